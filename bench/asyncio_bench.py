@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares awaiting deferreds directly with awaiting hand-rolled
+asyncio future wrappers.
+
+Usage: PYTHONPATH=src python bench/asyncio_bench.py [count]
+"""
+
+##
+# python standard library
+#
+import asyncio
+import sys
+import time
+
+##
+# promise modules
+#
+from promise import Deferred
+
+
+def wrap(deferred, loop):
+    """
+    Wraps deferred in asyncio future "by hand"
+    """
+    future = loop.create_future()
+    deferred.done(lambda *args, **kwargs: future.set_result(args[0]))
+    deferred.fail(lambda *args, **kwargs: future.set_exception(args[0]))
+    return future
+
+
+async def await_all(deferreds, loop, wrapped):
+    for deferred in deferreds:
+        if wrapped:
+            await wrap(deferred, loop)
+        else:
+            await deferred
+
+
+def run(count, wrapped, settled):
+    """
+    Returns time (in seconds) of awaiting "count" deferreds
+    """
+    loop = asyncio.new_event_loop()
+    deferreds = [Deferred() for i in range(0, count)]
+    if settled:
+        for deferred in deferreds:
+            deferred.resolve(1)
+    else:
+        for deferred in deferreds:
+            loop.call_soon(deferred.resolve, 1)
+    start = time.time()
+    loop.run_until_complete(await_all(deferreds, loop, wrapped))
+    elapsed = time.time() - start
+    loop.close()
+    return elapsed
+
+
+def main(count=100000):
+    print('%-30s %12s %12s' % ('scenario', 'wrapper [s]', 'await [s]'))
+    for settled in (False, True):
+        name = 'settled' if settled else 'settled by loop'
+        print('%-30s %12.4f %12.4f' % (name, run(count, True, settled),
+            run(count, False, settled)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
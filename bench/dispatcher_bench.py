@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures how long resolution of deferred with many subscribers blocks
+resolver when callbacks are called at once and when they are queued
+in Dispatcher, and how long single run of time-sliced Dispatcher takes.
+
+Usage: PYTHONPATH=src python bench/dispatcher_bench.py [subscribers] [budget]
+"""
+
+##
+# python standard library
+#
+import sys
+import time
+
+##
+# promise modules
+#
+from promise import CallbackList, Deferred, Dispatcher
+
+
+def callback(*args, **kwargs):
+    # few microseconds of work
+    sum(range(0, 200))
+
+
+def blocked(subscribers):
+    """
+    Returns time (in microseconds) resolution takes
+    """
+    d = Deferred()
+    for i in range(0, subscribers):
+        d.done(callback)
+    start = time.time()
+    d.resolve(1)
+    return (time.time() - start) * 1e6
+
+
+def slices(subscribers, budget):
+    """
+    Returns number of runs and time (in microseconds) of longest one
+    """
+    dispatcher = Dispatcher(budget)
+    CallbackList.dispatch = dispatcher
+    try:
+        blocked(subscribers)
+    finally:
+        CallbackList.dispatch = None
+    (runs, longest) = (0, 0)
+    while len(dispatcher):
+        start = time.time()
+        dispatcher.run()
+        longest = max(longest, time.time() - start)
+        runs += 1
+    return (runs, longest * 1e6)
+
+
+def main(subscribers=1000, budget=1000):
+    print('%-34s %12s' % ('scenario', 'time [us]'))
+    print('%-34s %12.1f' % ('inline resolve', blocked(subscribers)))
+    CallbackList.dispatch = Dispatcher(budget)
+    try:
+        print('%-34s %12.1f' % ('queued resolve', blocked(subscribers)))
+    finally:
+        CallbackList.dispatch = None
+    (runs, longest) = slices(subscribers, budget)
+    print('%-34s %12.1f' % ('longest of %d runs (%d us budget)' % (runs,
+        budget), longest))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures overhead of CallbackList error policies when no callback raises.
+
+Usage: PYTHONPATH=src python bench/errors_bench.py [number]
+"""
+
+##
+# python standard library
+#
+import sys
+import timeit
+
+##
+# promise modules
+#
+from promise import CallbackList, AGGREGATE
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def sink(callback, error):
+    pass
+
+
+def measure(callbacks, number):
+    """
+    Returns best time (in nanoseconds) of resolving list with
+    given number of callbacks
+    """
+    callbacks = [callback] * callbacks
+
+    def run():
+        CallbackList().done(*callbacks).resolve(1)
+    return min(timeit.repeat(run, number=number, repeat=3)) / number * 1e9
+
+
+def main(number=100000):
+    policies = [('propagate', None), ('aggregate', AGGREGATE),
+            ('sink', sink)]
+    print('%-15s' % 'callbacks [ns]' +
+            ''.join('%12s' % name for (name, policy) in policies))
+    for count in (1, 10, 100):
+        times = []
+        for (name, policy) in policies:
+            CallbackList.on_error = policy
+            times.append(measure(count, number // count))
+        CallbackList.on_error = None
+        print('%-15d' % count + ''.join('%12.1f' % t for t in times))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
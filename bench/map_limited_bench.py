@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares peak memory of "map_limited" with firing all calls at once
+through "when_all". Backend answers requests one by one, oldest first.
+
+Usage: PYTHONPATH=src python bench/map_limited_bench.py [max_exponent] [concurrency]
+"""
+
+##
+# python standard library
+#
+from collections import deque
+import sys
+import tracemalloc
+
+##
+# promise modules
+#
+from promise import Deferred, map_limited, when_all
+
+
+class Backend(object):
+    """
+    Answers requests in order they were made
+    """
+
+    def __init__(self):
+        self.pending = deque()
+
+    def request(self, item):
+        d = Deferred()
+        self.pending.append((d, item))
+        return d
+
+    def run(self):
+        while self.pending:
+            (d, item) = self.pending.popleft()
+            d.resolve(None)
+
+
+def limited(backend, size, concurrency):
+    return map_limited(backend.request, range(0, size), concurrency,
+            collect=False)
+
+
+def at_once(backend, size, concurrency):
+    return when_all(backend.request(i) for i in range(0, size))
+
+
+def peak(func, size, concurrency):
+    """
+    Returns peak memory (in bytes) allocated while mapping "size" items
+    """
+    backend = Backend()
+    tracemalloc.start()
+    p = func(backend, size, concurrency)
+    backend.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert p.resolved
+    return peak
+
+
+def main(max_exponent=6, concurrency=100):
+    print('%10s %16s %16s' % ('items', 'map_limited [B]', 'when_all [B]'))
+    for exponent in range(2, max_exponent + 1):
+        size = 10 ** exponent
+        print('%10d %16d %16d' % (size, peak(limited, size, concurrency),
+            peak(at_once, size, concurrency)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
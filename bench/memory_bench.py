@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures memory used by single Deferred object in its common states.
+
+Usage: PYTHONPATH=src python bench/memory_bench.py [count]
+"""
+
+##
+# python standard library
+#
+import sys
+import tracemalloc
+
+##
+# promise modules
+#
+from promise import Deferred
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+SCENARIOS = [
+    ('unresolved', lambda: Deferred()),
+    ('unresolved, 1 callback', lambda: Deferred().done(callback)),
+    ('unresolved, 2 callbacks', lambda: Deferred().then(callback, callback)),
+    ('resolved', lambda: Deferred().resolve(1)),
+    ('resolved, 1 callback', lambda: Deferred().done(callback).resolve(1)),
+]
+
+
+def measure(factory, count):
+    """
+    Returns number of bytes allocated (and retained) per object
+    """
+    objects = [None] * count
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(0, count):
+        objects[i] = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return float(after - before) / count
+
+
+def main(count=100000):
+    for (name, factory) in SCENARIOS:
+        print('%-30s %8.1f B' % (name, measure(factory, count)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
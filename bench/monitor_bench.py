@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures cost of creating, resolving and firing callbacks of deferreds
+with Monitor disabled and enabled.
+
+Usage: PYTHONPATH=src python bench/monitor_bench.py [count]
+"""
+
+##
+# python standard library
+#
+import sys
+import time
+
+##
+# promise modules
+#
+from promise import Deferred, Monitor
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def lifecycle(count):
+    """
+    Creates "count" deferreds, attaches callback and resolves them
+    """
+    for i in range(0, count):
+        Deferred().done(callback).resolve(i)
+
+
+def cost(func, count):
+    """
+    Returns time of single operation in microseconds
+    """
+    start = time.time()
+    func(count)
+    return (time.time() - start) / count * 1e6
+
+
+def main(count=1000000):
+    print('%-34s %10s' % ('scenario', 'us/op'))
+    print('%-34s %10.3f' % ('monitor disabled', cost(lifecycle, count)))
+    monitor = Monitor().enable()
+    try:
+        print('%-34s %10.3f' % ('monitor enabled', cost(lifecycle, count)))
+    finally:
+        monitor.disable()
+    metrics = monitor.metrics()
+    print('%-34s %10.3f' % ('callback p99', metrics['callback_time']['p99'] * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
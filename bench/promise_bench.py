@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares Promise view with legacy __getattr__-based proxy.
+
+Usage: PYTHONPATH=src python bench/promise_bench.py [number]
+"""
+
+##
+# python standard library
+#
+import sys
+import timeit
+
+##
+# promise modules
+#
+from promise import Deferred
+
+
+class LegacyPromise(object):
+    """
+    Promise as implemented before it became explicit view
+    """
+
+    def __init__(self, deferred):
+        self.__deferred = deferred
+
+    def __getattr__(self, name):
+        if name in ['resolve', 'reject', 'cancel']:
+            raise RuntimeError('Promise is read-only')
+        return getattr(self.__deferred, name)
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def measure(stmt, setup, number):
+    """
+    Returns best time (in nanoseconds) of single run of given statement
+    """
+    return min(timeit.repeat(stmt, setup, number=number, repeat=3,
+        globals=globals())) / number * 1e9
+
+
+# name, legacy statement, view statement, deferred; statements calling
+# "promise()" run with no promise held elsewhere
+SCENARIOS = [
+    ('attribute access (.done)', 'p.done', 'q.done', 'settled'),
+    ('done(callback) on settled', 'p.done(callback)', 'q.done(callback)',
+        'settled'),
+    ('promise(), pending', 'LegacyPromise(d)', 'd.promise()', 'pending'),
+    ('promise(), settled', 'LegacyPromise(d)', 'd.promise()', 'settled'),
+    ('promise().done(callback)', 'LegacyPromise(d).done(callback)',
+        'd.promise().done(callback)', 'settled'),
+    ('promise().state, pending', 'LegacyPromise(d).state',
+        'd.promise().state', 'pending'),
+]
+
+SETUP = {
+    'pending': 'd = Deferred(); p = LegacyPromise(d); q = d.promise()',
+    'settled': 'd = Deferred().resolve(1); p = LegacyPromise(d); '
+        'q = d.promise()',
+}
+
+
+def main(number=200000):
+    print('%-30s %12s %12s' % ('scenario [ns]', 'legacy', 'view'))
+    for (name, legacy, view, deferred) in SCENARIOS:
+        setup = SETUP[deferred]
+        if 'promise()' in view:
+            # no outstanding reference to cached promise
+            setup += '; del q'
+        print('%-30s %12.1f %12.1f' % (name,
+            measure(legacy, setup, number), measure(view, setup, number)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
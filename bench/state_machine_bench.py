@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares creating, subscribing and settling Deferred with implementation
+used before Deferred got its own state machine.
+
+Usage: PYTHONPATH=src python bench/state_machine_bench.py [number]
+"""
+
+##
+# python standard library
+#
+import sys
+import timeit
+
+##
+# promise modules
+#
+from promise import Deferred
+
+
+class LegacyCallbackList(object):
+    """
+    CallbackList as implemented before Deferred got its own state machine
+    """
+
+    def __init__(self):
+        self._callbacks = []
+        self._args = ()
+        self._kwargs = {}
+        self._resolved = False
+
+    def _fire(self, callbacks):
+        for callback in callbacks:
+            callback(*self._args, **self._kwargs)
+
+    def done(self, *args):
+        if self._callbacks is None:
+            return self
+        if self._resolved:
+            self._fire(args)
+        else:
+            self._callbacks.extend(args)
+        return self
+
+    def resolve(self, *args, **kwargs):
+        if self._callbacks is None or self._resolved:
+            return self
+        self._resolved = True
+        self._args = args
+        self._kwargs = kwargs
+        self._fire(self._callbacks)
+        return self
+
+    def cancel(self):
+        self._callbacks = None
+        return self
+
+
+class LegacyDeferred(object):
+    """
+    Deferred cancelling its callback lists with self-registered lambdas
+    """
+
+    def __init__(self):
+        self._done_callbacks = LegacyCallbackList()
+        self._fail_callbacks = LegacyCallbackList()
+        self.then(lambda *args, **kwargs: self._fail_callbacks.cancel(),
+                  lambda *args, **kwargs: self._done_callbacks.cancel())
+
+    def then(self, success, error):
+        self.done(success).fail(error)
+        return self
+
+    def done(self, *args):
+        self._done_callbacks.done(*args)
+        return self
+
+    def fail(self, *args):
+        self._fail_callbacks.done(*args)
+        return self
+
+    def resolve(self, *args, **kwargs):
+        self._done_callbacks.resolve(*args, **kwargs)
+        return self
+
+    def reject(self, *args, **kwargs):
+        self._fail_callbacks.resolve(*args, **kwargs)
+        return self
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def create_and_settle(cls, number):
+    """
+    Returns best time (in microseconds) of creating, subscribing
+    and settling single deferred of given class
+    """
+    def run():
+        cls().done(callback).resolve(1)
+        cls().fail(callback).reject(1)
+    return min(timeit.repeat(run, number=number, repeat=3)) / number / 2 * 1e6
+
+
+def main(number=20000):
+    before = create_and_settle(LegacyDeferred, number)
+    after = create_and_settle(Deferred, number)
+    print('create+settle [us]: before %.3f, after %.3f (%+.0f%%)' % (before,
+        after, (after / before - 1) * 100))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
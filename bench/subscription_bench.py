@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures cost of detaching callbacks from deferred with many subscribers:
+with "remove" (searches callback) and with Subscription returned
+by "subscribe".
+
+Usage: PYTHONPATH=src python bench/subscription_bench.py [max_exponent]
+"""
+
+##
+# python standard library
+#
+import sys
+import time
+
+##
+# promise modules
+#
+from promise import CallbackList
+
+
+def removed(size):
+    """
+    Attaches "size" callbacks and detaches them with "remove".
+    Returns time (in microseconds) per detached callback
+    """
+    callbacks = [lambda: None for i in range(0, size)]
+    cl = CallbackList().done(*callbacks)
+    start = time.time()
+    for callback in callbacks:
+        cl.remove(callback)
+    return (time.time() - start) / size * 1e6
+
+
+def unsubscribed(size):
+    """
+    Attaches "size" callbacks with "subscribe" and detaches them.
+    Returns time (in microseconds) per detached callback
+    """
+    cl = CallbackList()
+    subscriptions = [cl.subscribe(lambda: None) for i in range(0, size)]
+    start = time.time()
+    for subscription in subscriptions:
+        subscription.remove()
+    return (time.time() - start) / size * 1e6
+
+
+def main(max_exponent=5):
+    print('%10s %12s %14s' % ('callbacks', 'remove [us]', 'handle [us]'))
+    for exponent in range(1, max_exponent + 1):
+        size = 10 ** exponent
+        print('%10d %12.3f %14.3f' % (size, removed(size),
+            unsubscribed(size)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
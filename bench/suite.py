@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs microbenchmarks of hot paths (Deferred construction and resolution,
+callbacks attached to settled deferred, Promise attribute access and lookup,
+"when" with 10, 1k and 100k inputs) and measures memory used per object.
+Results are printed (or written) as JSON and, when baseline is given,
+compared with it: scenario slower (or bigger) than baseline by more than
+threshold is reported as regression and the run fails.
+
+Timings depend on machine and interpreter, so baseline has to be recorded
+(--save) on the machine it is compared on; it is not kept in repository.
+Comparison is skipped when baseline file does not exist yet.
+
+Usage: PYTHONPATH=src python bench/suite.py [--baseline FILE] [--save]
+    [--threshold 0.2] [--output FILE] [--scale 1.0] [--repeat 5]
+"""
+
+##
+# python standard library
+#
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+##
+# promise modules
+#
+from promise import Deferred, when
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+##
+# timed scenarios: name -> (prepare, operations)
+# "prepare(operations)" builds fixtures and returns function performing
+# given number of operations; only that function is timed
+#
+def construct(count):
+    def run():
+        for i in range(0, count):
+            Deferred()
+    return run
+
+
+def resolve(count):
+    deferreds = [Deferred() for i in range(0, count)]
+
+    def run():
+        for deferred in deferreds:
+            deferred.resolve(1)
+    return run
+
+
+def resolve_callback(count):
+    deferreds = [Deferred().done(callback) for i in range(0, count)]
+
+    def run():
+        for deferred in deferreds:
+            deferred.resolve(1)
+    return run
+
+
+def done_settled(count):
+    deferred = Deferred().resolve(1)
+
+    def run():
+        done = deferred.done
+        for i in range(0, count):
+            done(callback)
+    return run
+
+
+def promise_property(count):
+    promise = Deferred().promise()
+
+    def run():
+        for i in range(0, count):
+            promise.state
+    return run
+
+
+def promise_method(count):
+    promise = Deferred().promise()
+
+    def run():
+        for i in range(0, count):
+            promise.done
+    return run
+
+
+def promise_call(count):
+    deferred = Deferred()
+
+    def run():
+        # promise is not held between calls
+        promise = deferred.promise
+        for i in range(0, count):
+            promise().state
+    return run
+
+
+def fanin(inputs):
+    def prepare(count):
+        groups = [[Deferred() for i in range(0, inputs)]
+            for j in range(0, count)]
+
+        def run():
+            for deferreds in groups:
+                when(*deferreds).done(callback)
+                for deferred in deferreds:
+                    deferred.resolve(1)
+        return run
+    return prepare
+
+
+TIMED = [
+    ('Deferred()', construct, 200000),
+    ('resolve', resolve, 200000),
+    ('resolve, 1 callback', resolve_callback, 200000),
+    ('done on settled', done_settled, 200000),
+    ('Promise.state', promise_property, 200000),
+    ('Promise.done', promise_method, 200000),
+    ('promise(), not held', promise_call, 200000),
+    ('when, 10 inputs', fanin(10), 5000),
+    ('when, 1k inputs', fanin(1000), 50),
+    ('when, 100k inputs', fanin(100000), 1),
+]
+
+
+##
+# memory scenarios: name -> (factory, objects)
+#
+def when_input():
+    deferred = Deferred()
+    when(deferred)
+    return deferred
+
+
+MEMORY = [
+    ('Deferred, unresolved', Deferred, 100000),
+    ('Deferred, 1 callback', lambda: Deferred().done(callback), 100000),
+    ('Deferred, resolved', lambda: Deferred().resolve(1), 100000),
+    ('Promise', lambda: Deferred().promise(), 100000),
+    ('when, 1 pending input', when_input, 100000),
+]
+
+
+def timed(prepare, operations, repeat):
+    """
+    Returns best time of single operation in microseconds
+    """
+    best = None
+    for i in range(0, repeat):
+        # timeit disables garbage collector while timing
+        elapsed = timeit.Timer(prepare(operations)).timeit(1)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / operations * 1e6
+
+
+def allocated(factory, count):
+    """
+    Returns number of bytes allocated (and retained) per object
+    """
+    objects = [None] * count
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(0, count):
+        objects[i] = factory()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return float(after - before) / count
+
+
+def run(scale=1.0, repeat=5):
+    """
+    Runs all scenarios and returns report
+    """
+    results = {}
+    for (name, prepare, operations) in TIMED:
+        operations = max(1, int(operations * scale))
+        results[name] = {'value': timed(prepare, operations, repeat),
+            'unit': 'us'}
+    if tracemalloc is not None:
+        for (name, factory, count) in MEMORY:
+            count = max(1, int(count * scale))
+            results['memory: ' + name] = {
+                'value': allocated(factory, count), 'unit': 'B'}
+    return {'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results}
+
+
+def compare(report, baseline, threshold):
+    """
+    Returns list of (name, baseline, current) of scenarios slower (bigger)
+    than baseline by more than threshold (fraction of baseline)
+    """
+    regressions = []
+    previous = baseline['results']
+    for (name, result) in sorted(report['results'].items()):
+        if name not in previous:
+            continue
+        before = previous[name]['value']
+        if result['value'] > before * (1 + threshold):
+            regressions.append((name, before, result['value']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='promise microbenchmarks')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--save', action='store_true',
+        help='store report as baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='allowed slowdown, fraction of baseline (default: 0.2)')
+    parser.add_argument('--output', help='file to write JSON report to')
+    parser.add_argument('--scale', type=float, default=1.0,
+        help='multiplier of number of operations (default: 1.0)')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='number of timed runs, best is reported (default: 5)')
+    args = parser.parse_args(argv)
+
+    report = run(args.scale, args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+
+    if not args.baseline:
+        return 0
+    if args.save:
+        with open(args.baseline, 'w') as output:
+            output.write(text + '\n')
+        return 0
+    if not os.path.exists(args.baseline):
+        sys.stderr.write('no baseline %s, record it with --save '
+            '(make bench_baseline)\n' % args.baseline)
+        return 0
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    regressions = compare(report, baseline, args.threshold)
+    for (name, before, after) in regressions:
+        sys.stderr.write('regression: %s %.3f -> %.3f (+%.0f%%)\n' % (name,
+            before, after, (after / before - 1) * 100))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
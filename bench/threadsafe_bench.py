@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares throughput of ThreadSafeDeferred with single-threaded Deferred.
+
+Usage: PYTHONPATH=src python bench/threadsafe_bench.py [count] [threads]
+"""
+
+##
+# python standard library
+#
+import sys
+import threading
+import time
+
+##
+# promise modules
+#
+from promise import Deferred, ThreadSafeDeferred
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def settle(cls, count):
+    """
+    Creates, subscribes and resolves "count" deferreds
+    """
+    for i in range(0, count):
+        cls().done(callback).resolve(i)
+
+
+def done_on_settled(cls, count):
+    """
+    Attaches "count" callbacks to settled deferred
+    """
+    d = cls().resolve(1)
+    for i in range(0, count):
+        d.done(callback)
+
+
+def hammer(cls, count, threads):
+    """
+    Resolves "count" deferreds each attached to from "threads" threads
+    """
+    deferreds = [cls() for i in range(0, count)]
+
+    def attach():
+        for d in deferreds:
+            d.done(callback)
+
+    workers = [threading.Thread(target=attach) for i in range(0, threads)]
+    for worker in workers:
+        worker.start()
+    for d in deferreds:
+        d.resolve(1)
+    for worker in workers:
+        worker.join()
+
+
+def throughput(func, *args):
+    """
+    Returns number of operations per second
+    """
+    start = time.time()
+    func(*args)
+    return args[1] / (time.time() - start)
+
+
+def main(count=200000, threads=4):
+    print('%-30s %14s %14s' % ('scenario [ops/s]', 'Deferred',
+        'ThreadSafe'))
+    for (name, func, args) in [
+            ('create+done+resolve', settle, (count, )),
+            ('done on settled', done_on_settled, (count, ))]:
+        print('%-30s %14d %14d' % (name, throughput(func, Deferred, *args),
+            throughput(func, ThreadSafeDeferred, *args)))
+    print('%-30s %14s %14d' % ('%d threads attaching' % threads, '-',
+        throughput(hammer, ThreadSafeDeferred, count, threads) * threads))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
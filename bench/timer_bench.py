@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures cost of arming and cancelling timeouts served by TimerWheel
+compared with one threading.Timer per timeout.
+
+Usage: PYTHONPATH=src python bench/timer_bench.py [count] [threads]
+"""
+
+##
+# python standard library
+#
+import sys
+import threading
+import time
+
+##
+# promise modules
+#
+from promise import Deferred, TimerWheel
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def wheel_arm_cancel(count):
+    """
+    Arms and cancels "count" timers in single wheel
+    """
+    wheel = TimerWheel()
+    timers = [wheel.schedule(30, callback) for i in range(0, count)]
+    for timer in timers:
+        timer.cancel()
+    wheel.advance()
+
+
+def deferred_timeout(count):
+    """
+    Creates "count" deferreds with timeout and resolves them in time
+    """
+    wheel = TimerWheel()
+    deferreds = [Deferred().timeout(30, wheel) for i in range(0, count)]
+    for d in deferreds:
+        d.resolve(1)
+
+
+def thread_timers(count):
+    """
+    Arms and cancels "count" threading.Timer objects
+    """
+    timers = [threading.Timer(30, callback) for i in range(0, count)]
+    for timer in timers:
+        timer.start()
+    for timer in timers:
+        timer.cancel()
+    for timer in timers:
+        timer.join()
+
+
+def cost(func, count):
+    """
+    Returns time of single operation in microseconds
+    """
+    start = time.time()
+    func(count)
+    return (time.time() - start) / count * 1e6
+
+
+def main(count=1000000, threads=2000):
+    print('%-34s %10s' % ('scenario', 'us/op'))
+    print('%-34s %10.3f' % ('wheel arm+cancel (%d)' % count,
+        cost(wheel_arm_cancel, count)))
+    print('%-34s %10.3f' % ('Deferred.timeout+resolve (%d)' % count,
+        cost(deferred_timeout, count)))
+    print('%-34s %10.3f' % ('threading.Timer (%d)' % threads,
+        cost(thread_timers, threads)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
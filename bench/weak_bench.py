@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures memory held by long-lived deferred while many short-lived
+subscribers attach bound methods with "done" and with "done_weak".
+
+Usage: PYTHONPATH=src python bench/weak_bench.py [subscribers]
+"""
+
+##
+# python standard library
+#
+import sys
+import time
+import tracemalloc
+
+##
+# promise modules
+#
+from promise import Deferred
+
+
+class Subscriber(object):
+    """
+    Short-lived request handler with buffer
+    """
+
+    def __init__(self):
+        self.buffer = bytearray(1000)
+
+    def handle(self, *args):
+        pass
+
+
+def subscribe(attach, subscribers):
+    """
+    Returns time (in microseconds) per subscriber and peak memory (in MB)
+    """
+    d = Deferred()
+    attach = getattr(d, attach)
+    tracemalloc.start()
+    start = time.time()
+    for i in range(0, subscribers):
+        attach(Subscriber().handle)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (elapsed / subscribers * 1e6, peak / 1e6)
+
+
+def main(subscribers=1000000):
+    print('%-12s %12s %12s' % ('method', 'us/op', 'peak [MB]'))
+    for attach in ('done', 'done_weak'):
+        print('%-12s %12.3f %12.1f' % ((attach, ) +
+            subscribe(attach, subscribers)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
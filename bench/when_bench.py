@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures how "when" scales with number of input deferreds (with responses
+passed as usual or collected in Results object) and how fast it handles
+batches of mostly immediate values.
+
+Usage: PYTHONPATH=src python bench/when_bench.py [max_exponent]
+"""
+
+##
+# python standard library
+#
+import sys
+import time
+from functools import partial
+
+##
+# promise modules
+#
+from promise import Deferred, when_all
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def run(size, results=False):
+    """
+    Resolves "size" deferreds combined with "when_all", passes responses
+    to two callbacks. Returns time (in seconds) spent in "when_all"
+    and resolution
+    """
+    inputs = [Deferred() for i in range(0, size)]
+    start = time.time()
+    p = when_all(inputs, results=results).done(callback, callback)
+    for (i, d) in enumerate(inputs):
+        d.resolve(i)
+    elapsed = time.time() - start
+    assert p.resolved
+    return elapsed
+
+
+def mixed(size):
+    """
+    Combines "size" inputs, every tenth of them being deferred.
+    Returns time (in seconds) spent in "when_all"
+    """
+    inputs = [Deferred(i) if not i % 10 else i for i in range(0, size)]
+    start = time.time()
+    p = when_all(inputs)
+    elapsed = time.time() - start
+    assert p.resolved
+    return elapsed
+
+
+def main(max_exponent=6):
+    for (name, func) in [('deferreds', run),
+            ('results', partial(run, results=True)), ('90% values', mixed)]:
+        print('%10s %12s %16s' % (name, 'total [s]', 'per input [us]'))
+        for exponent in range(1, max_exponent + 1):
+            size = 10 ** exponent
+            elapsed = func(size)
+            print('%10d %12.4f %16.3f' % (size, elapsed,
+                elapsed / size * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
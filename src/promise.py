@@ -8,10 +8,321 @@ Open source (New BSD License) Python Promise implementation.
 Author: Michał Bachowski
 """
 
-from functools import partial
+from collections import deque, OrderedDict
+from functools import partial, update_wrapper
+from itertools import count, islice
+import heapq
+import math
+import random
+import sys
+import threading
+from types import MethodType
+import weakref
 
+try:
+    from time import monotonic as _monotonic, perf_counter as _perf_counter
+except ImportError:  # python < 3.3
+    from time import time as _monotonic, time as _perf_counter
 
-__all__ = ['Deferred', 'Promise', 'when']
+try:
+    import asyncio
+except ImportError:  # python < 3.4
+    asyncio = None
+
+# returns loop running in current thread (or None); missing before
+# python 3.5.3, futures are always settled through loop then
+_running_loop = getattr(asyncio, '_get_running_loop', None)
+
+try:
+    from concurrent import futures
+except ImportError:  # python 2 without "futures" package
+    futures = None
+
+
+__all__ = ['Deferred', 'Promise', 'when', 'when_all', 'when_any', 'when_race',
+           'when_some', 'PENDING', 'RESOLVED', 'REJECTED', 'CANCELLED',
+           'RejectedError', 'ThreadSafeDeferred', 'ThreadSafeCallbackList',
+           'AGGREGATE', 'CallbackError', 'DeferredTimeoutError', 'TimerWheel',
+           'Timer', 'register_thenable', 'as_completed', 'map_limited',
+           'BatchLoader', 'DeferredCache', 'cached_deferred', 'retry',
+           'RetryBudget', 'Monitor', 'Histogram', 'Exporter', 'Results',
+           'Dispatcher', 'priority', 'Subscription']
+
+
+# states of CallbackList and Deferred objects
+PENDING = 'pending'
+RESOLVED = 'resolved'
+REJECTED = 'rejected'
+CANCELLED = 'cancelled'
+
+# error policy of CallbackList: fire all callbacks, then raise CallbackError
+AGGREGATE = 'aggregate'
+
+# shared by all objects resolved without keyword arguments (never modified)
+_NO_KWARGS = {}
+
+# per-thread queue of calls made while other call is run by _trampoline
+_local = threading.local()
+
+
+def _trampoline(func, *args):
+    """
+    Calls given function. Calls made from within are queued and run by the
+    outermost call one after another, so synchronous cascades (e.g. long
+    chains of deferreds) do not grow the stack.
+    """
+    queue = getattr(_local, 'queue', None)
+    if queue is not None:
+        queue.append((func, args))
+        return
+    queue = _local.queue = deque([(func, args)])
+    error = None
+    try:
+        while queue:
+            (func, args) = queue.popleft()
+            # keep going on error, so none of queued calls is lost
+            try:
+                func(*args)
+            except Exception as e:
+                if error is None:
+                    error = e
+    except BaseException:
+        # interrupted (e.g. KeyboardInterrupt): propagate at once, calls
+        # still queued are dropped, later ones must not be queued forever
+        _local.queue = None
+        raise
+    _local.queue = None
+    if error is not None:
+        raise error
+
+
+class RejectedError(Exception):
+    """
+    Raised when awaited deferred was rejected with anything but exception.
+    Holds arguments of rejection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Object initialization
+        """
+        Exception.__init__(self, *args)
+        self.kwargs = kwargs
+
+
+class CallbackError(Exception):
+    """
+    Raised once all callbacks were fired when some of them raised.
+    Holds list of (callback, exception) pairs.
+    """
+
+    def __init__(self, errors):
+        """
+        Object initialization
+        """
+        Exception.__init__(self, errors)
+        self.errors = errors
+
+
+try:
+    _TimeoutError = TimeoutError
+except NameError:  # python 2
+    _TimeoutError = EnvironmentError
+
+
+class DeferredTimeoutError(_TimeoutError):
+    """
+    Deferred is rejected with it when it was not settled in time
+    """
+
+
+def _value(args, kwargs):
+    """
+    Converts arguments of resolution into single value
+    """
+    if kwargs:
+        return (args, kwargs)
+    if len(args) == 1:
+        return args[0]
+    return args or None
+
+
+def _error(args, kwargs):
+    """
+    Converts arguments of rejection into exception
+    """
+    if len(args) == 1 and not kwargs and isinstance(args[0], BaseException):
+        return args[0]
+    return RejectedError(*args, **kwargs)
+
+
+def _weak_died(entries, ref):
+    """
+    Counts dead (weak or removed) entry of given callback storage
+    """
+    entries = entries()
+    if entries is not None:
+        entries.dead += 1
+
+
+def _internal(callback):
+    """
+    Checks whether callback was attached internally, to cancel timer
+    of "timeout"
+    """
+    return type(callback) is MethodType and type(callback.__self__) is Timer
+
+
+class _Entries(list):
+    """
+    Storage of callbacks used once weak callbacks or subscriptions are
+    attached: counts weak callbacks which referents are gone and removed
+    subscriptions (tombstones), so they can be dropped before storage
+    grows too much
+    """
+
+    __slots__ = ('dead', 'died', '__weakref__')
+
+    def __init__(self, callbacks=()):
+        """
+        Object initialization
+        """
+        list.__init__(self, callbacks)
+        self.dead = 0
+        # shared by all weak entries; refers storage weakly, so there is
+        # no reference cycle
+        self.died = partial(_weak_died, weakref.ref(self))
+
+    def compact(self):
+        """
+        Drops dead weak callbacks and removed subscriptions, keeps order
+        of remaining ones
+        """
+        self[:] = [callback for callback in self
+                if (type(callback) is not _WeakCallback and
+                    type(callback) is not Subscription) or callback.alive]
+        self.dead = 0
+
+
+class _WeakCallback(object):
+    """
+    Callback held by weak reference: bound method is held by weak reference
+    to its object, other callables by weak reference to themselves.
+    Does nothing once referent is gone.
+    """
+
+    __slots__ = ('ref', 'func')
+
+    def __init__(self, callback, died):
+        """
+        Object initialization
+        """
+        if type(callback) is MethodType and callback.__self__ is not None:
+            # bound method is created on each attribute access,
+            # so hold its object instead
+            self.ref = weakref.ref(callback.__self__, died)
+            self.func = callback.__func__
+        else:
+            self.ref = weakref.ref(callback, died)
+            self.func = None
+
+    @property
+    def alive(self):
+        """
+        Checks whether referent still exists
+        """
+        return self.ref() is not None
+
+    def __call__(self, *args, **kwargs):
+        """
+        Calls callback unless it is gone
+        """
+        obj = self.ref()
+        if obj is None:
+            return
+        if self.func is None:
+            return obj(*args, **kwargs)
+        return self.func(obj, *args, **kwargs)
+
+    def __eq__(self, other):
+        """
+        Equals callback it holds (so it may be removed like other callbacks)
+        """
+        obj = self.ref()
+        if obj is None:
+            return False
+        if self.func is None:
+            return obj == other
+        return getattr(other, '__self__', None) is obj and \
+            getattr(other, '__func__', None) is self.func
+
+    def __ne__(self, other):
+        """
+        Opposite of __eq__ (needed by python 2)
+        """
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+
+class Subscription(object):
+    """
+    Callback attached with "subscribe". "remove" detaches it in O(1):
+    callback is released at once, its slot is left as tombstone skipped
+    on resolution and dropped as other callbacks are attached.
+    """
+
+    __slots__ = ('callback', 'died')
+
+    def __init__(self, callback, died=None):
+        """
+        Object initialization
+        """
+        self.callback = callback
+        self.died = died
+
+    @property
+    def alive(self):
+        """
+        Checks whether callback is still attached (and, when held by weak
+        reference, still exists)
+        """
+        callback = self.callback
+        return callback is not None and \
+            (type(callback) is not _WeakCallback or callback.alive)
+
+    def remove(self):
+        """
+        Detaches callback
+        """
+        alive = self.alive
+        self.callback = None
+        if alive and self.died is not None:
+            self.died(None)
+        self.died = None
+        return self
+
+    def __call__(self, *args, **kwargs):
+        """
+        Calls callback unless it was removed
+        """
+        callback = self.callback
+        if callback is not None:
+            return callback(*args, **kwargs)
+
+    def __eq__(self, other):
+        """
+        Equals callback it holds (so it may be removed like other callbacks)
+        """
+        return self.callback is not None and self.callback == other
+
+    def __ne__(self, other):
+        """
+        Opposite of __eq__ (needed by python 2)
+        """
+        return not self.__eq__(other)
+
+    __hash__ = None
 
 
 class CallbackList(object):
@@ -20,84 +331,375 @@ class CallbackList(object):
     If callback will be attached after resolvement will fire immediately
     """
 
+    # callbacks are stored as None (no callbacks), callback itself (just one)
+    # or list of callbacks; arguments are set on resolution
+    __slots__ = ('_callbacks', '_args', '_kwargs', '_state')
+
+    # when set, resolutions made from within callbacks are queued and fired
+    # by the outermost resolution, so stack depth does not depend
+    # on length of synchronous cascade
+    trampoline = False
+
+    # what to do when callback raises: None - stop firing and propagate error,
+    # AGGREGATE - fire remaining callbacks and raise CallbackError,
+    # callable - fire remaining callbacks and pass (callback, error) to it
+    on_error = None
+
+    # Monitor measuring callbacks (see Monitor.enable)
+    monitor = None
+
+    # None - call callbacks at once, in stack of resolver; callable
+    # (e.g. loop.call_soon or Dispatcher) - pass (callback, *args) to it
+    dispatch = None
+
     def __init__(self):
         """
         Object initialization
         """
-        self._callbacks = []
-        self._args = ()
-        self._kwargs = {}
-        self._resolved = False
+        self._callbacks = None
+        self._state = PENDING
 
     def _fire(self, callbacks):
         """
         Fires given callbacks
         """
+        if self.dispatch is not None:
+            self._dispatch(callbacks)
+            return
+        if self.monitor is not None:
+            self._fire_measured(callbacks)
+            return
+        args = self._args
+        kwargs = self._kwargs
+        # looked up in class, so functions do not become methods
+        if type(self).on_error is None:
+            # most resolutions have no keyword arguments, skip unpacking them
+            if kwargs is _NO_KWARGS:
+                for callback in callbacks:
+                    callback(*args)
+            else:
+                for callback in callbacks:
+                    callback(*args, **kwargs)
+            return
+        errors = None
+        for callback in callbacks:
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                if errors is None:
+                    errors = []
+                errors.append((callback, e))
+        if errors is not None:
+            self._failed(errors)
+
+    def _dispatch(self, callbacks):
+        """
+        Passes given callbacks to "dispatch"; when "on_error" policy
+        or monitor is set, callbacks are wrapped to honour them
+        """
+        args = self._args
+        kwargs = self._kwargs
+        # looked up in class, so functions do not become methods
+        dispatch = type(self).dispatch
+        on_error = type(self).on_error
+        monitor = self.monitor
+        for callback in callbacks:
+            if on_error is not None or monitor is not None:
+                guarded = _Guarded(callback, kwargs, on_error, monitor)
+                if type(callback) is _Prioritized:
+                    guarded = _Prioritized(guarded, callback.priority)
+                dispatch(guarded, *args)
+                continue
+            if kwargs is not _NO_KWARGS:
+                # dispatch targets (e.g. loop.call_soon) take no kwargs
+                callback = _bind_kwargs(callback, kwargs)
+            dispatch(callback, *args)
+
+    def _fire_measured(self, callbacks):
+        """
+        Fires given callbacks, reports time of each of them to monitor
+        """
+        args = self._args
+        kwargs = self._kwargs
+        monitor = self.monitor
+        on_error = type(self).on_error
+        errors = None
         for callback in callbacks:
-            callback(*self._args, **self._kwargs)
+            start = _perf_counter()
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                monitor.callback(callback, _perf_counter() - start, e)
+                if on_error is None:
+                    raise
+                if errors is None:
+                    errors = []
+                errors.append((callback, e))
+                continue
+            monitor.callback(callback, _perf_counter() - start, None)
+        if errors is not None:
+            self._failed(errors)
+
+    def _failed(self, errors):
+        """
+        Handles errors raised by callbacks according to "on_error" policy
+        """
+        on_error = type(self).on_error
+        if on_error == AGGREGATE:
+            raise CallbackError(errors)
+        for (callback, error) in errors:
+            on_error(callback, error)
 
     def done(self, *args):
         """
         Attaches given callback (or callbacks)
         """
-        if self.cancelled:
+        state = self._state
+        if state is RESOLVED:
+            # resolution still queued? keep order of callbacks
+            if self._callbacks is None:
+                self._fire(args)
+            else:
+                self._callbacks.extend(args)
+        elif state is PENDING and args:
+            callbacks = self._callbacks
+            if callbacks is None:
+                if len(args) == 1 and type(args[0]) is not list:
+                    self._callbacks = args[0]
+                else:
+                    self._callbacks = list(args)
+            elif type(callbacks) is list or type(callbacks) is _Entries:
+                callbacks.extend(args)
+            else:
+                self._callbacks = [callbacks]
+                self._callbacks.extend(args)
+        return self
+
+    def done_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) held by weak reference:
+        callback is dropped once it (or object of bound method) is gone.
+        Callbacks that will be fired at once are held strongly.
+        """
+        if self._state is not PENDING:
+            return self.done(*args)
+        if not args:
             return self
-        if self._resolved:
-            self._fire(args)
-        else:
-            self._callbacks.extend(args)
+        callbacks = self._entries()
+        died = callbacks.died
+        for callback in args:
+            callbacks.append(_WeakCallback(callback, died))
+        return self
+
+    def subscribe(self, callback, weak=False):
+        """
+        Attaches given callback (held by weak reference when "weak" is set,
+        see "done_weak"), returns Subscription that detaches it.
+        Callback that is fired at once gets subscription that is already
+        removed.
+        """
+        if self._state is not PENDING:
+            self.done(callback)
+            return Subscription(None)
+        callbacks = self._entries()
+        if weak:
+            callback = _WeakCallback(callback, callbacks.died)
+        subscription = Subscription(callback, callbacks.died)
+        callbacks.append(subscription)
+        return subscription
+
+    def _entries(self):
+        """
+        Returns storage of callbacks able to count dead entries
+        """
+        callbacks = self._callbacks
+        if type(callbacks) is not _Entries:
+            if callbacks is None:
+                callbacks = _Entries()
+            elif type(callbacks) is list:
+                callbacks = _Entries(callbacks)
+            else:
+                callbacks = _Entries((callbacks, ))
+            self._callbacks = callbacks
+        # drop dead callbacks once they make half of storage, so it stays
+        # bounded by number of live callbacks (amortized O(1) per callback)
+        elif callbacks.dead * 2 > len(callbacks):
+            callbacks.compact()
+        return callbacks
+
+    def remove(self, *args):
+        """
+        Detaches given callback (or callbacks)
+        """
+        # already fired (or cancelled) callbacks will never be called again
+        if self._state is not PENDING:
+            return self
+        for callback in args:
+            callbacks = self._callbacks
+            if type(callbacks) is _Entries:
+                self._remove_entry(callbacks, callback)
+            elif type(callbacks) is list:
+                try:
+                    callbacks.remove(callback)
+                except ValueError:
+                    pass
+            elif callbacks is not None and callbacks == callback:
+                self._callbacks = None
         return self
 
+    def _remove_entry(self, entries, callback):
+        """
+        Detaches given callback from storage of entries
+        """
+        for (index, entry) in enumerate(entries):
+            if entry == callback:
+                # subscription is left as tombstone and counted as dead
+                # once, so its own "remove" does nothing later
+                if type(entry) is Subscription:
+                    entry.remove()
+                else:
+                    del entries[index]
+                return
+
     def resolve(self, *args, **kwargs):
         """
         Resolves callback with given attributes
         """
-        if self.cancelled:
+        if self._state is not PENDING:
             return self
-        if self.resolved:
-            return self
-        self._resolved = True
+        self._state = RESOLVED
         self._args = args
-        self._kwargs = kwargs
-        self._fire(self._callbacks)
+        self._kwargs = kwargs or _NO_KWARGS
+        # callbacks are not needed once fired - release them
+        callbacks = self._callbacks
+        if callbacks is None:
+            return self
+        if self.trampoline:
+            if type(callbacks) is not list and type(callbacks) is not _Entries:
+                self._callbacks = [callbacks]
+            _trampoline(self._drain)
+            return self
+        self._callbacks = None
+        if type(callbacks) is not list and type(callbacks) is not _Entries:
+            callbacks = (callbacks, )
+        self._fire(callbacks)
         return self
 
+    def _drain(self):
+        """
+        Fires queued callbacks, including ones attached in the meantime
+        """
+        callbacks = self._callbacks
+        if callbacks is None:
+            return
+        try:
+            self._fire(callbacks)
+        finally:
+            self._callbacks = None
+
     def cancel(self):
         """
         Terminates resolution
         """
         self._callbacks = None
+        self._state = CANCELLED
         return self
 
+    @property
+    def empty(self):
+        """
+        Checks whether there are no callbacks waiting to be fired
+        """
+        callbacks = self._callbacks
+        if type(callbacks) is _Entries:
+            return len(callbacks) == callbacks.dead
+        return callbacks is None or (type(callbacks) is list and
+                not callbacks)
+
+    def _subscribed(self):
+        """
+        Checks whether callbacks other than internal ones (cancelling
+        timers of "timeout") wait to be fired
+        """
+        callbacks = self._callbacks
+        if callbacks is None:
+            return False
+        if type(callbacks) is not list and type(callbacks) is not _Entries:
+            return not _internal(callbacks)
+        for callback in callbacks:
+            if _internal(callback):
+                continue
+            if (type(callback) is _WeakCallback or
+                    type(callback) is Subscription) and not callback.alive:
+                continue
+            return True
+        return False
+
+    @property
+    def state(self):
+        """
+        Returns current state (PENDING, RESOLVED or CANCELLED)
+        """
+        return self._state
+
     @property
     def cancelled(self):
         """
         Checkes whether resolution was cancelled
         """
-        return self._callbacks is None
+        return self._state is CANCELLED
 
     @property
     def resolved(self):
         """
         Returns resolution status
         """
-        return self._resolved
+        return self._state is RESOLVED
+
+
+# shared (already fired) list of "on_cancel" callbacks of cancelled deferreds
+_CANCELLED = CallbackList().resolve()
 
 
 class Deferred(object):
     """
     Deferred object
+
+    Each deferred starts as PENDING and is moved (just once) either to
+    RESOLVED or REJECTED state by "resolve" or "reject" respectively.
+    State is switched before any callback is called, so callbacks see
+    deferred already settled. Cancellation moves deferred to CANCELLED
+    state from any other state.
+
+    Cancellation of pending deferred propagates: "on_cancel" callbacks are
+    called (e.g. to abort work of producer), deferred derived with
+    "then(..., chain=True)" detaches from its parent and cancels it when
+    nothing else is attached to it, combinators ("when" etc.) do the same
+    with their inputs.
     """
 
+    # callback lists are created on demand; once deferred is settled
+    # list of the other kind (and list of "on_cancel" callbacks) is dropped
+    __slots__ = ('_state', '_done_callbacks', '_fail_callbacks',
+            '_cancel_callbacks', '_promise', '__weakref__')
+
+    # class of callback lists
+    callback_list = CallbackList
+
+    # Monitor observing deferreds (see Monitor.enable)
+    monitor = None
+
     def __init__(self, func=None, *args, **kwargs):
         """
         Object initialization
         """
-        self._done_callbacks = CallbackList()
-        self._fail_callbacks = CallbackList()
-        # if either resolve or reject is called cancel both
-        self.then(lambda *args, **kwargs: self._fail_callbacks.cancel(),
-                  lambda *args, **kwargs: self._done_callbacks.cancel())
+        self._state = PENDING
+        self._done_callbacks = None
+        self._fail_callbacks = None
+        self._cancel_callbacks = None
+        self._promise = None
+        if self.monitor is not None:
+            self.monitor.created(self)
         # if function was not provided - skip
         if func is None:
             return
@@ -108,25 +710,53 @@ class Deferred(object):
         else:
             self.resolve(func)
 
-    def then(self, success, error):
+    def then(self, success, error, chain=False):
         """
-        Convenient wrapper for self.done() and self.fail() subsequent calls
+        Convenient wrapper for self.done() and self.fail() subsequent calls.
+
+        With "chain" set returns new (derived) deferred instead of self.
+        Derived deferred is resolved with value returned by callback
+        (or adopts state of returned Deferred or Promise) and is rejected
+        with exception raised by callback. When callback is None state
+        of this deferred is passed to derived one as is.
         """
-        self.done(success).fail(error)
-        return self
+        if not chain:
+            self.done(success).fail(error)
+            return self
+        stage = _Stage(self, self.__class__(), success, error)
+        self.done(stage).fail(stage.rejected)
+        stage.derived.on_cancel(stage.cancelled)
+        return stage.derived
 
     def done(self, *args):
         """
         Attaches given callback (or callbacks) to successful resolution
         """
-        self._done_callbacks.done(*args)
+        state = self._state
+        if state is PENDING or state is RESOLVED:
+            callbacks = self._done_callbacks
+            if callbacks is None:
+                callbacks = self._done_callbacks = self.callback_list()
+            callbacks.done(*args)
         return self
 
     def resolve(self, *args, **kwargs):
         """
         Resolves defferred positively
         """
-        self._done_callbacks.resolve(*args, **kwargs)
+        if self._state is not PENDING:
+            return self
+        self._state = RESOLVED
+        self._fail_callbacks = None
+        self._cancel_callbacks = None
+        if self._promise is not None:
+            self._unpin()
+        if self.monitor is not None:
+            self.monitor.settled(self)
+        callbacks = self._done_callbacks
+        if callbacks is None:
+            callbacks = self._done_callbacks = self.callback_list()
+        callbacks.resolve(*args, **kwargs)
         return self
 
     @property
@@ -134,20 +764,90 @@ class Deferred(object):
         """
         Returns resolution status
         """
-        return self._done_callbacks.resolved
+        return self._state is RESOLVED
 
     def fail(self, *args):
         """
         Attaches given callback (or callbacks) to rejected resolution
         """
-        self._fail_callbacks.done(*args)
+        state = self._state
+        if state is PENDING or state is REJECTED:
+            callbacks = self._fail_callbacks
+            if callbacks is None:
+                callbacks = self._fail_callbacks = self.callback_list()
+            callbacks.done(*args)
+        return self
+
+    def done_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to successful resolution,
+        holds it by weak reference (see CallbackList.done_weak).
+        Deferred does not keep callback (or object of bound method) alive.
+        """
+        state = self._state
+        if state is PENDING or state is RESOLVED:
+            callbacks = self._done_callbacks
+            if callbacks is None:
+                callbacks = self._done_callbacks = self.callback_list()
+            callbacks.done_weak(*args)
         return self
 
+    def fail_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to rejected resolution,
+        holds it by weak reference (see CallbackList.done_weak)
+        """
+        state = self._state
+        if state is PENDING or state is REJECTED:
+            callbacks = self._fail_callbacks
+            if callbacks is None:
+                callbacks = self._fail_callbacks = self.callback_list()
+            callbacks.done_weak(*args)
+        return self
+
+    def subscribe(self, callback, weak=False):
+        """
+        Attaches given callback to successful resolution, returns
+        Subscription which "remove" detaches it in O(1)
+        """
+        state = self._state
+        if state is PENDING or state is RESOLVED:
+            callbacks = self._done_callbacks
+            if callbacks is None:
+                callbacks = self._done_callbacks = self.callback_list()
+            return callbacks.subscribe(callback, weak)
+        return Subscription(None)
+
+    def subscribe_fail(self, callback, weak=False):
+        """
+        Attaches given callback to rejected resolution, returns
+        Subscription which "remove" detaches it in O(1)
+        """
+        state = self._state
+        if state is PENDING or state is REJECTED:
+            callbacks = self._fail_callbacks
+            if callbacks is None:
+                callbacks = self._fail_callbacks = self.callback_list()
+            return callbacks.subscribe(callback, weak)
+        return Subscription(None)
+
     def reject(self, *args, **kwargs):
         """
         Resolves defferred negatively
         """
-        self._fail_callbacks.resolve(*args, **kwargs)
+        if self._state is not PENDING:
+            return self
+        self._state = REJECTED
+        self._done_callbacks = None
+        self._cancel_callbacks = None
+        if self._promise is not None:
+            self._unpin()
+        if self.monitor is not None:
+            self.monitor.settled(self)
+        callbacks = self._fail_callbacks
+        if callbacks is None:
+            callbacks = self._fail_callbacks = self.callback_list()
+        callbacks.resolve(*args, **kwargs)
         return self
 
     @property
@@ -155,75 +855,3089 @@ class Deferred(object):
         """
         Returns resolution status
         """
-        return self._fail_callbacks.resolved
+        return self._state is REJECTED
 
     def cancel(self):
         """
-        Cancels deferred
+        Cancels deferred. When deferred was pending calls "on_cancel"
+        callbacks.
+        """
+        callbacks = self._cancel()
+        if callbacks is not None:
+            callbacks.resolve()
+        return self
+
+    def _cancel(self):
+        """
+        Switches deferred to CANCELLED state, releases callbacks.
+        Returns list of "on_cancel" callbacks to be called (if any).
         """
-        self._done_callbacks.cancel()
-        self._fail_callbacks.cancel()
+        callbacks = None
+        if self._state is PENDING:
+            callbacks = self._cancel_callbacks
+            # "on_cancel" callbacks attached from now on are called at once
+            self._cancel_callbacks = _CANCELLED
+            if self.monitor is not None:
+                self.monitor.cancelled(self)
+        self._state = CANCELLED
+        self._done_callbacks = None
+        self._fail_callbacks = None
+        if self._promise is not None:
+            self._unpin()
+        return callbacks
+
+    def on_cancel(self, *args):
+        """
+        Attaches given callback (or callbacks) called (without arguments)
+        when pending deferred is cancelled, e.g. to abort work of producer
+        """
+        state = self._state
+        if state is PENDING or state is CANCELLED:
+            callbacks = self._cancel_callbacks
+            if callbacks is None:
+                # cancelled after being settled - will never be called
+                if state is CANCELLED:
+                    return self
+                callbacks = self._cancel_callbacks = self.callback_list()
+            callbacks.done(*args)
         return self
 
+    def _release(self):
+        """
+        Cancels pending deferred that nothing is attached to anymore
+        """
+        if self._state is not PENDING:
+            return
+        done = self._done_callbacks
+        fail = self._fail_callbacks
+        # timer of "timeout" does not keep deferred alive
+        if (done is None or not done._subscribed()) and \
+                (fail is None or not fail._subscribed()):
+            self.cancel()
+
     @property
     def cancelled(self):
         """
         Checks whether deferred is cancelled
         """
-        return self._done_callbacks.cancelled and self._fail_callbacks.cancelled
+        return self._state is CANCELLED
 
-    def promise(self):
+    @property
+    def state(self):
         """
-        Returns Promise from given object
+        Returns current state (PENDING, RESOLVED, REJECTED or CANCELLED)
         """
-        return Promise(self)
+        return self._state
 
+    def timeout(self, seconds, wheel=None):
+        """
+        Rejects deferred with DeferredTimeoutError unless it is settled
+        within given number of seconds.
 
-class Promise(object):
-    """
-    Read-only deferred
-    """
+        Timer is served by given TimerWheel. Mind that wheel fires timers
+        in thread that advances it, so plain Deferred requires wheel
+        advanced in thread that settles it (ThreadSafeDeferred uses shared
+        one, advanced in background thread, by default).
+        """
+        if self._state is PENDING:
+            if wheel is None:
+                raise TypeError('Deferred is not thread-safe, pass wheel '
+                    'advanced in thread that settles it')
+            timer = wheel.schedule(seconds, self._expire, seconds)
+            self.then(timer.cancel, timer.cancel).on_cancel(timer.cancel)
+        return self
 
-    def __init__(self, deferred):
+    def _expire(self, seconds):
         """
-        Object initialization
+        Rejects deferred that was not settled in time
         """
-        self.__deferred = deferred
+        self.reject(DeferredTimeoutError(
+            'Deferred was not settled within %s seconds' % seconds))
 
-    def __getattr__(self, name):
+    def _detach(self, success, error):
         """
-        Get attributes from base deferred. Filter out methods that change state
+        Detaches callbacks attached with "then"
         """
-        if name in ['resolve', 'reject', 'cancel']:
-            raise RuntimeError('Promise is read-only')
-        return getattr(self.__deferred, name)
+        if self._done_callbacks is not None:
+            self._done_callbacks.remove(success)
+        if self._fail_callbacks is not None:
+            self._fail_callbacks.remove(error)
 
+    def promise(self):
+        """
+        Returns Promise from given object (created once while it is used)
+        """
+        # held strongly while deferred is pending, by weak reference once
+        # it is settled: promise refers to deferred, so they form a cycle
+        # only until settlement
+        promise = self._promise
+        if promise is not None:
+            if type(promise) is Promise:
+                return promise
+            promise = promise()
+            if promise is not None:
+                return promise
+        promise = Promise(self)
+        if self._state is PENDING:
+            self._promise = promise
+        else:
+            self._promise = weakref.ref(promise)
+        return promise
 
-# pylint: disable-msg=R0903,W0142
-def _success(out, responses, key, *args, **kwargs):
-    """
-    Helper function for "when" method
-    """
-    responses[key] = (args, kwargs)
-    if None in responses:
-        return
-    out.resolve(*responses)
+    def _unpin(self):
+        """
+        Holds cached promise of settled deferred by weak reference,
+        breaking their reference cycle
+        """
+        promise = self._promise
+        if type(promise) is Promise:
+            self._promise = weakref.ref(promise)
 
+    @classmethod
+    def from_future(cls, future, dispatch=None):
+        """
+        Returns deferred settled together with given future
+        (either asyncio or concurrent.futures one).
 
-def when(*args):
-    """
-    Convinient way to call multiple deferreds.
+        By default deferred is settled in thread that completed future.
+        "dispatch" (e.g. loop.call_soon_threadsafe) is called with function
+        and its arguments to settle deferred elsewhere.
+        Cancellation of deferred cancels future.
+        """
+        deferred = cls()
+        deferred.on_cancel(future.cancel)
+        if dispatch is None:
+            future.add_done_callback(deferred._settle_with)
+        else:
+            future.add_done_callback(partial(dispatch, deferred._settle_with))
+        return deferred
 
-    Expects input to be on or more callable or Deferred objects
-    """
-    out = Deferred()
-    responses = [None] * len(args)
+    @classmethod
+    def run_in(cls, executor, func, *args, **kwargs):
+        """
+        Calls given function with given arguments in given executor
+        (e.g. ThreadPoolExecutor or ProcessPoolExecutor) and returns deferred
+        settled with its result or raised exception.
+        Keyword argument "dispatch" is passed to "from_future".
+        """
+        dispatch = kwargs.pop('dispatch', None)
+        return cls.from_future(executor.submit(func, *args, **kwargs),
+                dispatch)
 
-    for (key, deferred) in enumerate(args):
-        # got Deferred instance? wait for resolution
-        try:
-            deferred.then(partial(_success, out, responses, key), out.reject)
-        except AttributeError:
-            # no Deferred instance? Resolve internal deferred
-            _success(out, responses, key, deferred)
-    return out.promise()
+    @classmethod
+    def map_in(cls, executor, func, iterable, chunksize=1, dispatch=None):
+        """
+        Calls given function for each of given items in given executor.
+        Items are submitted in chunks of "chunksize" items, which cuts
+        per-task overhead (e.g. IPC of ProcessPoolExecutor).
+
+        Returns promise (of deferred of this class) resolved with list
+        of results (ordered just like items) or rejected with first raised
+        exception. Without "dispatch" it is settled in thread of executor,
+        so use ThreadSafeDeferred to attach callbacks while it is pending.
+        """
+        # without dispatch target chunks complete in many threads at once
+        if dispatch is None:
+            serializer = dispatch = _Serializer()
+        else:
+            serializer = None
+        chunks = (cls.from_future(executor.submit(_map_chunk, func, chunk),
+                dispatch) for chunk in _chunks(iterable, chunksize))
+        fanin = _All()
+        fanin.out = cls()
+        if serializer is None:
+            return _combine(fanin, chunks).then(_flatten, None,
+                    chain=True).promise()
+        # chunks are settled only once all of them are attached
+        with serializer.lock:
+            return _combine(fanin, chunks).then(_flatten, None,
+                    chain=True).promise()
+
+    def _settle_with(self, future):
+        """
+        Settles deferred just like given (already done) future
+        """
+        if future.cancelled():
+            self.cancel()
+            return
+        error = future.exception()
+        if error is None:
+            self.resolve(future.result())
+        else:
+            self.reject(error)
+
+    def as_future(self, loop=None):
+        """
+        Returns asyncio future settled together with this deferred.
+        Resolution is passed as single value (None when resolved without
+        arguments, tuple when resolved with many), rejection as exception
+        (RejectedError when rejected with anything but exception),
+        cancellation cancels future. Deferred may be settled from any
+        thread.
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        setter = _FutureSetter(future, loop)
+        self.done(setter).fail(setter.rejected).on_cancel(setter.cancelled)
+        return future
+
+    def __await__(self):
+        """
+        Allows to await deferred in asyncio coroutines
+        """
+        state = self._state
+        # already settled? no need to involve event loop
+        if state is RESOLVED:
+            callbacks = self._done_callbacks
+            return _Settled(_value(callbacks._args, callbacks._kwargs), None)
+        if state is REJECTED:
+            callbacks = self._fail_callbacks
+            return _Settled(None, _error(callbacks._args, callbacks._kwargs))
+        if state is CANCELLED:
+            return _Settled(None, asyncio.CancelledError())
+        return self.as_future().__await__()
+
+
+class ThreadSafeCallbackList(CallbackList):
+    """
+    CallbackList that may be used from many threads at once.
+    Callbacks are fired outside of the lock; once all of them are fired
+    callbacks attached later are fired without locking at all.
+    """
+
+    __slots__ = ('_lock', )
+
+    def __init__(self, lock=None):
+        """
+        Object initialization
+        """
+        CallbackList.__init__(self)
+        self._lock = lock or threading.Lock()
+
+    def done(self, *args):
+        """
+        Attaches given callback (or callbacks)
+        """
+        # fast path: resolved and fired - nothing will change anymore
+        if self._state is RESOLVED and self._callbacks is None:
+            self._fire(args)
+            return self
+        with self._lock:
+            state = self._state
+            # pending or still firing - callbacks will be fired by resolver
+            if state is PENDING or \
+                    (state is RESOLVED and self._callbacks is not None):
+                CallbackList.done(self, *args)
+                return self
+            if state is not RESOLVED:
+                return self
+        self._fire(args)
+        return self
+
+    def done_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) held by weak reference
+        """
+        with self._lock:
+            if self._state is PENDING:
+                CallbackList.done_weak(self, *args)
+                return self
+        return self.done(*args)
+
+    def subscribe(self, callback, weak=False):
+        """
+        Attaches given callback, returns Subscription that detaches it
+        """
+        with self._lock:
+            if self._state is PENDING:
+                return CallbackList.subscribe(self, callback, weak)
+        self.done(callback)
+        return Subscription(None)
+
+    def remove(self, *args):
+        """
+        Detaches given callback (or callbacks)
+        """
+        with self._lock:
+            CallbackList.remove(self, *args)
+        return self
+
+    def resolve(self, *args, **kwargs):
+        """
+        Resolves callback with given attributes
+        """
+        with self._lock:
+            if self._state is not PENDING:
+                return self
+            callbacks = self._callbacks
+            self._args = args
+            self._kwargs = kwargs or _NO_KWARGS
+            # empty list marks that callbacks are being fired
+            self._callbacks = []
+            self._state = RESOLVED
+        if callbacks is None:
+            callbacks = ()
+        elif type(callbacks) is not list and type(callbacks) is not _Entries:
+            callbacks = (callbacks, )
+        try:
+            while True:
+                self._fire(callbacks)
+                # fire callbacks attached in the meantime
+                with self._lock:
+                    callbacks = self._callbacks
+                    if not callbacks:
+                        self._callbacks = None
+                        break
+                    self._callbacks = []
+        except BaseException:
+            with self._lock:
+                self._callbacks = None
+            raise
+        return self
+
+    def cancel(self):
+        """
+        Terminates resolution
+        """
+        with self._lock:
+            CallbackList.cancel(self)
+        return self
+
+
+class ThreadSafeDeferred(Deferred):
+    """
+    Deferred that may be used (attached to, resolved, rejected and
+    cancelled) from many threads at once. Callbacks are fired in thread
+    that settled deferred or (when attached after deferred was settled)
+    in thread that attached them.
+    """
+
+    __slots__ = ('_lock', )
+
+    callback_list = ThreadSafeCallbackList
+
+    def __init__(self, func=None, *args, **kwargs):
+        """
+        Object initialization
+        """
+        self._lock = threading.Lock()
+        Deferred.__init__(self, func, *args, **kwargs)
+
+    def _callback_list(self, name, state):
+        """
+        Returns callback list of given name, creates it when needed.
+        Returns None when deferred is in state other than given or PENDING.
+        """
+        with self._lock:
+            if self._state is not PENDING and self._state is not state:
+                return None
+            callbacks = getattr(self, name)
+            if callbacks is None:
+                callbacks = self.callback_list(self._lock)
+                setattr(self, name, callbacks)
+            return callbacks
+
+    def done(self, *args):
+        """
+        Attaches given callback (or callbacks) to successful resolution
+        """
+        callbacks = self._done_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_done_callbacks', RESOLVED)
+        if callbacks is not None:
+            callbacks.done(*args)
+        return self
+
+    def fail(self, *args):
+        """
+        Attaches given callback (or callbacks) to rejected resolution
+        """
+        callbacks = self._fail_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_fail_callbacks', REJECTED)
+        if callbacks is not None:
+            callbacks.done(*args)
+        return self
+
+    def done_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to successful resolution,
+        holds it by weak reference
+        """
+        callbacks = self._done_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_done_callbacks', RESOLVED)
+        if callbacks is not None:
+            callbacks.done_weak(*args)
+        return self
+
+    def fail_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to rejected resolution,
+        holds it by weak reference
+        """
+        callbacks = self._fail_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_fail_callbacks', REJECTED)
+        if callbacks is not None:
+            callbacks.done_weak(*args)
+        return self
+
+    def subscribe(self, callback, weak=False):
+        """
+        Attaches given callback to successful resolution, returns
+        Subscription that detaches it
+        """
+        callbacks = self._done_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_done_callbacks', RESOLVED)
+        if callbacks is None:
+            return Subscription(None)
+        return callbacks.subscribe(callback, weak)
+
+    def subscribe_fail(self, callback, weak=False):
+        """
+        Attaches given callback to rejected resolution, returns
+        Subscription that detaches it
+        """
+        callbacks = self._fail_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_fail_callbacks', REJECTED)
+        if callbacks is None:
+            return Subscription(None)
+        return callbacks.subscribe(callback, weak)
+
+    def resolve(self, *args, **kwargs):
+        """
+        Resolves defferred positively
+        """
+        with self._lock:
+            if self._state is not PENDING:
+                return self
+            self._state = RESOLVED
+            self._fail_callbacks = None
+            self._cancel_callbacks = None
+            if self._promise is not None:
+                self._unpin()
+            callbacks = self._done_callbacks
+            if callbacks is None:
+                callbacks = self._done_callbacks = \
+                    self.callback_list(self._lock)
+        if self.monitor is not None:
+            self.monitor.settled(self)
+        callbacks.resolve(*args, **kwargs)
+        return self
+
+    def reject(self, *args, **kwargs):
+        """
+        Resolves defferred negatively
+        """
+        with self._lock:
+            if self._state is not PENDING:
+                return self
+            self._state = REJECTED
+            self._done_callbacks = None
+            self._cancel_callbacks = None
+            if self._promise is not None:
+                self._unpin()
+            callbacks = self._fail_callbacks
+            if callbacks is None:
+                callbacks = self._fail_callbacks = \
+                    self.callback_list(self._lock)
+        if self.monitor is not None:
+            self.monitor.settled(self)
+        callbacks.resolve(*args, **kwargs)
+        return self
+
+    def cancel(self):
+        """
+        Cancels deferred
+        """
+        with self._lock:
+            callbacks = self._cancel()
+        # called outside of the lock, so they may use deferred
+        if callbacks is not None:
+            callbacks.resolve()
+        return self
+
+    def on_cancel(self, *args):
+        """
+        Attaches given callback (or callbacks) called when pending deferred
+        is cancelled
+        """
+        callbacks = self._cancel_callbacks
+        if callbacks is None:
+            callbacks = self._callback_list('_cancel_callbacks', CANCELLED)
+        if callbacks is not None:
+            callbacks.done(*args)
+        return self
+
+    def timeout(self, seconds, wheel=None):
+        """
+        Rejects deferred with DeferredTimeoutError unless it is settled
+        within given number of seconds. Timer is served by given
+        TimerWheel (shared one, advanced in background thread, by default).
+        """
+        if wheel is None:
+            wheel = TimerWheel.default()
+        return Deferred.timeout(self, seconds, wheel)
+
+
+class Promise(object):
+    """
+    Read-only deferred
+    """
+
+    __slots__ = ('__deferred', '__weakref__')
+
+    def __init__(self, deferred):
+        """
+        Object initialization
+        """
+        self.__deferred = deferred
+
+    def _read_only(self):
+        """
+        Methods that change state are not available
+        """
+        raise RuntimeError('Promise is read-only')
+
+    resolve = property(_read_only)
+    reject = property(_read_only)
+    cancel = property(_read_only)
+
+    def abandon(self):
+        """
+        Tells that result is not needed anymore: cancels deferred,
+        which propagates cancellation to its producer (see Deferred.cancel)
+        """
+        self.__deferred.cancel()
+        return self
+
+    def on_cancel(self, *args):
+        """
+        Attaches given callback (or callbacks) called when deferred
+        is cancelled, see Deferred.on_cancel
+        """
+        self.__deferred.on_cancel(*args)
+        return self
+
+    def then(self, success, error, chain=False):
+        """
+        Attaches callbacks to deferred, see Deferred.then
+        """
+        derived = self.__deferred.then(success, error, chain)
+        if chain:
+            return derived
+        return self
+
+    def done(self, *args):
+        """
+        Attaches given callback (or callbacks) to successful resolution
+        """
+        self.__deferred.done(*args)
+        return self
+
+    def fail(self, *args):
+        """
+        Attaches given callback (or callbacks) to rejected resolution
+        """
+        self.__deferred.fail(*args)
+        return self
+
+    def done_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to successful resolution,
+        holds it by weak reference
+        """
+        self.__deferred.done_weak(*args)
+        return self
+
+    def fail_weak(self, *args):
+        """
+        Attaches given callback (or callbacks) to rejected resolution,
+        holds it by weak reference
+        """
+        self.__deferred.fail_weak(*args)
+        return self
+
+    def subscribe(self, callback, weak=False):
+        """
+        Attaches given callback to successful resolution, returns
+        Subscription that detaches it
+        """
+        return self.__deferred.subscribe(callback, weak)
+
+    def subscribe_fail(self, callback, weak=False):
+        """
+        Attaches given callback to rejected resolution, returns
+        Subscription that detaches it
+        """
+        return self.__deferred.subscribe_fail(callback, weak)
+
+    @property
+    def resolved(self):
+        """
+        Returns resolution status
+        """
+        return self.__deferred.resolved
+
+    @property
+    def rejected(self):
+        """
+        Returns resolution status
+        """
+        return self.__deferred.rejected
+
+    @property
+    def cancelled(self):
+        """
+        Checks whether deferred is cancelled
+        """
+        return self.__deferred.cancelled
+
+    @property
+    def state(self):
+        """
+        Returns current state of deferred
+        """
+        return self.__deferred.state
+
+    def promise(self):
+        """
+        Returns self
+        """
+        return self
+
+    def as_future(self, loop=None):
+        """
+        Returns asyncio future settled together with deferred
+        """
+        return self.__deferred.as_future(loop)
+
+    def __await__(self):
+        """
+        Allows to await promise in asyncio coroutines
+        """
+        return self.__deferred.__await__()
+
+
+def _unwrap(deferred):
+    """
+    Returns Deferred behind given Promise (or given Deferred itself),
+    so internals may use its private methods
+    """
+    if isinstance(deferred, Promise):
+        return deferred._Promise__deferred
+    return deferred
+
+
+class _Prioritized(object):
+    """
+    Callback with priority, see "priority"
+    """
+
+    __slots__ = ('callback', 'priority')
+
+    def __init__(self, callback, priority):
+        """
+        Object initialization
+        """
+        self.callback = callback
+        self.priority = priority
+
+    def __call__(self, *args, **kwargs):
+        """
+        Calls callback
+        """
+        return self.callback(*args, **kwargs)
+
+
+def priority(callback, priority):
+    """
+    Returns given callback marked with given priority. Dispatcher runs
+    callbacks with higher priority first (default priority is 0).
+    Callbacks called at once (without dispatcher) run in order they were
+    attached.
+    """
+    return _Prioritized(callback, priority)
+
+
+def _bind_kwargs(callback, kwargs):
+    """
+    Returns callback called with given keyword arguments, keeps priority
+    """
+    if type(callback) is _Prioritized:
+        return _Prioritized(partial(callback.callback, **kwargs),
+                callback.priority)
+    return partial(callback, **kwargs)
+
+
+class _Guarded(object):
+    """
+    Dispatched callback measured by monitor, which errors are handled
+    according to "on_error" policy of callback list it was attached to
+    """
+
+    __slots__ = ('callback', 'kwargs', 'on_error', 'monitor')
+
+    def __init__(self, callback, kwargs, on_error, monitor):
+        """
+        Object initialization
+        """
+        self.callback = callback
+        self.kwargs = kwargs
+        self.on_error = on_error
+        self.monitor = monitor
+
+    def __call__(self, *args):
+        """
+        Calls callback
+        """
+        callback = self.callback
+        monitor = self.monitor
+        if monitor is not None:
+            start = _perf_counter()
+        try:
+            callback(*args, **self.kwargs)
+        except Exception as e:
+            if monitor is not None:
+                monitor.callback(callback, _perf_counter() - start, e)
+            on_error = self.on_error
+            if on_error is None:
+                raise
+            if on_error == AGGREGATE:
+                raise CallbackError([(callback, e)])
+            on_error(callback, e)
+            return
+        if monitor is not None:
+            monitor.callback(callback, _perf_counter() - start, None)
+
+
+class Dispatcher(object):
+    """
+    Queue of callbacks fired by deferreds, so resolution does not block
+    resolver until all callbacks finish (set as CallbackList.dispatch).
+    Queued callbacks are run by "run": ones with higher priority first
+    (see "priority"), others in order they were queued.
+
+    "run" stops after "budget" microseconds (but runs at least one
+    callback), so other work may be done in the meantime. When "schedule"
+    (e.g. loop.call_soon) is given, "run" is scheduled with it whenever
+    there are callbacks waiting, otherwise it has to be called explicitly.
+    """
+
+    def __init__(self, budget=None, schedule=None, clock=_perf_counter):
+        """
+        Object initialization
+        """
+        self.budget = budget
+        self.schedule = schedule
+        self.clock = clock
+        # callbacks with default priority, in order they were queued
+        self._queue = deque()
+        # (-priority, order, func, args) of all other callbacks
+        self._prioritized = []
+        self._order = count()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def __call__(self, func, *args):
+        """
+        Queues call of given function with given arguments
+        """
+        if type(func) is _Prioritized and func.priority:
+            with self._lock:
+                heapq.heappush(self._prioritized,
+                        (-func.priority, next(self._order), func, args))
+        else:
+            self._queue.append((func, args))
+        if self.schedule is None or self._scheduled:
+            return
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.schedule(self.run)
+
+    def _pop(self):
+        """
+        Returns (func, args) of next callback or None when queue is empty
+        """
+        prioritized = self._prioritized
+        if prioritized:
+            with self._lock:
+                # higher priority than default goes first,
+                # lower once there is nothing else left
+                if prioritized and (prioritized[0][0] < 0 or
+                        not self._queue):
+                    entry = heapq.heappop(prioritized)
+                    return (entry[2], entry[3])
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            return None
+
+    def run(self):
+        """
+        Runs queued callbacks until queue is empty or time budget is used.
+        Returns number of callbacks that are still waiting.
+        """
+        deadline = None
+        if self.budget is not None:
+            deadline = self.clock() + self.budget / 1e6
+        error = None
+        while True:
+            entry = self._pop()
+            if entry is None:
+                break
+            # keep going on error, so none of queued callbacks is lost
+            try:
+                entry[0](*entry[1])
+            except Exception as e:
+                if error is None:
+                    error = e
+            if deadline is not None and self.clock() >= deadline:
+                break
+        with self._lock:
+            waiting = len(self)
+            scheduled = self._scheduled = bool(waiting) and \
+                self.schedule is not None
+        if scheduled:
+            self.schedule(self.run)
+        if error is not None:
+            raise error
+        return waiting
+
+    def __len__(self):
+        """
+        Returns number of queued callbacks
+        """
+        return len(self._queue) + len(self._prioritized)
+
+
+class _Settled(object):
+    """
+    Result of awaiting already settled deferred
+    """
+
+    __slots__ = ('value', 'error')
+
+    def __init__(self, value, error):
+        """
+        Object initialization
+        """
+        self.value = value
+        self.error = error
+
+    def __iter__(self):
+        """
+        Returns self
+        """
+        return self
+
+    def __next__(self):
+        """
+        Finishes awaiting immediately
+        """
+        if self.error is not None:
+            raise self.error
+        raise StopIteration(self.value)
+
+    next = __next__
+
+
+class _FutureSetter(object):
+    """
+    Passes state of deferred to asyncio future
+    """
+
+    __slots__ = ('future', 'loop')
+
+    def __init__(self, future, loop):
+        """
+        Object initialization
+        """
+        self.future = future
+        self.loop = loop
+
+    def __call__(self, *args, **kwargs):
+        """
+        Handles resolution of deferred
+        """
+        self._settle(self._set_result, _value(args, kwargs))
+
+    def rejected(self, *args, **kwargs):
+        """
+        Handles rejection of deferred
+        """
+        self._settle(self._set_exception, _error(args, kwargs))
+
+    def cancelled(self):
+        """
+        Handles cancellation of deferred
+        """
+        self._settle(self._cancel, None)
+
+    def _settle(self, func, value):
+        """
+        Calls given setter in loop's thread: at once when deferred
+        is settled in running loop, through the loop otherwise
+        """
+        if _running_loop is not None and _running_loop() is self.loop:
+            func(value)
+        else:
+            self.loop.call_soon_threadsafe(func, value)
+
+    def _set_result(self, value):
+        """
+        Resolves future unless it was cancelled
+        """
+        if not self.future.done():
+            self.future.set_result(value)
+
+    def _set_exception(self, error):
+        """
+        Rejects future unless it was cancelled
+        """
+        if not self.future.done():
+            self.future.set_exception(error)
+
+    def _cancel(self, value):
+        """
+        Cancels future unless it is done already
+        """
+        self.future.cancel()
+
+
+class _Serializer(object):
+    """
+    Dispatch target that calls functions one at a time
+    """
+
+    __slots__ = ('lock', )
+
+    def __init__(self):
+        """
+        Object initialization
+        """
+        self.lock = threading.RLock()
+
+    def __call__(self, func, *args):
+        """
+        Calls given function with given arguments
+        """
+        with self.lock:
+            func(*args)
+
+
+def _chunks(iterable, size):
+    """
+    Splits given iterable into lists of given size
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _map_chunk(func, chunk):
+    """
+    Calls given function for each item of given chunk (in executor)
+    """
+    return [func(item) for item in chunk]
+
+
+def _flatten(*responses):
+    """
+    Joins results of all chunks (passed as responses of "when")
+    """
+    return [result for (args, kwargs) in responses for result in args[0]]
+
+
+class _Stage(object):
+    """
+    Links deferred with one derived from it by "then(..., chain=True)"
+    """
+
+    __slots__ = ('parent', 'derived', 'success', 'error')
+
+    def __init__(self, parent, derived, success, error):
+        """
+        Object initialization
+        """
+        self.parent = parent
+        self.derived = derived
+        self.success = success
+        self.error = error
+
+    def __call__(self, *args, **kwargs):
+        """
+        Handles resolution of parent deferred
+        """
+        self.parent = None
+        _trampoline(self._run, self.success, self.derived.resolve, args,
+                kwargs)
+
+    def rejected(self, *args, **kwargs):
+        """
+        Handles rejection of parent deferred
+        """
+        self.parent = None
+        _trampoline(self._run, self.error, self.derived.reject, args, kwargs)
+
+    def cancelled(self):
+        """
+        Handles cancellation of derived deferred
+        """
+        parent = self.parent
+        if parent is not None:
+            self.parent = None
+            _unlink(parent, self, self.rejected)
+
+    def _run(self, callback, settle, args, kwargs):
+        """
+        Calls callback and settles derived deferred with its outcome
+        """
+        if callback is None:
+            settle(*args, **kwargs)
+            return
+        try:
+            value = callback(*args, **kwargs)
+        except Exception as e:
+            self.derived.reject(e)
+            return
+        _adopt(self.derived, value)
+
+
+class _Adopter(object):
+    """
+    Passes state of adopted deferred to the adopting one
+    """
+
+    __slots__ = ('deferred', 'adopted')
+
+    def __init__(self, deferred, adopted):
+        """
+        Object initialization
+        """
+        self.deferred = deferred
+        self.adopted = adopted
+
+    def __call__(self, *args, **kwargs):
+        """
+        Handles resolution of adopted deferred
+        """
+        _trampoline(_apply, self.deferred.resolve, args, kwargs)
+
+    def rejected(self, *args, **kwargs):
+        """
+        Handles rejection of adopted deferred
+        """
+        _trampoline(_apply, self.deferred.reject, args, kwargs)
+
+    def cancelled(self):
+        """
+        Handles cancellation of adopting deferred
+        """
+        adopted = self.adopted
+        if adopted is not None:
+            self.adopted = None
+            _unlink(adopted, self, self.rejected)
+
+
+def _unlink(parent, success, error):
+    """
+    Detaches given callbacks from parent deferred
+    and cancels it when nothing else is attached to it
+    """
+    parent._detach(success, error)
+    parent._release()
+
+
+def _apply(func, args, kwargs):
+    """
+    Calls given function with given arguments
+    """
+    func(*args, **kwargs)
+
+
+def _adopt(deferred, value):
+    """
+    Resolves deferred with given value or, when value is Deferred or Promise,
+    makes deferred follow its state
+    """
+    if not isinstance(value, (Deferred, Promise)):
+        deferred.resolve(value)
+    elif value is deferred:
+        deferred.reject(TypeError('Deferred can not adopt itself'))
+    else:
+        value = _unwrap(value)
+        adopter = _Adopter(deferred, value)
+        value.done(adopter).fail(adopter.rejected)
+        deferred.on_cancel(adopter.cancelled)
+
+
+class Timer(object):
+    """
+    Single timer scheduled in TimerWheel
+    """
+
+    __slots__ = ('wheel', 'expires', 'callback', 'args')
+
+    def __init__(self, wheel, expires, callback, args):
+        """
+        Object initialization
+        """
+        self.wheel = wheel
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+
+    def cancel(self, *args, **kwargs):
+        """
+        Cancels timer. Accepts (and ignores) any arguments, so it can be
+        attached as callback directly.
+        """
+        wheel = self.wheel
+        if wheel is not None:
+            wheel._cancel(self)
+
+    @property
+    def active(self):
+        """
+        Checks whether timer is still waiting to be fired
+        """
+        return self.wheel is not None
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel: timers are kept in buckets of "levels"
+    wheels of 2 ** "bits" slots each; every level covers 2 ** "bits" times
+    longer period than previous one. Timers are moved to lower level when
+    their time comes closer, so arming and cancelling timer costs O(1)
+    and very many timers may be served at once.
+
+    Wheel is advanced by "advance" method, called in background
+    (by "start") either from daemon thread or from asyncio loop.
+    """
+
+    # shared wheel, see TimerWheel.default
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, tick=0.01, bits=8, levels=4, clock=_monotonic,
+            dispatch=None):
+        """
+        Object initialization.
+
+        "tick" is resolution of wheel (in seconds), "clock" returns current
+        time in seconds. "dispatch" (e.g. loop.call_soon_threadsafe),
+        when given, is called with callback and its arguments instead of
+        calling callback directly.
+        """
+        self.tick = tick
+        self.clock = clock
+        self.dispatch = dispatch
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = [[[] for i in range(0, 1 << bits)]
+                for level in range(0, levels)]
+        self._start = clock()
+        # number of ticks processed so far
+        self._now = 0
+        self._count = 0
+        self._cancelled = 0
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._driver = None
+
+    @classmethod
+    def default(cls):
+        """
+        Returns shared wheel advanced in background thread
+        """
+        wheel = TimerWheel._default
+        if wheel is None:
+            with TimerWheel._default_lock:
+                wheel = TimerWheel._default
+                if wheel is None:
+                    wheel = TimerWheel._default = cls().start()
+        return wheel
+
+    def __len__(self):
+        """
+        Returns number of active timers
+        """
+        return self._count
+
+    def schedule(self, delay, callback, *args):
+        """
+        Calls given callback with given arguments after given number
+        of seconds. Returns Timer.
+        """
+        with self._lock:
+            expires = int(math.ceil((self.clock() - self._start + delay) /
+                self.tick))
+            timer = Timer(self, max(expires, self._now + 1), callback, args)
+            self._insert(timer)
+            self._count += 1
+            if self._count == 1:
+                self._wakeup.notify()
+        return timer
+
+    def _cancel(self, timer):
+        """
+        Cancels given timer (it is left in its bucket until bucket's time)
+        """
+        with self._lock:
+            if timer.wheel is None:
+                return
+            timer.wheel = timer.callback = timer.args = None
+            self._count -= 1
+            self._cancelled += 1
+
+    def _insert(self, timer):
+        """
+        Puts timer into bucket matching its expiration time
+        """
+        now = self._now
+        expires = max(timer.expires, now)
+        delta = (expires - now) >> self._bits
+        level = 0
+        top = len(self._levels) - 1
+        while delta and level < top:
+            delta >>= self._bits
+            level += 1
+        self._levels[level][(expires >> (level * self._bits)) & self._mask]\
+            .append(timer)
+
+    def _step(self, expired):
+        """
+        Processes next tick, appends expired timers to given list
+        """
+        self._now += 1
+        now = self._now
+        # lower level wrapped? move timers from higher level down
+        level = 1
+        while level < len(self._levels) and \
+                not (now >> ((level - 1) * self._bits)) & self._mask:
+            index = (now >> (level * self._bits)) & self._mask
+            bucket = self._levels[level][index]
+            self._levels[level][index] = []
+            for timer in bucket:
+                if timer.wheel is None:
+                    self._cancelled -= 1
+                else:
+                    self._insert(timer)
+            level += 1
+        index = now & self._mask
+        bucket = self._levels[0][index]
+        self._levels[0][index] = []
+        for timer in bucket:
+            if timer.wheel is None:
+                self._cancelled -= 1
+            else:
+                expired.append((timer.callback, timer.args))
+                timer.wheel = timer.callback = timer.args = None
+                self._count -= 1
+
+    def advance(self):
+        """
+        Fires all timers that expired by now. Returns number of them.
+        """
+        expired = []
+        with self._lock:
+            target = int((self.clock() - self._start) / self.tick)
+            while self._now < target and self._count:
+                self._step(expired)
+            # no timers left? skip empty ticks at once
+            if self._now < target:
+                self._now = target
+                if self._cancelled:
+                    for level in self._levels:
+                        for bucket in level:
+                            del bucket[:]
+                    self._cancelled = 0
+        dispatch = self.dispatch
+        error = None
+        for (callback, args) in expired:
+            # keep going on error, so no timer is lost
+            try:
+                if dispatch is None:
+                    callback(*args)
+                else:
+                    dispatch(callback, *args)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return len(expired)
+
+    def start(self, loop=None):
+        """
+        Starts advancing wheel in background: from daemon thread
+        or, when loop is given, from asyncio loop
+        """
+        with self._lock:
+            if self._driver is not None:
+                return self
+            if loop is None:
+                self._driver = threading.Thread(target=self._run,
+                        name='TimerWheel')
+                self._driver.daemon = True
+                self._driver.start()
+            else:
+                self._driver = loop
+                loop.call_soon_threadsafe(self._tick, loop)
+        return self
+
+    def stop(self):
+        """
+        Stops advancing wheel in background
+        """
+        with self._lock:
+            self._driver = None
+            self._wakeup.notify()
+        return self
+
+    def _run(self):
+        """
+        Advances wheel from background thread
+        """
+        thread = threading.current_thread()
+        while True:
+            with self._lock:
+                if self._driver is not thread:
+                    return
+                # sleep until first timer is scheduled
+                self._wakeup.wait(self.tick if self._count else None)
+            try:
+                self.advance()
+            except Exception:
+                sys.excepthook(*sys.exc_info())
+
+    def _tick(self, loop):
+        """
+        Advances wheel from asyncio loop
+        """
+        if self._driver is not loop:
+            return
+        try:
+            self.advance()
+        finally:
+            loop.call_later(self.tick, self._tick, loop)
+
+
+# pylint: disable-msg=R0903,W0142
+# guards taking output of combinator (or "retry") state, which may be
+# settled from thread of timer wheel as well
+_settle_lock = threading.Lock()
+
+# returned by "settle" of state which output was taken already,
+# so settling it once again does nothing
+_SETTLED = Deferred().cancel()
+
+
+class _Fanin(object):
+    """
+    Shared state of single combinator ("when", "when_any" etc.) call.
+    Once output is settled all references (including collected responses)
+    are dropped and callbacks are detached from pending inputs, so late
+    responses do no work.
+    Output is taken atomically, so it is settled once even when deadline
+    expires (in thread of timer wheel) while inputs are settled.
+    """
+
+    __slots__ = ('out', 'inputs', 'count', 'sealed')
+
+    def __init__(self):
+        """
+        Object initialization
+        """
+        self.out = Deferred()
+        self.inputs = []
+        self.count = 0
+        self.sealed = False
+
+    def add(self, key):
+        """
+        Registers new input
+        """
+        self.count += 1
+
+    def value(self, key, value):
+        """
+        Handles non-Deferred input (immediate resolution)
+        """
+        self.resolved(key, (value, ), {})
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given input
+        """
+        raise NotImplementedError()
+
+    def rejected(self, key, args, kwargs):
+        """
+        Handles rejection of given input
+        """
+        raise NotImplementedError()
+
+    def seal(self):
+        """
+        Marks that all inputs have been registered
+        """
+        self.sealed = True
+
+    def cancel(self):
+        """
+        Handles cancellation of output: detaches from all pending inputs
+        and cancels ones nothing else is attached to
+        """
+        inputs = self.inputs
+        if inputs is None or self.settle() is _SETTLED:
+            return
+        for (deferred, success, error) in inputs:
+            deferred._release()
+
+    def settle(self, detach=True):
+        """
+        Detaches from all pending inputs (unless "detach" is False)
+        and returns output deferred. Returns already cancelled deferred
+        when output was taken before.
+        """
+        with _settle_lock:
+            out = self.out
+            inputs = self.inputs
+            self.out = None
+            self.inputs = None
+            if out is not None:
+                self._drop()
+        if out is None:
+            return _SETTLED
+        if detach:
+            for (deferred, success, error) in inputs:
+                deferred._detach(success, error)
+        return out
+
+    def _drop(self):
+        """
+        Drops collected responses; late responses of inputs that were
+        not detached find them gone
+        """
+
+
+class _All(_Fanin):
+    """
+    State of "when" call: waits for all inputs or first failure
+    """
+
+    __slots__ = ('responses', 'pending')
+
+    def __init__(self):
+        """
+        Object initialization
+        """
+        _Fanin.__init__(self)
+        self.responses = []
+        self.pending = 0
+
+    def add(self, key):
+        """
+        Registers new input
+        """
+        _Fanin.add(self, key)
+        self.responses.append(None)
+        self.pending += 1
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given input
+        """
+        responses = self.responses
+        # each input is counted once, even if it reports its resolution again
+        if responses is None or responses[key] is not None:
+            return
+        responses[key] = (args, kwargs)
+        self.pending -= 1
+        if self.sealed and not self.pending:
+            self._resolve()
+
+    def rejected(self, key, args, kwargs):
+        """
+        Handles rejection of given input
+        """
+        self.settle().reject(*args, **kwargs)
+
+    def value(self, key, value):
+        """
+        Handles non-Deferred input (immediate resolution)
+        """
+        responses = self.responses
+        if responses is None:
+            return
+        responses[key] = ((value, ), {})
+        self.pending -= 1
+
+    def seal(self):
+        """
+        Marks that all inputs have been registered
+        """
+        _Fanin.seal(self)
+        if not self.pending:
+            self._resolve()
+
+    def _resolve(self):
+        """
+        Resolves output with all responses
+        """
+        responses = self.responses
+        if responses is not None:
+            self.settle().resolve(*responses)
+
+    def _drop(self):
+        """
+        Drops collected responses
+        """
+        self.responses = None
+
+
+# marks response that was not received yet
+_MISSING = object()
+
+
+class Results(object):
+    """
+    Responses of inputs of "when" called with "results=True", in order
+    of inputs. Passed to callbacks as single argument, so responses are
+    not copied.
+
+    Item is response of input: the only argument input was resolved with,
+    None when it was resolved without arguments or tuple when resolved with
+    many (see "response" for keyword arguments).
+    """
+
+    __slots__ = ('_values', '_responses')
+
+    def __init__(self, size=0):
+        """
+        Object initialization
+        """
+        self._values = [_MISSING] * size
+        # (args, kwargs) of inputs resolved with anything but one argument
+        self._responses = None
+
+    def _add(self, key):
+        """
+        Makes room for response of given input
+        """
+        if key >= len(self._values):
+            self._values.append(_MISSING)
+
+    def _set(self, key, args, kwargs):
+        """
+        Stores response of given input; returns False when it is already set
+        """
+        if self._values[key] is not _MISSING:
+            return False
+        if len(args) == 1 and not kwargs:
+            self._values[key] = args[0]
+            return True
+        if self._responses is None:
+            self._responses = {}
+        self._responses[key] = (args, kwargs)
+        self._values[key] = args[0] if len(args) == 1 else (args or None)
+        return True
+
+    def response(self, key):
+        """
+        Returns (args, kwargs) given input was resolved with
+        """
+        if key < 0:
+            key += len(self._values)
+        if self._responses is not None and key in self._responses:
+            return self._responses[key]
+        return ((self._values[key], ), {})
+
+    def __getitem__(self, key):
+        """
+        Returns response of given input
+        """
+        return self._values[key]
+
+    def __len__(self):
+        """
+        Returns number of inputs
+        """
+        return len(self._values)
+
+    def __iter__(self):
+        """
+        Iterates over responses of all inputs
+        """
+        return iter(self._values)
+
+    def __repr__(self):
+        """
+        Returns representation of responses
+        """
+        return 'Results(%r)' % (self._values, )
+
+
+class _Collect(_All):
+    """
+    State of "when" call with "results=True": collects responses
+    in Results object
+    """
+
+    __slots__ = ()
+
+    def __init__(self, size=0):
+        """
+        Object initialization
+        """
+        _All.__init__(self)
+        self.responses = Results(size)
+
+    def add(self, key):
+        """
+        Registers new input
+        """
+        _Fanin.add(self, key)
+        self.responses._add(key)
+        self.pending += 1
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given input
+        """
+        responses = self.responses
+        # each input is counted once, even if it reports its resolution again
+        if responses is None or not responses._set(key, args, kwargs):
+            return
+        self.pending -= 1
+        if self.sealed and not self.pending:
+            self._resolve()
+
+    def value(self, key, value):
+        """
+        Handles non-Deferred input (immediate resolution)
+        """
+        responses = self.responses
+        if responses is None:
+            return
+        responses._values[key] = value
+        self.pending -= 1
+
+    def _resolve(self):
+        """
+        Resolves output with Results object
+        """
+        responses = self.responses
+        if responses is not None:
+            self.settle().resolve(responses)
+
+
+def _all(iterable, results):
+    """
+    Returns state of "when" call
+    """
+    if not results:
+        return _All()
+    try:
+        return _Collect(len(iterable))
+    except TypeError:
+        return _Collect()
+
+
+class _Some(_Fanin):
+    """
+    State of "when_some" call: waits for "needed" resolutions (quorum)
+    or for so many failures that quorum can not be reached
+    """
+
+    __slots__ = ('needed', 'responses', 'failures')
+
+    def __init__(self, needed):
+        """
+        Object initialization
+        """
+        _Fanin.__init__(self)
+        self.needed = needed
+        self.responses = []
+        self.failures = []
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given input
+        """
+        responses = self.responses
+        if responses is None:
+            return
+        responses.append((args, kwargs))
+        if len(responses) >= self.needed:
+            self._resolve(args, kwargs)
+
+    def rejected(self, key, args, kwargs):
+        """
+        Handles rejection of given input
+        """
+        failures = self.failures
+        if failures is None:
+            return
+        failures.append((args, kwargs))
+        self._check()
+
+    def seal(self):
+        """
+        Marks that all inputs have been registered
+        """
+        _Fanin.seal(self)
+        responses = self.responses
+        if responses is None:
+            return
+        if len(responses) >= self.needed:
+            self._resolve((), {})
+        else:
+            self._check()
+
+    def _check(self):
+        """
+        Rejects output once quorum can not be reached
+        """
+        failures = self.failures
+        if failures is not None and self.sealed and \
+                self.count - len(failures) < self.needed:
+            self.settle().reject(*failures)
+
+    def _resolve(self, args, kwargs):
+        """
+        Resolves output with all collected responses
+        """
+        responses = self.responses
+        if responses is not None:
+            self.settle().resolve(*responses)
+
+    def _drop(self):
+        """
+        Drops collected responses and failures
+        """
+        self.responses = self.failures = None
+
+
+class _Any(_Some):
+    """
+    State of "when_any" call: first resolution wins
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        """
+        Object initialization
+        """
+        _Some.__init__(self, 1)
+
+    def _resolve(self, args, kwargs):
+        """
+        Resolves output with response of the winner
+        """
+        self.settle().resolve(*args, **kwargs)
+
+
+class _Race(_Fanin):
+    """
+    State of "when_race" call: first settled input wins
+    """
+
+    __slots__ = ()
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given input
+        """
+        self.settle().resolve(*args, **kwargs)
+
+    def rejected(self, key, args, kwargs):
+        """
+        Handles rejection of given input
+        """
+        self.settle().reject(*args, **kwargs)
+
+
+def _success(fanin, key, *args, **kwargs):
+    """
+    Helper function for "when" method
+    """
+    if fanin.out is not None:
+        fanin.resolved(key, args, kwargs)
+
+
+def _failure(fanin, key, *args, **kwargs):
+    """
+    Helper function for "when" method
+    """
+    if fanin.out is not None:
+        fanin.rejected(key, args, kwargs)
+
+
+def _expired(fanin, deadline, detach):
+    """
+    Rejects combinator output that was not settled before deadline.
+    Inputs are not detached in thread of shared wheel ("detach" is False),
+    their late responses find output taken.
+    """
+    if fanin.out is not None:
+        fanin.settle(detach).reject(DeferredTimeoutError(
+            'Inputs were not settled within %s seconds' % deadline))
+
+
+# adapters of foreign thenables, see "register_thenable"
+_thenables = {}
+
+# classes of inputs of combinators mapped to their adapters,
+# "_then" (duck-typed thenables) or None (immediate values)
+_kinds = {}
+
+# marks that kind of input is not known yet
+_UNKNOWN = object()
+
+
+def register_thenable(cls, adapt):
+    """
+    Allows to pass instances of given class (and its subclasses) to
+    combinators. "adapt" is called with such instance and returns Deferred
+    (or Promise) settled together with it.
+    """
+    _thenables[cls] = adapt
+    _kinds.clear()
+
+
+def _then(thenable, success, error):
+    """
+    Attaches callbacks to duck-typed thenable
+    """
+    thenable.then(success, error)
+
+
+def _classify(cls):
+    """
+    Returns adapter for instances of given class, "_then", None
+    or _UNKNOWN when it depends on instance
+    """
+    for base in getattr(cls, '__mro__', (cls, )):
+        if base in _thenables:
+            return _thenables[base]
+    if getattr(cls, 'then', None) is not None:
+        return _then
+    # instances without own attributes are plain values
+    if not cls.__dictoffset__ and getattr(cls, '__getattr__', None) is None:
+        return None
+    return _UNKNOWN
+
+
+def _kind(value):
+    """
+    Returns adapter for given input of combinator, "_then" for duck-typed
+    thenables or None for immediate values
+    """
+    cls = type(value)
+    kind = _kinds.get(cls, _UNKNOWN)
+    if kind is _UNKNOWN:
+        kind = _classify(cls)
+        if kind is _UNKNOWN:
+            if getattr(value, 'then', None) is None:
+                return None
+            return _then
+        _kinds[cls] = kind
+    return kind
+
+
+def _combine(fanin, iterable, deadline=None, wheel=None):
+    """
+    Subscribes given combinator state to all inputs
+    """
+    if deadline is not None and wheel is None:
+        # deadline expires in thread of shared wheel
+        fanin.out = ThreadSafeDeferred()
+    out = fanin.out
+    for (key, deferred) in enumerate(iterable):
+        # output already settled? do not even touch remaining inputs
+        if fanin.out is None:
+            break
+        fanin.add(key)
+        if not isinstance(deferred, (Deferred, Promise)):
+            kind = _kind(deferred)
+            # no Deferred instance? Resolve internal deferred
+            if kind is None:
+                fanin.value(key, deferred)
+                continue
+            if kind is _then:
+                deferred.then(partial(_success, fanin, key),
+                        partial(_failure, fanin, key))
+                continue
+            deferred = kind(deferred)
+        if type(deferred) is not Deferred:
+            deferred = _unwrap(deferred)
+        # got Deferred instance? wait for resolution
+        success = partial(_success, fanin, key)
+        error = partial(_failure, fanin, key)
+        fanin.inputs.append((deferred, success, error))
+        deferred.then(success, error)
+    if fanin.out is not None:
+        fanin.seal()
+    # sealing may settle output as well
+    if fanin.out is not None:
+        out.on_cancel(fanin.cancel)
+    if deadline is not None and fanin.out is not None:
+        detach = wheel is not None
+        if wheel is None:
+            wheel = TimerWheel.default()
+        timer = wheel.schedule(deadline, _expired, fanin, deadline, detach)
+        out.then(timer.cancel, timer.cancel).on_cancel(timer.cancel)
+    return out.promise()
+
+
+def _options(kwargs):
+    """
+    Extracts "deadline" and "wheel" keyword arguments of combinators
+    """
+    deadline = kwargs.pop('deadline', None)
+    wheel = kwargs.pop('wheel', None)
+    if kwargs:
+        raise TypeError('Unexpected keyword arguments: %s' %
+                ', '.join(sorted(kwargs)))
+    return (deadline, wheel)
+
+
+def when_all(iterable, deadline=None, wheel=None, results=False):
+    """
+    Convinient way to call multiple deferreds.
+
+    Works just like "when" but accepts any iterable (also generator)
+    of callable or Deferred objects
+    """
+    return _combine(_all(iterable, results), iterable, deadline, wheel)
+
+
+def when(*args, **kwargs):
+    """
+    Convinient way to call multiple deferreds.
+
+    Expects input to be on or more callable or Deferred objects.
+
+    When "deadline" (in seconds) is given output is rejected with
+    DeferredTimeoutError unless it is settled in time. Timer is served
+    by given TimerWheel ("wheel"), shared one by default. The same
+    applies to all other combinators.
+
+    When "results" is true output is resolved with single Results object
+    instead of (args, kwargs) tuple per input.
+    """
+    results = kwargs.pop('results', False)
+    return _combine(_all(args, results), args, *_options(kwargs))
+
+
+def when_some(needed, *args, **kwargs):
+    """
+    Resolves as soon as "needed" of given inputs are resolved (quorum).
+    Responses are passed to callbacks in order of resolution.
+    Rejects as soon as quorum can not be reached, passing all failures.
+    """
+    return _combine(_Some(needed), args, *_options(kwargs))
+
+
+def when_any(*args, **kwargs):
+    """
+    Resolves with response of first resolved input.
+    Rejects when all inputs were rejected, passing all failures.
+    """
+    return _combine(_Any(), args, *_options(kwargs))
+
+
+def when_race(*args, **kwargs):
+    """
+    Settles just like first settled (either resolved or rejected) input
+    """
+    return _combine(_Race(), args, *_options(kwargs))
+
+
+def _as_deferred(value):
+    """
+    Returns Deferred settled together with given input of combinator
+    """
+    if isinstance(value, (Deferred, Promise)):
+        return _unwrap(value)
+    kind = _kind(value)
+    if kind is None:
+        return Deferred().resolve(value)
+    if kind is _then:
+        deferred = Deferred()
+        value.then(deferred.resolve, deferred.reject)
+        return deferred
+    return _unwrap(kind(value))
+
+
+class _AsCompleted(object):
+    """
+    Iterates over settled deferreds in order of their settlement
+    """
+
+    __slots__ = ('_ready', '_remaining', '_waiter', '_lock')
+
+    def __init__(self, iterable):
+        """
+        Object initialization
+        """
+        self._ready = deque()
+        self._remaining = 0
+        self._waiter = None
+        self._lock = threading.Condition()
+        for value in iterable:
+            deferred = _as_deferred(value)
+            self._remaining += 1
+            settled = partial(_completed, self, deferred)
+            deferred.then(settled, settled)
+            deferred.on_cancel(settled)
+
+    def _put(self, deferred):
+        """
+        Handles settlement of given deferred
+        """
+        with self._lock:
+            waiter = self._waiter
+            if waiter is None:
+                self._ready.append(deferred)
+                self._lock.notify()
+                return
+            self._waiter = None
+        waiter.resolve(deferred)
+
+    def __iter__(self):
+        """
+        Returns self
+        """
+        return self
+
+    def __next__(self):
+        """
+        Returns next settled deferred, blocks until there is one
+        """
+        with self._lock:
+            if not self._remaining:
+                raise StopIteration()
+            while not self._ready:
+                self._lock.wait()
+            self._remaining -= 1
+            return self._ready.popleft()
+
+    next = __next__
+
+    def __aiter__(self):
+        """
+        Returns self
+        """
+        return self
+
+    def __anext__(self):
+        """
+        Returns deferred resolved with next settled deferred
+        """
+        with self._lock:
+            if not self._remaining:
+                return Deferred().reject(StopAsyncIteration())
+            self._remaining -= 1
+            if self._ready:
+                return Deferred().resolve(self._ready.popleft())
+            # resolved by thread that settles input
+            waiter = self._waiter = ThreadSafeDeferred()
+        return waiter
+
+
+def _completed(iterator, deferred, *args, **kwargs):
+    """
+    Helper function for "as_completed"
+    """
+    iterator._put(deferred)
+
+
+def as_completed(iterable):
+    """
+    Returns iterator over given inputs (just like ones of "when") yielding
+    them in order of settlement (resolution, rejection or cancellation).
+    Inputs that are not Deferred or Promise are yielded as deferreds
+    settled together with them. Results are not kept once yielded.
+
+    Iteration blocks until next input is settled, so inputs have to be
+    settled in other threads (use ThreadSafeDeferred). In asyncio
+    coroutines use "async for" instead, which waits without blocking.
+    """
+    return _AsCompleted(iterable)
+
+
+# marks end of iteration
+_END = object()
+
+
+class _MapLimited(object):
+    """
+    State of "map_limited" call
+    """
+
+    __slots__ = ('func', 'items', 'concurrency', 'ordered', 'out', 'results',
+            'inputs', 'count', 'pumping')
+
+    def __init__(self, func, iterable, concurrency, ordered, collect):
+        """
+        Object initialization
+        """
+        self.func = func
+        self.items = iter(iterable)
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.out = Deferred()
+        self.results = [] if collect else None
+        # in-flight deferreds: key -> (deferred, success, error)
+        self.inputs = {}
+        self.count = 0
+        self.pumping = False
+
+    def pump(self):
+        """
+        Starts next items until limit of in-flight deferreds is reached.
+        Deferreds settled immediately are handled by the same loop.
+        """
+        if self.pumping:
+            return
+        self.pumping = True
+        try:
+            while self.out is not None and self.items is not None and \
+                    len(self.inputs) < self.concurrency:
+                try:
+                    item = next(self.items, _END)
+                except Exception as e:
+                    self.settle().reject(e)
+                    break
+                if item is _END:
+                    self.items = None
+                    break
+                self._start(item)
+        finally:
+            self.pumping = False
+        if self.items is None and not self.inputs and self.out is not None:
+            results = self.results
+            self.results = None
+            self.settle().resolve(results)
+
+    def _start(self, item):
+        """
+        Calls function for given item and waits for its result
+        """
+        key = self.count
+        self.count += 1
+        try:
+            deferred = _as_deferred(self.func(item))
+        except Exception as e:
+            self.settle().reject(e)
+            return
+        if self.ordered and self.results is not None:
+            self.results.append(None)
+        success = partial(_mapped, self, key)
+        error = partial(_map_failed, self, key)
+        self.inputs[key] = (deferred, success, error)
+        deferred.then(success, error)
+
+    def resolved(self, key, args, kwargs):
+        """
+        Handles resolution of given item
+        """
+        if self.inputs.pop(key, None) is None:
+            return
+        if self.results is None:
+            pass
+        elif self.ordered:
+            self.results[key] = _value(args, kwargs)
+        else:
+            self.results.append(_value(args, kwargs))
+        self.pump()
+
+    def rejected(self, key, args, kwargs):
+        """
+        Handles rejection of given item
+        """
+        self.results = None
+        self.settle().reject(*args, **kwargs)
+
+    def cancel(self):
+        """
+        Handles cancellation of output: stops pulling items and cancels
+        in-flight deferreds nothing else is attached to
+        """
+        inputs = self.inputs
+        if self.out is None:
+            return
+        self.results = None
+        self.settle()
+        for (deferred, success, error) in inputs.values():
+            deferred._release()
+
+    def settle(self):
+        """
+        Detaches from in-flight deferreds and returns output deferred
+        """
+        out = self.out
+        for (deferred, success, error) in self.inputs.values():
+            deferred._detach(success, error)
+        self.out = None
+        self.items = None
+        self.func = None
+        self.inputs = {}
+        return out
+
+
+def _mapped(state, key, *args, **kwargs):
+    """
+    Helper function for "map_limited"
+    """
+    if state.out is not None:
+        state.resolved(key, args, kwargs)
+
+
+def _map_failed(state, key, *args, **kwargs):
+    """
+    Helper function for "map_limited"
+    """
+    if state.out is not None:
+        state.rejected(key, args, kwargs)
+
+
+def map_limited(func, iterable, concurrency, ordered=True, collect=True):
+    """
+    Calls given function (returning Deferred, Promise or any other input
+    accepted by "when") for items pulled lazily from given iterable,
+    keeping at most "concurrency" of returned deferreds pending at once.
+
+    Returns promise resolved with list of results (ordered just like items
+    or, when "ordered" is not set, in order of resolution) or rejected
+    just like first rejected deferred; no more items are pulled then.
+    Without "collect" results are not kept (they are expected to be handled
+    by callbacks attached by function) and promise is resolved with None,
+    so memory used does not depend on number of items.
+    Cancellation of result cancels pending deferreds.
+    """
+    if concurrency < 1:
+        raise ValueError('Concurrency has to be positive')
+    state = _MapLimited(func, iterable, concurrency, ordered, collect)
+    out = state.out
+    out.on_cancel(state.cancel)
+    state.pump()
+    return out.promise()
+
+
+class BatchLoader(object):
+    """
+    Coalesces requests for single keys into calls of batch function.
+
+    Keys requested with "load" are queued and passed to batch function
+    at once, when batch is dispatched: explicitly ("dispatch"), once
+    "max_size" keys are queued, "delay" seconds after first key was queued
+    (timer is served by given TimerWheel, shared one by default) or when
+    function scheduled with "schedule" (e.g. loop.call_soon) is called.
+    Requests for key that is already queued or being loaded share
+    the same deferred.
+
+    Batch function is called with list of keys and returns (or returns
+    Deferred resolved with) list of values ordered just like keys
+    or dictionary mapping keys to values. Keys are rejected with values
+    that are exceptions, keys missing from dictionary with KeyError.
+
+    BatchLoader is not thread-safe, except for dispatch by shared wheel
+    (queue is guarded by lock then and keys are resolved with
+    ThreadSafeDeferred). When own timer wheel is advanced in other thread
+    pass one with "dispatch" set (e.g. loop.call_soon_threadsafe).
+    """
+
+    __slots__ = ('batch', 'max_size', 'delay', 'wheel', 'schedule',
+            '_queue', '_pending', '_timer', '_scheduled', '_lock',
+            '_deferred')
+
+    def __init__(self, batch, max_size=None, delay=None, wheel=None,
+            schedule=None):
+        """
+        Object initialization
+        """
+        self.batch = batch
+        self.max_size = max_size
+        self.delay = delay
+        self.wheel = wheel
+        self.schedule = schedule
+        self._queue = []
+        # deferreds of queued and being loaded keys
+        self._pending = {}
+        self._timer = None
+        self._scheduled = False
+        self._lock = threading.Lock()
+        # shared wheel dispatches batch in its own thread
+        if delay is not None and wheel is None:
+            self._deferred = ThreadSafeDeferred
+        else:
+            self._deferred = Deferred
+
+    def load(self, key):
+        """
+        Returns promise resolved with value of given key
+        """
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None and not previous.cancelled:
+                return previous.promise()
+            deferred = self._pending[key] = self._deferred()
+            # cancelled deferred of queued key is just replaced
+            if previous is None or key not in self._queue:
+                self._queue.append(key)
+            size = len(self._queue)
+        if self.max_size is not None and size >= self.max_size:
+            self.dispatch()
+        elif size == 1:
+            self._wait()
+        return deferred.promise()
+
+    def load_many(self, keys):
+        """
+        Returns promise resolved with list of values of given keys
+        """
+        return when_all([self.load(key) for key in keys]).then(_values,
+                None, chain=True).promise()
+
+    def _wait(self):
+        """
+        Arranges dispatch of batch that has just been started
+        """
+        if self.delay is not None:
+            wheel = self.wheel
+            if wheel is None:
+                wheel = TimerWheel.default()
+            self._timer = wheel.schedule(self.delay, self.dispatch)
+        elif self.schedule is not None and not self._scheduled:
+            self._scheduled = True
+            self.schedule(self.dispatch)
+
+    def dispatch(self):
+        """
+        Calls batch function for all queued keys
+        """
+        with self._lock:
+            self._scheduled = False
+            timer = self._timer
+            self._timer = None
+            keys = self._queue
+            self._queue = []
+            deferreds = [self._pending[key] for key in keys]
+        if timer is not None:
+            timer.cancel()
+        if not keys:
+            return self
+        try:
+            result = _as_deferred(self.batch(list(keys)))
+        except Exception as e:
+            self._rejected(keys, deferreds, (e, ), {})
+            return self
+        result.then(partial(_batch_loaded, self, keys, deferreds),
+                partial(_batch_failed, self, keys, deferreds))
+        return self
+
+    def _resolved(self, keys, deferreds, args, kwargs):
+        """
+        Settles deferreds of given keys with result of batch function
+        """
+        values = _value(args, kwargs)
+        if hasattr(values, 'keys'):
+            values = [values[key] if key in values else
+                    KeyError(key) for key in keys]
+        elif len(values) != len(keys):
+            self._rejected(keys, deferreds, (ValueError('Batch function '
+                'returned %d values for %d keys' % (len(values),
+                    len(keys))), ), {})
+            return
+        for (key, deferred, value) in zip(keys, deferreds, values):
+            self._release(key, deferred)
+            if isinstance(value, Exception):
+                deferred.reject(value)
+            else:
+                deferred.resolve(value)
+
+    def _rejected(self, keys, deferreds, args, kwargs):
+        """
+        Rejects deferreds of given keys just like batch was rejected
+        """
+        for (key, deferred) in zip(keys, deferreds):
+            self._release(key, deferred)
+            deferred.reject(*args, **kwargs)
+
+    def _release(self, key, deferred):
+        """
+        Forgets deferred of given key (unless it was replaced already)
+        """
+        with self._lock:
+            if self._pending.get(key) is deferred:
+                del self._pending[key]
+
+
+def _batch_loaded(loader, keys, deferreds, *args, **kwargs):
+    """
+    Helper function for "BatchLoader"
+    """
+    loader._resolved(keys, deferreds, args, kwargs)
+
+
+def _batch_failed(loader, keys, deferreds, *args, **kwargs):
+    """
+    Helper function for "BatchLoader"
+    """
+    loader._rejected(keys, deferreds, args, kwargs)
+
+
+class _CacheEntry(object):
+    """
+    Deferred stored in DeferredCache
+    """
+
+    __slots__ = ('deferred', 'expires', 'load', 'refreshing')
+
+    def __init__(self, deferred, load):
+        """
+        Object initialization
+        """
+        self.deferred = deferred
+        # pending entries do not expire
+        self.expires = None
+        self.load = load
+        self.refreshing = False
+
+
+class DeferredCache(object):
+    """
+    Cache of deferreds returned by some function, stored per key.
+
+    Callers asking for key being loaded share the same (pending) deferred,
+    so function is called once per key (single flight). Rejected
+    and cancelled deferreds are evicted at once. Resolved ones are evicted
+    "ttl" seconds after resolution and when cache grows above "max_size"
+    (least recently used first). Expired entries are evicted (in order
+    of expiration) on any later "get", not only when their key is asked
+    for, so they do not pile up. When "refresh" is set, key asked for
+    later than "refresh" seconds before expiration is loaded again
+    in background, while cached value is still returned.
+
+    Numbers of "hits", "misses" and "evictions" are counted.
+    DeferredCache is not thread-safe.
+    """
+
+    __slots__ = ('max_size', 'ttl', 'refresh', 'clock', '_entries',
+            '_expiring', 'hits', 'misses', 'evictions')
+
+    def __init__(self, max_size=None, ttl=None, refresh=None,
+            clock=_monotonic):
+        """
+        Object initialization
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh = refresh
+        self.clock = clock
+        # ordered from least to most recently used
+        self._entries = OrderedDict()
+        # (expires, key, entry) in order of expiration
+        self._expiring = deque()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        """
+        Returns number of cached entries
+        """
+        return len(self._entries)
+
+    def get(self, key, func, *args, **kwargs):
+        """
+        Returns promise of deferred cached under given key. When there is
+        none, calls given function with given arguments and caches
+        deferred (or other input accepted by "when") it returns.
+        """
+        now = None
+        if self._expiring:
+            now = self.clock()
+            self._expire(now)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            expires = entry.expires
+            if expires is not None and now is None:
+                now = self.clock()
+            if expires is None or now < expires:
+                self._entries[key] = entry
+                self.hits += 1
+                if self.refresh is not None and expires is not None and \
+                        not entry.refreshing and \
+                        now >= expires - self.refresh:
+                    self._reload(key, entry)
+                return entry.deferred.promise()
+            self.evictions += 1
+        self.misses += 1
+        load = partial(func, *args, **kwargs)
+        entry = _CacheEntry(_as_deferred(load()), load)
+        if self.refresh is None:
+            entry.load = None
+        self._entries[key] = entry
+        self._watch(key, entry, entry.deferred)
+        if self.max_size is not None:
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry.deferred.promise()
+
+    def _expire(self, now):
+        """
+        Evicts entries expired by given time
+        """
+        expiring = self._expiring
+        entries = self._entries
+        while expiring and expiring[0][0] <= now:
+            (expires, key, entry) = expiring.popleft()
+            # skip entries refreshed or removed since
+            if entry.expires == expires and entries.get(key) is entry:
+                del entries[key]
+                self.evictions += 1
+
+    def _watch(self, key, entry, deferred):
+        """
+        Observes settlement of deferred loaded for given entry
+        """
+        failed = partial(_cache_failed, self, key, entry, deferred)
+        deferred.then(partial(_cache_resolved, self, key, entry, deferred),
+                failed)
+        deferred.on_cancel(failed)
+
+    def _reload(self, key, entry):
+        """
+        Loads entry again in background
+        """
+        entry.refreshing = True
+        try:
+            deferred = _as_deferred(entry.load())
+        except Exception:
+            entry.refreshing = False
+            return
+        self._watch(key, entry, deferred)
+
+    def _resolved(self, key, entry, deferred):
+        """
+        Handles resolution of deferred loaded for given entry
+        """
+        entry.deferred = deferred
+        entry.refreshing = False
+        if self.ttl is not None:
+            entry.expires = self.clock() + self.ttl
+            self._expiring.append((entry.expires, key, entry))
+
+    def _failed(self, key, entry, deferred):
+        """
+        Handles rejection (or cancellation) of deferred loaded
+        for given entry
+        """
+        # failed refresh keeps cached value until it expires
+        if deferred is not entry.deferred:
+            entry.refreshing = False
+            return
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Removes given key from cache
+        """
+        self._entries.pop(key, None)
+        return self
+
+    def clear(self):
+        """
+        Removes all keys from cache
+        """
+        self._entries.clear()
+        self._expiring.clear()
+        return self
+
+
+def _cache_resolved(cache, key, entry, deferred, *args, **kwargs):
+    """
+    Helper function for "DeferredCache"
+    """
+    cache._resolved(key, entry, deferred)
+
+
+def _cache_failed(cache, key, entry, deferred, *args, **kwargs):
+    """
+    Helper function for "DeferredCache"
+    """
+    cache._failed(key, entry, deferred)
+
+
+def cached_deferred(max_size=None, ttl=None, refresh=None, key=None):
+    """
+    Decorator caching deferreds returned by function in DeferredCache
+    (available as "cache" attribute of decorated function).
+    Cache key is built from arguments of call or by given "key" function
+    called with them.
+    """
+    def decorator(func):
+        cache = DeferredCache(max_size, ttl, refresh)
+
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                name = key(*args, **kwargs)
+            elif kwargs:
+                name = (args, tuple(sorted(kwargs.items())))
+            else:
+                name = args
+            return cache.get(name, func, *args, **kwargs)
+
+        update_wrapper(wrapper, func)
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+class RetryBudget(object):
+    """
+    Token bucket limiting retries made by all its users: every retry takes
+    one token, tokens are added at "rate" per second up to "capacity".
+    Thread-safe, so may be shared by all callers of a backend.
+    """
+
+    __slots__ = ('rate', 'capacity', 'clock', '_tokens', '_updated', '_lock')
+
+    def __init__(self, rate, capacity, clock=_monotonic):
+        """
+        Object initialization
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        """
+        Returns number of tokens available now
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _refill(self):
+        """
+        Adds tokens accumulated since last update
+        """
+        now = self.clock()
+        self._tokens = min(self.capacity,
+                self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Takes one token. Returns False when there is none.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _Retry(object):
+    """
+    State of "retry" call
+    """
+
+    __slots__ = ('factory', 'attempts', 'attempt', 'backoff', 'jitter',
+            'retry_on', 'budget', 'wheel', 'out', 'current', 'callbacks',
+            'timer')
+
+    def __init__(self, factory, attempts, backoff, jitter, retry_on, budget,
+            wheel):
+        """
+        Object initialization
+        """
+        self.factory = factory
+        self.attempts = attempts
+        self.attempt = 0
+        self.backoff = backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+        self.budget = budget
+        self.wheel = wheel
+        # attempts are made in thread of shared wheel
+        self.out = ThreadSafeDeferred() if wheel is None else Deferred()
+        # pending attempt and callbacks attached to it
+        self.current = None
+        self.callbacks = None
+        self.timer = None
+
+    def run(self):
+        """
+        Makes next attempt
+        """
+        self.timer = None
+        if self.out is None:
+            return
+        self.attempt += 1
+        try:
+            current = _as_deferred(self.factory())
+        except Exception as e:
+            self.failed(None, (e, ), {})
+            return
+        self.current = current
+        self.callbacks = (partial(_attempt_resolved, self, current),
+                partial(_attempt_failed, self, current))
+        current.then(*self.callbacks)
+
+    def failed(self, current, args, kwargs):
+        """
+        Handles failure of attempt: schedules next one or rejects output
+        """
+        if current is not self.current or self.out is None:
+            return
+        self.current = None
+        self.callbacks = None
+        if self.attempt >= self.attempts or \
+                not self._retryable(_error(args, kwargs)) or \
+                (self.budget is not None and not self.budget.acquire()):
+            self.settle().reject(*args, **kwargs)
+            return
+        wheel = self.wheel
+        if wheel is None:
+            wheel = TimerWheel.default()
+        self.timer = wheel.schedule(self._delay(), self.run)
+
+    def _retryable(self, error):
+        """
+        Checks whether attempt that failed with given error may be retried
+        """
+        retry_on = self.retry_on
+        if isinstance(retry_on, (type, tuple)):
+            return isinstance(error, retry_on)
+        return retry_on(error)
+
+    def _delay(self):
+        """
+        Returns delay (in seconds) of next attempt
+        """
+        backoff = self.backoff
+        if callable(backoff):
+            delay = backoff(self.attempt)
+        else:
+            delay = backoff * 2 ** (self.attempt - 1)
+        return delay * (1 + self.jitter * random.random())
+
+    def cancel(self):
+        """
+        Handles cancellation of output
+        """
+        current = self.current
+        callbacks = self.callbacks
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.settle() is _SETTLED:
+            return
+        if current is not None:
+            _unlink(current, *callbacks)
+
+    def settle(self):
+        """
+        Releases attempt state and returns output deferred (already
+        cancelled one when output was taken before)
+        """
+        with _settle_lock:
+            out = self.out
+            self.out = None
+        if out is None:
+            return _SETTLED
+        self.factory = None
+        self.current = None
+        self.callbacks = None
+        self.timer = None
+        return out
+
+
+def _attempt_resolved(state, current, *args, **kwargs):
+    """
+    Helper function for "retry"
+    """
+    if current is state.current and state.out is not None:
+        state.settle().resolve(*args, **kwargs)
+
+
+def _attempt_failed(state, current, *args, **kwargs):
+    """
+    Helper function for "retry"
+    """
+    state.failed(current, args, kwargs)
+
+
+def retry(factory, attempts, backoff=0.1, jitter=0.1, retry_on=Exception,
+        budget=None, wheel=None):
+    """
+    Calls factory (returning Deferred, Promise or any other input accepted
+    by "when") up to "attempts" times, until deferred it returns resolves.
+    Returns promise settled just like last attempt.
+
+    Next attempt is scheduled in given TimerWheel (shared one by default)
+    after "backoff" seconds doubled with each attempt (or number of
+    seconds returned by "backoff" called with number of failed attempts),
+    lengthened randomly by up to "jitter" part of it. Attempt is retried
+    only when its error (exception passed to rejection or RejectedError)
+    is instance of "retry_on" class (or tuple of them) or, when
+    "retry_on" is function, it returns True for it, and when shared
+    RetryBudget ("budget") has tokens left. Shared wheel makes attempts
+    in its own thread, so output is ThreadSafeDeferred then.
+    Cancellation of result stops retrying and cancels pending attempt.
+    """
+    state = _Retry(factory, attempts, backoff, jitter, retry_on, budget,
+            wheel)
+    out = state.out
+    out.on_cancel(state.cancel)
+    state.run()
+    return out.promise()
+
+
+class Histogram(object):
+    """
+    Histogram of durations with buckets of (roughly) constant relative
+    width (like HdrHistogram): durations are counted in "unit"s, every
+    power of two range is split into 2 ** ("bits" - 1) buckets, so values
+    are reported with relative error below 2 ** (1 - "bits").
+    Not thread-safe.
+    """
+
+    __slots__ = ('bits', 'unit', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bits=5, unit=1e-6):
+        """
+        Object initialization
+        """
+        self.bits = bits
+        self.unit = unit
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        """
+        Returns index of bucket of given value (in units)
+        """
+        bits = self.bits
+        if value < 1 << bits:
+            return value
+        shift = value.bit_length() - bits
+        return (1 << bits) + ((shift - 1) << (bits - 1)) + \
+            (value >> shift) - (1 << (bits - 1))
+
+    def _highest(self, index):
+        """
+        Returns highest value (in units) counted in bucket of given index
+        """
+        bits = self.bits
+        if index < 1 << bits:
+            return index
+        index -= 1 << bits
+        shift = (index >> (bits - 1)) + 1
+        low = ((index & ((1 << (bits - 1)) - 1)) + (1 << (bits - 1))) \
+            << shift
+        return low + (1 << shift) - 1
+
+    def record(self, seconds):
+        """
+        Counts given duration
+        """
+        index = self._index(int(seconds / self.unit))
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """
+        Returns duration (in seconds) given percent of counted durations
+        does not exceed
+        """
+        if not self.count:
+            return None
+        needed = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return min(self.max, (self._highest(index) + 1) * self.unit)
+
+    def summary(self):
+        """
+        Returns dictionary describing counted durations
+        """
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'p999': self.percentile(99.9)}
+
+
+class Exporter(object):
+    """
+    Receives metrics collected by Monitor (see Monitor.export)
+    """
+
+    def export(self, metrics):
+        """
+        Handles given metrics (dictionary returned by Monitor.metrics)
+        """
+        raise NotImplementedError()
+
+
+class Monitor(object):
+    """
+    Collects metrics of deferreds: counters of created, resolved, rejected
+    and cancelled deferreds and of called (and failed) callbacks,
+    number of live pending deferreds and histograms of time deferreds
+    were pending ("settle_latency") and time spent in callbacks
+    ("callback_time").
+
+    Monitoring is off by default and costs just a check of class attribute
+    then; "enable" turns it on. Only deferreds created while monitor is
+    enabled are counted as pending.
+    """
+
+    def __init__(self, exporters=(), clock=_perf_counter):
+        """
+        Object initialization
+        """
+        self.exporters = list(exporters)
+        self.clock = clock
+        self.counters = dict.fromkeys(('created', 'resolved', 'rejected',
+            'cancelled', 'callbacks', 'callback_errors'), 0)
+        self.settle_latency = Histogram()
+        self.callback_time = Histogram()
+        # creation time of pending deferreds
+        self._pending = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """
+        Starts monitoring of all deferreds and callback lists
+        """
+        Deferred.monitor = self
+        CallbackList.monitor = self
+        return self
+
+    def disable(self):
+        """
+        Stops monitoring
+        """
+        if Deferred.monitor is self:
+            Deferred.monitor = None
+            CallbackList.monitor = None
+        return self
+
+    @property
+    def pending(self):
+        """
+        Returns number of live pending deferreds
+        """
+        return len(self._pending)
+
+    def created(self, deferred):
+        """
+        Called when given deferred is created
+        """
+        now = self.clock()
+        with self._lock:
+            self.counters['created'] += 1
+            self._pending[deferred] = now
+
+    def settled(self, deferred):
+        """
+        Called when given deferred is resolved or rejected
+        """
+        now = self.clock()
+        with self._lock:
+            self.counters[deferred.state] += 1
+            created = self._pending.pop(deferred, None)
+            if created is not None:
+                self.settle_latency.record(now - created)
+
+    def cancelled(self, deferred):
+        """
+        Called when given pending deferred is cancelled
+        """
+        with self._lock:
+            self.counters['cancelled'] += 1
+            self._pending.pop(deferred, None)
+
+    def callback(self, callback, seconds, error):
+        """
+        Called when given callback was called; "error" is exception
+        it raised (if any)
+        """
+        with self._lock:
+            self.counters['callbacks'] += 1
+            if error is not None:
+                self.counters['callback_errors'] += 1
+            self.callback_time.record(seconds)
+
+    def metrics(self):
+        """
+        Returns dictionary of all metrics
+        """
+        with self._lock:
+            metrics = dict(self.counters)
+            metrics['pending'] = len(self._pending)
+            metrics['settle_latency'] = self.settle_latency.summary()
+            metrics['callback_time'] = self.callback_time.summary()
+        return metrics
+
+    def export(self):
+        """
+        Passes metrics to all exporters
+        """
+        metrics = self.metrics()
+        for exporter in self.exporters:
+            exporter.export(metrics)
+        return metrics
+
+
+def _values(*responses):
+    """
+    Converts responses passed by "when" into list of values
+    """
+    return [_value(args, kwargs) for (args, kwargs) in responses]
+
+
+if asyncio is not None:
+    register_thenable(asyncio.Future, Deferred.from_future)
+if futures is not None:
+    register_thenable(futures.Future, Deferred.from_future)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+from concurrent import futures
+from functools import partial
+import threading
+import unittest
+
+try:
+    import asyncio
+except ImportError:  # python < 3.4
+    asyncio = None
+
+##
+# promise modules
+#
+from promise import Deferred, RejectedError, ThreadSafeDeferred, \
+    as_completed, when
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class AsyncioTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def later(self, func, *args):
+        self.loop.call_soon(func, *args)
+
+    def test_resolved_deferred_can_be_awaited(self):
+        self.assertEqual(self.loop.run_until_complete(Deferred(1)), 1)
+
+    def test_rejected_deferred_can_be_awaited(self):
+        e = RuntimeError()
+        with self.assertRaises(RuntimeError) as ctx:
+            self.loop.run_until_complete(Deferred().reject(e))
+        self.assertTrue(ctx.exception is e)
+
+    def test_cancelled_deferred_can_be_awaited(self):
+        self.assertRaises(asyncio.CancelledError,
+                self.loop.run_until_complete, Deferred().cancel())
+
+    def test_pending_deferred_can_be_awaited(self):
+        d = Deferred()
+        self.later(d.resolve, 1)
+        self.assertEqual(self.loop.run_until_complete(d), 1)
+
+    def test_promise_can_be_awaited(self):
+        d = Deferred()
+        self.later(d.resolve, 1)
+        self.assertEqual(self.loop.run_until_complete(d.promise()), 1)
+
+    def test_resolution_arguments_are_converted_to_single_value(self):
+        run = self.loop.run_until_complete
+        self.assertEqual(run(Deferred().resolve()), None)
+        self.assertEqual(run(Deferred().resolve(1, 2)), (1, 2))
+        self.assertEqual(run(Deferred().resolve(1, a=2)), ((1, ), {'a': 2}))
+
+    def test_rejection_arguments_are_converted_to_exception(self):
+        d = Deferred()
+        self.later(partial(d.reject, 1, a=2))
+        with self.assertRaises(RejectedError) as ctx:
+            self.loop.run_until_complete(d)
+        self.assertEqual(ctx.exception.args, (1, ))
+        self.assertEqual(ctx.exception.kwargs, {'a': 2})
+
+    def test_as_future_returns_future_settled_with_deferred(self):
+        d = Deferred()
+        future = d.as_future(self.loop)
+        self.assertFalse(future.done())
+        d.resolve(1)
+        self.assertEqual(self.loop.run_until_complete(future), 1)
+
+    def test_as_future_is_settled_at_once_in_running_loop(self):
+        d = Deferred()
+        future = d.as_future(self.loop)
+        done = []
+
+        def settle():
+            d.resolve(1)
+            done.append(future.done())
+        self.later(settle)
+        self.assertEqual(self.loop.run_until_complete(future), 1)
+        self.assertEqual(done, [True])
+
+    def test_as_future_ignores_cancelled_future(self):
+        d = Deferred()
+        d.as_future(self.loop).cancel()
+        d.resolve(1)
+
+    def test_as_future_settles_future_in_loop_thread(self):
+        d = Deferred()
+        future = d.as_future(self.loop)
+        thread = threading.Thread(target=d.resolve, args=(1, ))
+        thread.start()
+        thread.join()
+        self.assertFalse(future.done())
+        self.assertEqual(self.loop.run_until_complete(future), 1)
+
+    def test_as_future_is_cancelled_with_deferred(self):
+        d = Deferred()
+        future = d.as_future(self.loop)
+        d.cancel()
+        self.assertRaises(asyncio.CancelledError,
+                self.loop.run_until_complete, future)
+
+    def test_awaiting_deferred_cancelled_later_raises_CancelledError(self):
+        d = Deferred()
+        self.later(d.cancel)
+        self.assertRaises(asyncio.CancelledError,
+                self.loop.run_until_complete,
+                asyncio.wait_for(d, 5))
+
+    def test_as_future_called_in_other_thread_is_settled_through_loop(self):
+        d = Deferred()
+        created = []
+
+        def run():
+            created.append(d.as_future(self.loop))
+            d.resolve(1)
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertFalse(created[0].done())
+        self.assertEqual(self.loop.run_until_complete(created[0]), 1)
+
+    def test_from_future_returns_deferred_settled_with_asyncio_future(self):
+        future = self.loop.create_future()
+        d = Deferred.from_future(future)
+        future.set_result(1)
+        self.assertEqual(self.loop.run_until_complete(d), 1)
+
+    def test_from_future_returns_deferred_rejected_with_future_exception(self):
+        e = RuntimeError()
+        future = self.loop.create_future()
+        d = Deferred.from_future(future)
+        future.set_exception(e)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(d.rejected)
+
+    def test_from_future_returns_deferred_cancelled_with_future(self):
+        future = self.loop.create_future()
+        d = Deferred.from_future(future)
+        future.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(d.cancelled)
+
+    def test_from_future_accepts_concurrent_future(self):
+        future = futures.Future()
+        d = Deferred.from_future(future)
+        future.set_result(1)
+        self.assertTrue(d.resolved)
+
+    def test_when_waits_for_asyncio_futures(self):
+        future = self.loop.create_future()
+        p = when(future, 2)
+        self.later(future.set_result, 1)
+        self.assertEqual(self.loop.run_until_complete(p),
+                (((1, ), {}), ((2, ), {})))
+
+    def test_as_completed_is_async_iterator(self):
+        inputs = [Deferred(), Deferred()]
+        completed = as_completed(inputs).__aiter__()
+        self.later(inputs[1].resolve)
+        run = self.loop.run_until_complete
+        self.assertTrue(run(completed.__anext__()) is inputs[1])
+        inputs[0].reject()
+        self.assertTrue(run(completed.__anext__()) is inputs[0])
+        self.assertRaises(StopAsyncIteration, run, completed.__anext__())
+
+    def test_as_completed_waits_for_inputs_settled_in_other_threads(self):
+        d = ThreadSafeDeferred()
+        completed = as_completed([d])
+        self.later(threading.Thread(target=d.resolve).start)
+        self.assertTrue(self.loop.run_until_complete(
+            completed.__anext__()) is d)
+
+
+if "__main__" == __name__:
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import DeferredCache, Deferred, Promise, cached_deferred
+
+
+class DeferredCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.clock = Clock()
+        self.deferreds = []
+
+    def load(self, *args):
+        d = Deferred()
+        self.deferreds.append(d)
+        return d
+
+    def test_get_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(DeferredCache().get(1, self.load),
+            Promise))
+
+    def test_concurrent_callers_share_one_call(self):
+        cache = DeferredCache()
+        p = cache.get(1, self.load)
+        self.assertTrue(cache.get(1, self.load) is p)
+        self.assertEqual(len(self.deferreds), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_function_is_called_with_given_arguments(self):
+        func = mock.MagicMock(return_value=1)
+        DeferredCache().get('k', func, 1, a=2).done(self.c)
+        func.assert_called_once_with(1, a=2)
+        self.c.assert_called_once_with(1)
+
+    def test_resolved_value_is_cached(self):
+        cache = DeferredCache()
+        cache.get(1, self.load)
+        self.deferreds[0].resolve(10)
+        cache.get(1, self.load).done(self.c)
+        self.c.assert_called_once_with(10)
+        self.assertEqual(len(self.deferreds), 1)
+
+    def test_rejected_entries_are_evicted(self):
+        cache = DeferredCache()
+        cache.get(1, self.load).fail(self.c)
+        self.deferreds[0].reject(1)
+        self.c.assert_called_once_with(1)
+        self.assertEqual((len(cache), cache.evictions), (0, 1))
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 2)
+
+    def test_cancelled_entries_are_evicted(self):
+        cache = DeferredCache()
+        cache.get(1, self.load).abandon()
+        self.assertEqual(len(cache), 0)
+
+    def test_entries_expire_after_ttl(self):
+        cache = DeferredCache(ttl=10, clock=self.clock)
+        cache.get(1, self.load)
+        self.clock.now = 5
+        self.deferreds[0].resolve()
+        self.clock.now = 14
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 1)
+        self.clock.now = 15
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expired_entries_are_evicted_on_access_to_other_keys(self):
+        cache = DeferredCache(ttl=1000, clock=self.clock)
+        for key in range(0, 100):
+            cache.get(key, self.load)
+            self.deferreds[-1].resolve()
+            self.clock.now += 1
+        self.clock.now = 1050
+        cache.get('other', self.load)
+        self.assertEqual((len(cache), cache.evictions), (50, 51))
+        self.clock.now = 2000
+        cache.get('other', self.load)
+        self.assertEqual((len(cache), cache.evictions), (1, 100))
+
+    def test_refreshed_entry_is_not_evicted_at_old_expiration(self):
+        cache = DeferredCache(ttl=10, refresh=3, clock=self.clock)
+        cache.get(1, self.load)
+        self.deferreds[0].resolve('old')
+        self.clock.now = 8
+        cache.get(1, self.load)
+        self.deferreds[1].resolve('new')
+        self.clock.now = 12
+        cache.get(2, self.load)
+        cache.get(1, self.load).done(self.c)
+        self.c.assert_called_once_with('new')
+        self.assertEqual(cache.evictions, 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = DeferredCache(max_size=2)
+        cache.get(1, self.load)
+        cache.get(2, self.load)
+        cache.get(1, self.load)
+        cache.get(3, self.load)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(1, self.load)
+        cache.get(2, self.load)
+        self.assertEqual(len(self.deferreds), 4)
+
+    def test_entries_are_refreshed_before_expiration(self):
+        cache = DeferredCache(ttl=10, refresh=3, clock=self.clock)
+        cache.get(1, self.load)
+        self.deferreds[0].resolve('old')
+        self.clock.now = 6
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 1)
+        self.clock.now = 7
+        cache.get(1, self.load).done(self.c)
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 2)
+        self.c.assert_called_once_with('old')
+        self.deferreds[1].resolve('new')
+        self.clock.now = 16
+        cache.get(1, self.load).done(self.c.new)
+        self.c.new.assert_called_once_with('new')
+
+    def test_failed_refresh_keeps_cached_value(self):
+        cache = DeferredCache(ttl=10, refresh=3, clock=self.clock)
+        cache.get(1, self.load)
+        self.deferreds[0].resolve('old')
+        self.clock.now = 8
+        cache.get(1, self.load)
+        self.deferreds[1].reject()
+        cache.get(1, self.load).done(self.c)
+        self.c.assert_called_once_with('old')
+        self.assertEqual(len(cache), 1)
+
+    def test_invalidate_removes_key(self):
+        cache = DeferredCache()
+        cache.get(1, self.load)
+        cache.invalidate(1)
+        cache.get(1, self.load)
+        self.assertEqual(len(self.deferreds), 2)
+
+    def test_clear_removes_all_keys(self):
+        cache = DeferredCache()
+        cache.get(1, self.load)
+        self.assertEqual(len(cache.clear()), 0)
+
+
+class CachedDeferredTestCase(unittest.TestCase):
+
+    def test_deferreds_are_cached_per_arguments(self):
+        func = mock.MagicMock(side_effect=lambda *a, **kw: Deferred())
+        cached = cached_deferred()(func)
+        self.assertTrue(cached(1, a=2) is cached(1, a=2))
+        self.assertFalse(cached(1) is cached(2))
+        self.assertEqual(func.call_count, 3)
+
+    def test_key_is_built_by_given_function(self):
+        func = mock.MagicMock(side_effect=lambda *a: Deferred())
+        cached = cached_deferred(key=lambda a, b: a)(func)
+        self.assertTrue(cached(1, 2) is cached(1, 3))
+
+    def test_cache_is_available_as_attribute(self):
+        def load():
+            return Deferred()
+        cached = cached_deferred(max_size=10)(load)
+        self.assertEqual(cached.cache.max_size, 10)
+        self.assertEqual(cached.__name__, 'load')
+
+
+if "__main__" == __name__:
+    unittest.main()
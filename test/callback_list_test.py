@@ -4,8 +4,14 @@
 ##
 # python standard library
 #
+import gc
 import unittest
 
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
 ##
 # test helpers
 #
@@ -14,7 +20,8 @@ from testutils import mock
 ##
 # promise modules
 #
-from promise import CallbackList
+from promise import CallbackList, PENDING, RESOLVED, CANCELLED, AGGREGATE, \
+    CallbackError, Subscription
 
 
 class CallbackListTestCase(unittest.TestCase):
@@ -140,5 +147,334 @@ class CallbackListTestCase(unittest.TestCase):
         self.assertTrue(CallbackList().cancel().resolve().cancelled)
 
 
+    def test_callbacks_are_fired_in_order_of_attachment(self):
+        CallbackList().done(self.c.a).done(self.c.b, self.c.c).done(self.c.d)\
+            .resolve(1)
+        self.assertEqual(self.c.mock_calls, [mock.call.a(1), mock.call.b(1),
+                mock.call.c(1), mock.call.d(1)])
+
+    def test_remove_detaches_given_callbacks(self):
+        c = mock.MagicMock()
+        CallbackList().done(self.c).remove(self.c).resolve()
+        CallbackList().done(self.c, c).remove(self.c).resolve()
+        self.assertEqual(self.c.call_count, 0)
+        c.assert_called_once_with()
+
+    def test_remove_ignores_unknown_callbacks(self):
+        CallbackList().done(self.c).remove(mock.MagicMock()).resolve()
+        CallbackList().remove(self.c).done(self.c).resolve()
+        self.assertEqual(self.c.call_count, 2)
+
+
+    def test_state_returns_current_state(self):
+        self.assertEqual(CallbackList().state, PENDING)
+        self.assertEqual(CallbackList().resolve().state, RESOLVED)
+        self.assertEqual(CallbackList().resolve().cancel().state, CANCELLED)
+
+
+
+class TrampolinedCallbackListTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        patcher = mock.patch.object(CallbackList, 'trampoline', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve_fires_callbacks(self):
+        CallbackList().done(self.c).resolve(1)
+        self.c.assert_called_once_with(1)
+
+    def test_done_after_resolvement_fires_callbacks_immediately(self):
+        CallbackList().resolve(1).done(self.c)
+        self.c.assert_called_once_with(1)
+
+    def test_nested_resolution_is_fired_after_outer_callbacks(self):
+        inner = CallbackList().done(self.c.inner)
+        CallbackList().done(lambda: inner.resolve(), self.c.outer).resolve()
+        self.assertEqual(self.c.mock_calls, [mock.call.outer(),
+                mock.call.inner()])
+
+    def test_callbacks_attached_while_resolution_is_queued_keep_order(self):
+        inner = CallbackList().done(self.c.first)
+
+        def outer():
+            inner.resolve(1)
+            inner.done(self.c.second)
+            self.assertEqual(self.c.call_count, 0)
+
+        CallbackList().done(outer).resolve()
+        self.assertEqual(self.c.mock_calls, [mock.call.first(1),
+                mock.call.second(1)])
+
+    def test_long_synchronous_cascade_does_not_grow_stack(self):
+        lists = [CallbackList() for i in range(0, 100000)]
+        for (current, following) in zip(lists, lists[1:]):
+            current.done(following.resolve)
+        lists[-1].done(self.c)
+        lists[0].resolve(1)
+        self.c.assert_called_once_with(1)
+
+    def test_interrupted_resolution_does_not_block_later_ones(self):
+        def interrupt(*args):
+            raise KeyboardInterrupt()
+
+        inner = CallbackList().done(self.c.inner)
+        outer = CallbackList().done(lambda: inner.resolve(), interrupt)
+        self.assertRaises(KeyboardInterrupt, outer.resolve)
+        # interruption propagates at once, queued calls are dropped
+        self.assertFalse(self.c.inner.called)
+        CallbackList().done(self.c.later).resolve()
+        self.c.later.assert_called_once_with()
+
+
+class CallbackListErrorPolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.e = RuntimeError()
+        self.failing = mock.MagicMock(side_effect=self.e)
+
+    def policy(self, on_error):
+        patcher = mock.patch.object(CallbackList, 'on_error', on_error)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_error_stops_firing_by_default(self):
+        l = CallbackList().done(self.failing, self.c)
+        self.assertRaises(RuntimeError, l.resolve)
+        self.assertEqual(self.c.call_count, 0)
+
+    def test_aggregate_policy_fires_all_callbacks_before_raising(self):
+        self.policy(AGGREGATE)
+        l = CallbackList().done(self.failing, self.c, self.failing)
+        with self.assertRaises(CallbackError) as ctx:
+            l.resolve(1)
+        self.c.assert_called_once_with(1)
+        self.assertEqual(ctx.exception.errors, [(self.failing, self.e),
+                (self.failing, self.e)])
+
+    def test_sink_policy_passes_errors_to_sink(self):
+        sink = mock.MagicMock()
+        self.policy(sink)
+        CallbackList().done(self.failing, self.c).resolve(1)
+        self.c.assert_called_once_with(1)
+        sink.assert_called_once_with(self.failing, self.e)
+
+    def test_sink_policy_accepts_plain_functions(self):
+        errors = []
+
+        def sink(callback, error):
+            errors.append((callback, error))
+
+        self.policy(sink)
+        CallbackList().resolve().done(self.failing)
+        self.assertEqual(errors, [(self.failing, self.e)])
+
+    def test_policy_does_not_affect_callbacks_that_do_not_raise(self):
+        sink = mock.MagicMock()
+        self.policy(sink)
+        CallbackList().done(self.c).resolve(1)
+        self.c.assert_called_once_with(1)
+        self.assertEqual(sink.call_count, 0)
+
+
+
+class Subscriber(object):
+    """
+    Short-lived object subscribing with bound method
+    """
+
+    def __init__(self, calls=None):
+        self.calls = calls
+        self.buffer = bytearray(1000)
+
+    def handle(self, *args):
+        self.calls.append(args)
+
+
+class CallbackListWeakTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def test_weak_callback_is_fired(self):
+        c = mock.MagicMock()
+        s = Subscriber(self.calls)
+        CallbackList().done_weak(c, s.handle).resolve(1)
+        c.assert_called_once_with(1)
+        self.assertEqual(self.calls, [(1, )])
+
+    def test_weak_callback_does_not_keep_subscriber_alive(self):
+        cl = CallbackList().done_weak(Subscriber(self.calls).handle)
+        cl.resolve(1)
+        self.assertEqual(self.calls, [])
+
+    def test_weak_callback_of_function_does_not_keep_it_alive(self):
+        calls = self.calls
+        cl = CallbackList().done_weak(lambda *args: calls.append(args))
+        cl.resolve(1)
+        self.assertEqual(calls, [])
+
+    def test_weak_and_strong_callbacks_keep_order(self):
+        s = Subscriber(self.calls)
+        cl = CallbackList().done(lambda: self.calls.append('a'))
+        cl.done_weak(s.handle)
+        cl.done(lambda: self.calls.append('b'))
+        cl.resolve()
+        self.assertEqual(self.calls, ['a', (), 'b'])
+
+    def test_weak_callback_attached_after_resolution_is_fired(self):
+        CallbackList().resolve(1).done_weak(Subscriber(self.calls).handle)
+        self.assertEqual(self.calls, [(1, )])
+
+    def test_weak_callback_may_be_removed(self):
+        s = Subscriber(self.calls)
+        c = mock.MagicMock()
+        cl = CallbackList().done_weak(s.handle, c)
+        cl.remove(s.handle, c).resolve()
+        self.assertEqual(self.calls, [])
+        self.assertFalse(c.called)
+
+    def test_list_with_dead_weak_callbacks_only_is_empty(self):
+        s = Subscriber(self.calls)
+        cl = CallbackList().done_weak(s.handle)
+        self.assertFalse(cl.empty)
+        del s
+        self.assertTrue(cl.empty)
+
+    def test_dead_weak_callbacks_are_dropped(self):
+        live = [Subscriber(self.calls) for i in range(0, 10)]
+        cl = CallbackList()
+        for s in live:
+            cl.done_weak(s.handle)
+        for i in range(0, 1000):
+            cl.done_weak(Subscriber(self.calls).handle)
+        self.assertTrue(len(cl._callbacks) <= 2 * len(live) + 2)
+        cl.resolve(1)
+        self.assertEqual(len(self.calls), len(live))
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_memory_is_bounded_with_many_transient_subscribers(self):
+        cl = CallbackList()
+        gc.collect()
+        tracemalloc.start()
+        for i in range(0, 1000000):
+            cl.done_weak(Subscriber(self.calls).handle)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # single subscriber takes more than 1kB
+        self.assertTrue(peak < 100000, peak)
+        self.assertTrue(len(cl._callbacks) < 10)
+
+
+class CallbackListSubscriptionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def callback(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def test_subscribe_returns_Subscription(self):
+        self.assertTrue(isinstance(CallbackList().subscribe(self.callback(1)),
+            Subscription))
+
+    def test_subscribed_callback_is_fired(self):
+        cl = CallbackList()
+        cl.subscribe(self.callback('a'))
+        cl.resolve(1, 2)
+        self.assertEqual(self.calls, [('a', (1, 2))])
+
+    def test_removed_callback_is_not_fired(self):
+        cl = CallbackList()
+        cl.subscribe(self.callback('a')).remove()
+        cl.resolve()
+        self.assertEqual(self.calls, [])
+
+    def test_removal_keeps_order_of_remaining_callbacks(self):
+        cl = CallbackList().done(self.callback('a'))
+        subscriptions = [cl.subscribe(self.callback(i)) for i in range(0, 6)]
+        cl.done(self.callback('b'))
+        subscriptions[1].remove()
+        subscriptions[4].remove()
+        cl.resolve()
+        self.assertEqual([name for (name, args) in self.calls],
+                ['a', 0, 2, 3, 5, 'b'])
+
+    def test_removal_releases_callback(self):
+        c = self.callback('a')
+        s = CallbackList().subscribe(c)
+        self.assertTrue(s.alive)
+        s.remove()
+        self.assertFalse(s.alive)
+        self.assertEqual(s.callback, None)
+
+    def test_remove_may_be_called_many_times(self):
+        cl = CallbackList()
+        s = cl.subscribe(self.callback('a'))
+        cl.subscribe(self.callback('b'))
+        s.remove()
+        s.remove()
+        self.assertFalse(cl.empty)
+
+    def test_callback_may_remove_other_callback_while_fired(self):
+        cl = CallbackList()
+        cl.subscribe(lambda: s.remove())
+        s = cl.subscribe(self.callback('a'))
+        cl.resolve()
+        self.assertEqual(self.calls, [])
+
+    def test_list_with_removed_subscriptions_only_is_empty(self):
+        cl = CallbackList()
+        s = cl.subscribe(self.callback('a'))
+        self.assertFalse(cl.empty)
+        s.remove()
+        self.assertTrue(cl.empty)
+
+    def test_callback_of_resolved_list_is_fired_at_once(self):
+        s = CallbackList().resolve(1).subscribe(self.callback('a'))
+        self.assertEqual(self.calls, [('a', (1, ))])
+        self.assertFalse(s.alive)
+
+    def test_subscription_may_hold_callback_by_weak_reference(self):
+        cl = CallbackList()
+        s = cl.subscribe(Subscriber(self.calls).handle, weak=True)
+        self.assertFalse(s.alive)
+        self.assertTrue(cl.empty)
+        s.remove()
+        cl.resolve()
+        self.assertEqual(self.calls, [])
+
+    def test_removed_subscriptions_are_dropped(self):
+        cl = CallbackList()
+        live = [cl.subscribe(self.callback(i)) for i in range(0, 10)]
+        for i in range(0, 1000):
+            cl.subscribe(self.callback('removed')).remove()
+        self.assertTrue(len(cl._callbacks) <= 2 * len(live) + 2)
+        cl.resolve()
+        self.assertEqual([name for (name, args) in self.calls],
+                list(range(0, 10)))
+
+    def test_subscription_may_be_removed_by_callback(self):
+        c = self.callback('a')
+        cl = CallbackList()
+        cl.subscribe(c)
+        cl.remove(c).resolve()
+        self.assertEqual(self.calls, [])
+
+    def test_subscription_removed_by_callback_is_counted_once(self):
+        a = self.callback('a')
+        cl = CallbackList()
+        s = cl.subscribe(a)
+        cl.done(self.callback('b'))
+        cl.remove(a)
+        s.remove()
+        self.assertFalse(s.alive)
+        self.assertFalse(cl.empty)
+        cl.resolve()
+        self.assertEqual(self.calls, [('b', ())])
+
+
 if "__main__" == __name__:
     unittest.main()
@@ -6,6 +6,7 @@
 #
 from functools import partial
 import unittest
+import weakref
 
 ##
 # test helpers
@@ -15,7 +16,8 @@ from testutils import mock
 ##
 # promise modules
 #
-from promise import Deferred, Promise
+from promise import Deferred, Promise, PENDING, RESOLVED, REJECTED, \
+    CANCELLED
 
 
 class DeferredTestCase(unittest.TestCase):
@@ -317,5 +319,240 @@ class DeferredTestCase(unittest.TestCase):
         self.assertTrue(isinstance(Deferred().promise(), Promise))
 
 
+    def test_deferred_does_not_allocate_instance_dict(self):
+        self.assertFalse(hasattr(Deferred(), '__dict__'))
+
+
+    def test_state_returns_current_state(self):
+        self.assertEqual(Deferred().state, PENDING)
+        self.assertEqual(Deferred().resolve().reject().state, RESOLVED)
+        self.assertEqual(Deferred().reject().resolve().state, REJECTED)
+        self.assertEqual(Deferred().resolve().cancel().state, CANCELLED)
+
+    def test_state_is_switched_before_callbacks_are_called(self):
+        d = Deferred()
+        d.done(lambda: self.c(d.state)).resolve()
+        self.c.assert_called_once_with(RESOLVED)
+
+    def test_only_user_callbacks_are_kept_by_deferred(self):
+        d = Deferred().done(self.c)
+        self.assertEqual(d._done_callbacks._callbacks, self.c)
+        self.assertEqual(d._fail_callbacks, None)
+
+
+    def test_then_with_chain_returns_derived_deferred(self):
+        d = Deferred()
+        derived = d.then(None, None, chain=True)
+        self.assertTrue(isinstance(derived, Deferred))
+        self.assertFalse(derived is d)
+
+    def test_then_with_chain_resolves_derived_with_returned_value(self):
+        d = Deferred()
+        d.then(lambda a, b: a + b, None, chain=True).done(self.c)
+        d.resolve(1, b=2)
+        self.c.assert_called_once_with(3)
+
+    def test_then_with_chain_passes_state_when_callback_is_none(self):
+        c = mock.MagicMock()
+        Deferred().resolve(1, foo=2).then(None, None, chain=True).done(self.c)
+        Deferred().reject(1, foo=2).then(None, None, chain=True).fail(c)
+        self.c.assert_called_once_with(1, foo=2)
+        c.assert_called_once_with(1, foo=2)
+
+    def test_then_with_chain_rejects_derived_with_raised_exception(self):
+        e = RuntimeError()
+
+        def c():
+            raise e
+
+        Deferred().resolve().then(c, None, chain=True).fail(self.c)
+        self.c.assert_called_once_with(e)
+
+    def test_then_with_chain_resolves_derived_with_value_returned_on_error(self):
+        Deferred().reject(1).then(None, lambda a: a + 1, chain=True)\
+            .done(self.c)
+        self.c.assert_called_once_with(2)
+
+    def test_then_with_chain_adopts_returned_deferred(self):
+        c = mock.MagicMock()
+        inner1 = Deferred()
+        inner2 = Deferred()
+        Deferred().resolve().then(lambda: inner1, None, chain=True)\
+            .done(self.c)
+        Deferred().resolve().then(lambda: inner2.promise(), None,
+                chain=True).fail(c)
+        self.assertEqual(self.c.call_count, 0)
+
+        inner1.resolve(1, foo=2)
+        inner2.reject(3)
+
+        self.c.assert_called_once_with(1, foo=2)
+        c.assert_called_once_with(3)
+
+    def test_then_with_chain_rejects_deferred_adopting_itself(self):
+        d = Deferred()
+        derived = d.then(lambda: derived, None, chain=True).fail(self.c)
+        d.resolve()
+        self.c.assert_called_once_with(mock.ANY)
+        self.assertTrue(isinstance(self.c.call_args[0][0], TypeError))
+
+    def test_then_with_chain_handles_long_chains_without_recursion(self):
+        d = Deferred()
+        last = d
+        for i in range(0, 100000):
+            last = last.then(lambda a: a + 1, None, chain=True)
+        last.done(self.c)
+        d.resolve(0)
+        self.c.assert_called_once_with(100000)
+
+    def test_then_with_chain_handles_long_adoption_chains_without_recursion(self):
+        d = Deferred()
+        last = d
+        for i in range(0, 100000):
+            last = Deferred(1).then(partial(lambda p, a: p, last), None,
+                    chain=True)
+        last.done(self.c)
+        d.resolve(0)
+        self.c.assert_called_once_with(0)
+
+    def test_then_with_chain_runs_queued_stages_when_callback_raises(self):
+        d = Deferred()
+        derived = d.then(None, None, chain=True)
+        derived.then(None, None, chain=True).done(self.c)
+        derived.done(mock.MagicMock(side_effect=RuntimeError()))
+        self.assertRaises(RuntimeError, d.resolve, 1)
+        self.c.assert_called_once_with(1)
+
+    def test_on_cancel_callbacks_are_called_on_cancellation(self):
+        Deferred().on_cancel(self.c).cancel()
+        self.c.assert_called_once_with()
+
+    def test_on_cancel_callbacks_are_not_called_after_settlement(self):
+        Deferred().on_cancel(self.c).resolve().cancel()
+        Deferred().on_cancel(self.c).reject().cancel()
+        Deferred().resolve().cancel().on_cancel(self.c)
+        self.assertEqual(self.c.call_count, 0)
+
+    def test_on_cancel_attached_after_cancellation_is_called_immediately(self):
+        Deferred().cancel().on_cancel(self.c)
+        self.c.assert_called_once_with()
+
+    def test_on_cancel_callbacks_are_released_on_settlement(self):
+        d = Deferred().on_cancel(self.c).resolve()
+        self.assertIsNone(d._cancel_callbacks)
+
+    def test_cancel_of_derived_deferred_cancels_parent(self):
+        d = Deferred().on_cancel(self.c)
+        d.then(None, None, chain=True).cancel()
+        self.assertTrue(d.cancelled)
+        self.c.assert_called_once_with()
+
+    def test_cancel_of_derived_deferred_keeps_parent_used_elsewhere(self):
+        d = Deferred().done(self.c)
+        d.then(None, None, chain=True).cancel()
+        self.assertFalse(d.cancelled)
+        d.resolve(1)
+        self.c.assert_called_once_with(1)
+
+    def test_cancel_of_derived_deferred_propagates_through_chain(self):
+        d = Deferred()
+        last = d
+        for i in range(0, 10):
+            last = last.then(None, None, chain=True)
+        last.cancel()
+        self.assertTrue(d.cancelled)
+
+    def test_cancel_of_derived_deferred_cancels_adopted_deferred(self):
+        adopted = Deferred()
+        d = Deferred()
+        derived = d.then(lambda: adopted, None, chain=True)
+        d.resolve()
+        derived.cancel()
+        self.assertTrue(adopted.cancelled)
+
+    def test_cancel_of_derived_deferred_releases_parent(self):
+        d = Deferred()
+        derived = d.then(None, None, chain=True)
+        d.done(self.c)
+        derived.cancel()
+        self.assertEqual(d._done_callbacks._callbacks, [self.c])
+
+    def test_callback_list_class_is_configurable(self):
+        callback_list = mock.MagicMock()
+        with mock.patch.object(Deferred, 'callback_list', callback_list):
+            Deferred().done(self.c)
+        callback_list.return_value.done.assert_called_once_with(self.c)
+
+
+    def test_done_weak_holds_callback_by_weak_reference(self):
+        c = mock.MagicMock()
+        Deferred().done_weak(c).resolve(1)
+        c.assert_called_once_with(1)
+        calls = []
+        c = lambda *args: calls.append(args)
+        ref = weakref.ref(c)
+        d = Deferred().done_weak(c)
+        del c
+        self.assertEqual(ref(), None)
+        d.resolve(1)
+        self.assertEqual(calls, [])
+
+    def test_fail_weak_holds_callback_by_weak_reference(self):
+        c = mock.MagicMock()
+        d = Deferred().fail_weak(c)
+        d.reject(1)
+        c.assert_called_once_with(1)
+
+    def test_done_weak_on_rejected_deferred_does_nothing(self):
+        Deferred().reject().done_weak(self.c)
+        self.assertFalse(self.c.called)
+
+    def test_dead_weak_callbacks_do_not_prevent_release(self):
+        d = Deferred()
+        d.done_weak(lambda: None)
+        d._release()
+        self.assertTrue(d.cancelled)
+
+
+    def test_subscribe_attaches_removable_callbacks(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        d.subscribe(c)
+        d.subscribe(self.c).remove()
+        d.resolve(1)
+        c.assert_called_once_with(1)
+        self.assertFalse(self.c.called)
+
+    def test_subscribe_fail_attaches_removable_callbacks(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        d.subscribe_fail(c)
+        d.subscribe_fail(self.c).remove()
+        d.reject(1)
+        c.assert_called_once_with(1)
+        self.assertFalse(self.c.called)
+
+    def test_subscribe_to_other_resolution_does_nothing(self):
+        s = Deferred().reject().subscribe(self.c)
+        self.assertFalse(s.alive)
+        s.remove()
+        self.assertFalse(self.c.called)
+
+    def test_removal_of_last_subscription_allows_release(self):
+        d = Deferred()
+        d.subscribe(self.c).remove()
+        d._release()
+        self.assertTrue(d.cancelled)
+
+    def test_subscription_removed_twice_does_not_allow_release(self):
+        d = Deferred()
+        s = d.subscribe(self.c)
+        d.done(self.c.other)
+        d._detach(self.c, None)
+        s.remove()
+        d._release()
+        self.assertFalse(d.cancelled)
+
+
 if "__main__" == __name__:
     unittest.main()
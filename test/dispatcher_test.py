@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import unittest
+
+try:
+    import asyncio
+except ImportError:  # python < 3.4
+    asyncio = None
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import CallbackList, CallbackError, Deferred, Dispatcher, \
+    Monitor, priority, when, AGGREGATE
+
+
+def deferred_class(dispatch, **attributes):
+    """
+    Returns Deferred subclass firing callbacks with given dispatch target
+    (and other attributes of callback list)
+    """
+    attributes['dispatch'] = dispatch
+    callback_list = type('DispatchedCallbackList', (CallbackList, ),
+            attributes)
+    return type('DispatchedDeferred', (Deferred, ),
+            {'callback_list': callback_list})
+
+
+class CallbackListDispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.dispatch = mock.MagicMock(
+            side_effect=lambda func, *args: self.calls.append((func, args)))
+        self.Deferred = deferred_class(self.dispatch)
+
+    def test_callbacks_are_called_at_once_by_default(self):
+        self.assertEqual(CallbackList.dispatch, None)
+
+    def test_callbacks_are_passed_to_dispatch_on_resolution(self):
+        c = mock.MagicMock()
+        d = self.Deferred().done(c)
+        d.resolve(1, 2)
+        self.assertFalse(c.called)
+        self.assertEqual(self.calls, [(c, (1, 2))])
+
+    def test_callbacks_attached_to_settled_deferred_are_dispatched(self):
+        c = mock.MagicMock()
+        self.Deferred().reject(1).fail(c)
+        self.assertFalse(c.called)
+        self.assertEqual(self.calls, [(c, (1, ))])
+
+    def test_keyword_arguments_are_bound_to_callback(self):
+        c = mock.MagicMock()
+        self.Deferred().done(c).resolve(1, foo=2)
+        (func, args) = self.calls[0]
+        func(*args)
+        c.assert_called_once_with(1, foo=2)
+
+    def test_plain_function_is_not_bound_as_method(self):
+        calls = []
+
+        def dispatch(func, *args):
+            calls.append(args)
+        self.Deferred = deferred_class(dispatch)
+        self.Deferred().done(mock.MagicMock()).resolve(1)
+        self.assertEqual(calls, [(1, )])
+
+
+class DispatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.order = []
+
+    def callback(self, name, cost=0):
+        def callback(*args):
+            self.clock.now += cost
+            self.order.append(name)
+        return callback
+
+    def test_callbacks_are_queued_until_run(self):
+        dispatcher = Dispatcher()
+        dispatcher(self.callback('a'))
+        dispatcher(self.callback('b'))
+        self.assertEqual(len(dispatcher), 2)
+        self.assertEqual(self.order, [])
+        self.assertEqual(dispatcher.run(), 0)
+        self.assertEqual(self.order, ['a', 'b'])
+
+    def test_arguments_are_passed_to_callbacks(self):
+        c = mock.MagicMock()
+        dispatcher = Dispatcher()
+        dispatcher(c, 1, 2)
+        dispatcher.run()
+        c.assert_called_once_with(1, 2)
+
+    def test_callbacks_with_higher_priority_run_first(self):
+        dispatcher = Dispatcher()
+        dispatcher(self.callback('a'))
+        dispatcher(priority(self.callback('b'), -1))
+        dispatcher(priority(self.callback('c'), 10))
+        dispatcher(self.callback('d'))
+        dispatcher.run()
+        self.assertEqual(self.order, ['c', 'a', 'd', 'b'])
+
+    def test_run_stops_once_budget_is_used(self):
+        dispatcher = Dispatcher(budget=1000, clock=self.clock)
+        for name in 'abcd':
+            dispatcher(self.callback(name, 0.0006))
+        self.assertEqual(dispatcher.run(), 2)
+        self.assertEqual(self.order, ['a', 'b'])
+        self.assertEqual(dispatcher.run(), 0)
+        self.assertEqual(self.order, ['a', 'b', 'c', 'd'])
+
+    def test_run_calls_at_least_one_callback(self):
+        dispatcher = Dispatcher(budget=0, clock=self.clock)
+        dispatcher(self.callback('a', 1))
+        dispatcher(self.callback('b', 1))
+        self.assertEqual(dispatcher.run(), 1)
+
+    def test_run_is_scheduled_once_while_callbacks_wait(self):
+        schedule = mock.MagicMock()
+        dispatcher = Dispatcher(budget=1000, schedule=schedule,
+                clock=self.clock)
+        dispatcher(self.callback('a', 0.001))
+        dispatcher(self.callback('b', 0.001))
+        schedule.assert_called_once_with(dispatcher.run)
+        dispatcher.run()
+        self.assertEqual(schedule.call_count, 2)
+        dispatcher.run()
+        self.assertEqual(schedule.call_count, 2)
+        dispatcher(self.callback('c'))
+        self.assertEqual(schedule.call_count, 3)
+
+    def test_errors_do_not_stop_other_callbacks(self):
+        c = mock.MagicMock()
+        dispatcher = Dispatcher()
+        dispatcher(mock.MagicMock(side_effect=ValueError()))
+        dispatcher(c)
+        self.assertRaises(ValueError, dispatcher.run)
+        self.assertTrue(c.called)
+
+    def test_resolution_does_not_wait_for_callbacks(self):
+        dispatcher = Dispatcher()
+        c = mock.MagicMock()
+        d = deferred_class(dispatcher)().done(c, priority(c, 1))
+        d.resolve(1, foo=2)
+        self.assertFalse(c.called)
+        dispatcher.run()
+        self.assertEqual(c.call_count, 2)
+        c.assert_called_with(1, foo=2)
+
+    def test_cascades_are_run_by_dispatcher(self):
+        dispatcher = Dispatcher()
+        Deferred = deferred_class(dispatcher)
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+        when(d1, d2).done(c)
+        d1.resolve(1)
+        d2.resolve(2)
+        dispatcher.run()
+        c.assert_called_once_with(((1, ), {}), ((2, ), {}))
+
+    def test_dispatched_callbacks_honour_error_handler(self):
+        dispatcher = Dispatcher()
+        on_error = mock.MagicMock()
+        error = ValueError()
+        failing = mock.MagicMock(side_effect=error)
+        c = mock.MagicMock()
+        Deferred = deferred_class(dispatcher, on_error=on_error)
+        Deferred().done(failing, priority(c, 1)).resolve(1)
+        self.assertEqual(dispatcher.run(), 0)
+        on_error.assert_called_once_with(failing, error)
+        c.assert_called_once_with(1)
+
+    def test_dispatched_callbacks_honour_aggregate_policy(self):
+        dispatcher = Dispatcher()
+        c = mock.MagicMock()
+        Deferred = deferred_class(dispatcher, on_error=AGGREGATE)
+        Deferred().done(mock.MagicMock(side_effect=ValueError()), c)\
+            .resolve(1)
+        self.assertRaises(CallbackError, dispatcher.run)
+        c.assert_called_once_with(1)
+
+    def test_dispatched_callbacks_are_measured_by_monitor(self):
+        dispatcher = Dispatcher()
+        monitor = Monitor()
+        c = mock.MagicMock()
+        Deferred = deferred_class(dispatcher, monitor=monitor,
+                on_error=mock.MagicMock())
+        Deferred().done(c, mock.MagicMock(side_effect=ValueError()))\
+            .resolve(1, foo=2)
+        dispatcher.run()
+        c.assert_called_once_with(1, foo=2)
+        metrics = monitor.metrics()
+        self.assertEqual(metrics['callbacks'], 2)
+        self.assertEqual(metrics['callback_errors'], 1)
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class LoopDispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_callbacks_may_be_dispatched_with_call_soon(self):
+        c = mock.MagicMock()
+        d = deferred_class(self.loop.call_soon)().done(c)
+        d.resolve(1)
+        self.assertFalse(c.called)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        c.assert_called_once_with(1)
+
+    def test_dispatcher_may_be_run_by_loop(self):
+        c = mock.MagicMock()
+        dispatcher = Dispatcher(budget=100, schedule=self.loop.call_soon)
+        d = deferred_class(dispatcher)().done(c, c)
+        d.resolve(1)
+        self.assertFalse(c.called)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(c.call_count, 2)
+
+
+if "__main__" == __name__:
+    unittest.main()
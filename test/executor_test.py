@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+from concurrent import futures
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+
+##
+# promise modules
+#
+from promise import Deferred, ThreadSafeDeferred, Promise
+
+
+def fail(*args):
+    raise RuntimeError(*args)
+
+
+class ExecutorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.executor = futures.ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    def wait(self):
+        self.executor.shutdown(wait=True)
+
+    def test_run_in_returns_instance_of_given_class(self):
+        self.assertTrue(isinstance(
+            ThreadSafeDeferred.run_in(self.executor, abs, 1),
+            ThreadSafeDeferred))
+
+    def test_run_in_resolves_deferred_with_result(self):
+        d = ThreadSafeDeferred.run_in(self.executor, divmod, 7, 2)
+        self.wait()
+        d.done(self.c)
+        self.c.assert_called_once_with((3, 1))
+
+    def test_run_in_passes_keyword_arguments_to_function(self):
+        d = ThreadSafeDeferred.run_in(self.executor, int, '11', base=2)
+        self.wait()
+        d.done(self.c)
+        self.c.assert_called_once_with(3)
+
+    def test_run_in_rejects_deferred_with_raised_exception(self):
+        d = ThreadSafeDeferred.run_in(self.executor, fail, 1)
+        self.wait()
+        d.fail(self.c)
+        self.c.assert_called_once_with(mock.ANY)
+        self.assertTrue(isinstance(self.c.call_args[0][0], RuntimeError))
+
+    def test_run_in_settles_deferred_through_dispatch_target(self):
+        dispatch = mock.MagicMock()
+        d = Deferred.run_in(self.executor, abs, -1, dispatch=dispatch)
+        self.wait()
+        self.assertFalse(d.resolved)
+
+        (func, future) = dispatch.call_args[0]
+        func(future)
+        self.assertTrue(d.resolved)
+
+    def test_cancel_of_deferred_cancels_submitted_task(self):
+        future = futures.Future()
+        Deferred.from_future(future).cancel()
+        self.assertTrue(future.cancelled())
+
+    def test_map_in_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(
+            Deferred.map_in(self.executor, abs, []), Promise))
+
+    def test_map_in_builds_output_of_given_class(self):
+        p = ThreadSafeDeferred.map_in(self.executor, abs, range(0, 10),
+                chunksize=3)
+        self.assertTrue(isinstance(p._Promise__deferred, ThreadSafeDeferred))
+        p.done(self.c)
+        self.wait()
+        self.c.assert_called_once_with(list(range(0, 10)))
+
+    def test_map_in_resolves_with_ordered_results(self):
+        p = Deferred.map_in(self.executor, abs, range(0, -100, -1),
+                chunksize=7)
+        self.wait()
+        p.done(self.c)
+        self.c.assert_called_once_with(list(range(0, 100)))
+
+    def test_map_in_submits_items_in_chunks(self):
+        executor = mock.MagicMock()
+        Deferred.map_in(executor, abs, range(0, 10), chunksize=4)
+        self.assertEqual([call[0][2] for call in
+            executor.submit.call_args_list], [[0, 1, 2, 3], [4, 5, 6, 7],
+                [8, 9]])
+
+    def test_map_in_rejects_with_raised_exception(self):
+        p = Deferred.map_in(self.executor, fail, range(0, 10), chunksize=3)
+        self.wait()
+        p.fail(self.c)
+        self.c.assert_called_once_with(mock.ANY)
+        self.assertTrue(isinstance(self.c.call_args[0][0], RuntimeError))
+
+    def test_map_in_of_plain_deferred_settles_under_load(self):
+        for i in range(0, 300):
+            executor = futures.ThreadPoolExecutor(4)
+            p = Deferred.map_in(executor, abs, range(0, 200))
+            executor.shutdown(wait=True)
+            self.assertTrue(p.resolved, 'run %d did not settle' % i)
+
+    def test_map_in_works_with_process_pool(self):
+        executor = futures.ProcessPoolExecutor(2)
+        p = Deferred.map_in(executor, abs, range(0, -10, -1), chunksize=3)
+        executor.shutdown(wait=True)
+        p.done(self.c)
+        self.c.assert_called_once_with(list(range(0, 10)))
+
+
+if "__main__" == __name__:
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import threading
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import BatchLoader, Deferred, Promise, TimerWheel
+
+
+class BatchLoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.batch = mock.MagicMock(side_effect=lambda keys: [key * 10
+            for key in keys])
+
+    def test_load_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(BatchLoader(self.batch).load(1), Promise))
+
+    def test_keys_are_loaded_in_one_batch(self):
+        loader = BatchLoader(self.batch)
+        loader.load(1).done(self.c.one)
+        loader.load(2).done(self.c.two)
+        self.assertEqual(self.batch.call_count, 0)
+        loader.dispatch()
+        self.batch.assert_called_once_with([1, 2])
+        self.assertEqual(self.c.mock_calls, [mock.call.one(10),
+            mock.call.two(20)])
+
+    def test_requests_for_the_same_key_share_deferred(self):
+        loader = BatchLoader(self.batch)
+        self.assertTrue(loader.load(1) is loader.load(1))
+        loader.dispatch()
+        self.batch.assert_called_once_with([1])
+
+    def test_requests_for_key_being_loaded_share_deferred(self):
+        d = Deferred()
+        loader = BatchLoader(mock.MagicMock(return_value=d))
+        p = loader.load(1)
+        loader.dispatch()
+        self.assertTrue(loader.load(1) is p)
+        d.resolve([10])
+        self.assertFalse(loader.load(1) is p)
+
+    def test_batch_is_dispatched_once_max_size_is_reached(self):
+        loader = BatchLoader(self.batch, max_size=2)
+        loader.load(1)
+        self.assertEqual(self.batch.call_count, 0)
+        loader.load(2)
+        self.batch.assert_called_once_with([1, 2])
+
+    def test_batch_is_dispatched_by_scheduled_call(self):
+        schedule = mock.MagicMock()
+        loader = BatchLoader(self.batch, schedule=schedule)
+        loader.load(1)
+        loader.load(2)
+        schedule.assert_called_once_with(loader.dispatch)
+        schedule.call_args[0][0]()
+        self.batch.assert_called_once_with([1, 2])
+
+    def test_batch_is_dispatched_after_delay(self):
+        clock = Clock()
+        wheel = TimerWheel(tick=1, clock=clock)
+        loader = BatchLoader(self.batch, delay=2, wheel=wheel)
+        loader.load(1)
+        loader.load(2)
+        clock.now = 2
+        wheel.advance()
+        self.batch.assert_called_once_with([1, 2])
+
+    def test_batch_is_dispatched_by_shared_wheel_in_background(self):
+        event = threading.Event()
+        loader = BatchLoader(self.batch, delay=0.02)
+        loader.load(1).done(lambda value: event.set())
+        loader.load(2)
+        self.assertTrue(event.wait(5))
+        self.batch.assert_called_once_with([1, 2])
+
+    def test_batch_may_return_dictionary(self):
+        loader = BatchLoader(lambda keys: {1: 'a'})
+        loader.load(1).done(self.c)
+        loader.load(2).fail(self.c)
+        loader.dispatch()
+        self.assertEqual(self.c.call_args_list[0], mock.call('a'))
+        self.assertTrue(isinstance(self.c.call_args[0][0], KeyError))
+
+    def test_batch_may_return_deferred(self):
+        d = Deferred()
+        loader = BatchLoader(lambda keys: d)
+        loader.load(1).done(self.c)
+        loader.dispatch()
+        d.resolve([10])
+        self.c.assert_called_once_with(10)
+
+    def test_exceptions_returned_by_batch_reject_keys(self):
+        e = RuntimeError()
+        loader = BatchLoader(lambda keys: [e, 1])
+        loader.load(1).fail(self.c)
+        loader.load(2).done(self.c)
+        loader.dispatch()
+        self.assertEqual(self.c.mock_calls, [mock.call(e), mock.call(1)])
+
+    def test_error_raised_by_batch_rejects_all_keys(self):
+        e = RuntimeError()
+        loader = BatchLoader(mock.MagicMock(side_effect=e))
+        loader.load(1).fail(self.c)
+        loader.load(2).fail(self.c)
+        loader.dispatch()
+        self.assertEqual(self.c.mock_calls, [mock.call(e), mock.call(e)])
+
+    def test_wrong_number_of_values_rejects_all_keys(self):
+        loader = BatchLoader(lambda keys: [1])
+        loader.load(1).fail(self.c)
+        loader.load(2).fail(self.c)
+        loader.dispatch()
+        self.assertEqual(self.c.call_count, 2)
+        self.assertTrue(isinstance(self.c.call_args[0][0], ValueError))
+
+    def test_cancelled_key_is_loaded_again(self):
+        loader = BatchLoader(self.batch)
+        p = loader.load(1)
+        p.abandon()
+        loader.load(1).done(self.c)
+        loader.dispatch()
+        self.batch.assert_called_once_with([1])
+        self.c.assert_called_once_with(10)
+
+    def test_load_many_resolves_with_list_of_values(self):
+        loader = BatchLoader(self.batch)
+        loader.load_many([1, 2, 1]).done(self.c)
+        loader.dispatch()
+        self.batch.assert_called_once_with([1, 2])
+        self.c.assert_called_once_with([10, 20, 10])
+
+
+if "__main__" == __name__:
+    unittest.main()
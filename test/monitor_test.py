@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import gc
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import CallbackList, Deferred, Exporter, Histogram, Monitor, \
+    ThreadSafeDeferred
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.h = Histogram()
+
+    def test_empty_histogram_has_no_percentiles(self):
+        self.assertEqual(self.h.count, 0)
+        self.assertEqual(self.h.percentile(50), None)
+        self.assertEqual(self.h.summary()['mean'], None)
+
+    def test_record_counts_durations(self):
+        self.h.record(0.001)
+        self.h.record(0.003)
+        self.assertEqual(self.h.count, 2)
+        self.assertEqual(self.h.min, 0.001)
+        self.assertEqual(self.h.max, 0.003)
+        self.assertAlmostEqual(self.h.summary()['mean'], 0.002)
+
+    def test_small_values_are_exact(self):
+        self.h.record(0.000005)
+        self.assertAlmostEqual(self.h.percentile(100), 0.000005)
+
+    def test_every_value_falls_into_bucket_bounding_it(self):
+        for value in range(0, 100000, 7):
+            index = self.h._index(value)
+            low = self.h._highest(index - 1) + 1 if index else 0
+            self.assertTrue(low <= value <= self.h._highest(index))
+
+    def test_buckets_have_bounded_relative_width(self):
+        for value in range(32, 100000, 7):
+            index = self.h._index(value)
+            width = self.h._highest(index) - self.h._highest(index - 1)
+            self.assertTrue(width <= value / 16.0)
+
+    def test_percentile_is_within_relative_error(self):
+        for i in range(1, 1001):
+            self.h.record(i * 0.001)
+        self.assertTrue(0.5 <= self.h.percentile(50) <= 0.5 * 1.07)
+        self.assertTrue(0.99 <= self.h.percentile(99) <= 0.99 * 1.07)
+        self.assertEqual(self.h.percentile(100), 1.0)
+
+
+class MonitorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.monitor = Monitor(clock=self.clock).enable()
+
+    def tearDown(self):
+        self.monitor.disable()
+
+    def test_monitoring_is_disabled_by_default(self):
+        self.monitor.disable()
+        self.assertEqual(Deferred.monitor, None)
+        self.assertEqual(CallbackList.monitor, None)
+        Deferred().resolve()
+        self.assertEqual(self.monitor.counters['created'], 0)
+
+    def test_enable_sets_monitor_of_classes(self):
+        self.assertTrue(Deferred.monitor is self.monitor)
+        self.assertTrue(CallbackList.monitor is self.monitor)
+
+    def test_disable_leaves_other_monitor_enabled(self):
+        other = Monitor().enable()
+        self.monitor.disable()
+        self.assertTrue(Deferred.monitor is other)
+        other.disable()
+
+    def test_counts_settled_deferreds(self):
+        Deferred().resolve()
+        Deferred().reject()
+        Deferred().cancel()
+        c = self.monitor.counters
+        self.assertEqual(c['created'], 3)
+        self.assertEqual(c['resolved'], 1)
+        self.assertEqual(c['rejected'], 1)
+        self.assertEqual(c['cancelled'], 1)
+
+    def test_cancelling_settled_deferred_is_not_counted(self):
+        Deferred().resolve().cancel()
+        self.assertEqual(self.monitor.counters['cancelled'], 0)
+
+    def test_pending_counts_live_pending_deferreds(self):
+        d = Deferred()
+        e = Deferred()
+        Deferred().resolve()
+        self.assertEqual(self.monitor.pending, 2)
+        d.resolve()
+        self.assertEqual(self.monitor.pending, 1)
+        del e
+        gc.collect()
+        self.assertEqual(self.monitor.pending, 0)
+
+    def test_records_time_deferred_was_pending(self):
+        d = Deferred()
+        self.clock.now += 0.5
+        d.resolve()
+        latency = self.monitor.settle_latency
+        self.assertEqual(latency.count, 1)
+        self.assertEqual(latency.max, 0.5)
+
+    def test_deferred_created_before_enabling_has_no_latency(self):
+        self.monitor.disable()
+        d = Deferred()
+        self.monitor.enable()
+        d.resolve()
+        self.assertEqual(self.monitor.counters['resolved'], 1)
+        self.assertEqual(self.monitor.settle_latency.count, 0)
+
+    def test_thread_safe_deferred_is_monitored(self):
+        d = ThreadSafeDeferred()
+        self.assertEqual(self.monitor.pending, 1)
+        d.reject()
+        self.assertEqual(self.monitor.counters['rejected'], 1)
+        self.assertEqual(self.monitor.pending, 0)
+
+    def test_callbacks_are_measured(self):
+        c = mock.MagicMock()
+        Deferred().done(c, c).resolve(1)
+        c.assert_called_with(1)
+        self.assertEqual(self.monitor.counters['callbacks'], 2)
+        self.assertEqual(self.monitor.callback_time.count, 2)
+
+    def test_callback_errors_are_counted_and_raised(self):
+        def failing():
+            raise ValueError()
+        d = Deferred().done(failing)
+        self.assertRaises(ValueError, d.resolve)
+        self.assertEqual(self.monitor.counters['callback_errors'], 1)
+
+    def test_callback_errors_follow_on_error_policy(self):
+        def failing():
+            raise ValueError()
+        c = mock.MagicMock()
+        handler = mock.MagicMock()
+        CallbackList.on_error = handler
+        try:
+            Deferred().done(failing, c).resolve()
+        finally:
+            CallbackList.on_error = None
+        c.assert_called_once_with()
+        self.assertEqual(handler.call_count, 1)
+        self.assertEqual(self.monitor.counters['callback_errors'], 1)
+
+    def test_metrics_contains_all_metrics(self):
+        Deferred().done(mock.MagicMock()).resolve()
+        metrics = self.monitor.metrics()
+        self.assertEqual(metrics['created'], 1)
+        self.assertEqual(metrics['pending'], 0)
+        self.assertEqual(metrics['settle_latency']['count'], 1)
+        self.assertEqual(metrics['callback_time']['count'], 1)
+
+    def test_export_passes_metrics_to_exporters(self):
+        exporter = mock.MagicMock()
+        self.monitor.exporters.append(exporter)
+        metrics = self.monitor.export()
+        exporter.export.assert_called_once_with(metrics)
+
+    def test_exporter_has_to_implement_export(self):
+        self.assertRaises(NotImplementedError, Exporter().export, {})
+
+
+if "__main__" == __name__:
+    unittest.main()
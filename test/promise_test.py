@@ -5,7 +5,9 @@
 # python standard library
 #
 from functools import partial
+import gc
 import unittest
+import weakref
 
 ##
 # test helpers
@@ -15,7 +17,7 @@ from testutils import mock
 ##
 # promise modules
 #
-from promise import Promise
+from promise import Promise, Deferred, PENDING, RESOLVED, when
 
 
 class PromiseTestCase(unittest.TestCase):
@@ -34,9 +36,13 @@ class PromiseTestCase(unittest.TestCase):
             err = True
         self.assertFalse(err)
 
-    def test_promise_works_as_proxy_for_given_object(self):
-        Promise(self.d).foo()
-        self.d.foo.assert_called_once_with()
+    def test_promise_does_not_expose_other_attributes_of_deferred(self):
+        d = Deferred()
+        p = d.promise()
+        for name in ('foo', 'timeout', '_cancel', '_expire', '_settle_with',
+                '_release', '_detach'):
+            self.assertRaises(AttributeError, getattr, p, name)
+        self.assertEqual(d.state, PENDING)
 
     def test_promise_rejects_call_to_resolve_method(self):
         self.assertRaises(RuntimeError, partial(getattr, Promise(self.d),
@@ -53,6 +59,100 @@ class PromiseTestCase(unittest.TestCase):
                 'cancel'))
         self.assertEqual(self.d.cancel.call_count, 0)
 
+    def test_promise_is_created_once_per_deferred(self):
+        d = Deferred()
+        self.assertTrue(d.promise() is d.promise())
+        self.assertTrue(d.promise().promise() is d.promise())
+
+    def test_promise_of_pending_deferred_is_kept_without_holder(self):
+        d = Deferred()
+        ref = weakref.ref(d.promise())
+        self.assertTrue(ref() is d.promise())
+
+    def test_promise_is_kept_across_settlement_while_held(self):
+        d = Deferred()
+        p = d.promise()
+        d.resolve(1)
+        self.assertTrue(d.promise() is p)
+
+    def test_done_fail_and_then_return_promise(self):
+        p = Promise(self.d)
+        self.assertTrue(p.done(1) is p)
+        self.assertTrue(p.fail(1) is p)
+        self.assertTrue(p.then(1, 2) is p)
+        self.d.done.assert_called_once_with(1)
+        self.d.fail.assert_called_once_with(1)
+        self.d.then.assert_called_once_with(1, 2, False)
+
+    def test_then_with_chain_returns_derived_deferred(self):
+        d = Deferred()
+        derived = d.promise().then(None, None, chain=True)
+        self.assertTrue(isinstance(derived, Deferred))
+        self.assertFalse(derived is d)
+
+    def test_promise_reflects_state_of_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        p = d.promise().done(c)
+        self.assertFalse(p.resolved)
+        d.resolve(1)
+        c.assert_called_once_with(1)
+        self.assertTrue(p.resolved)
+        self.assertFalse(p.rejected)
+        self.assertFalse(p.cancelled)
+        self.assertEqual(p.state, RESOLVED)
+
+    def test_abandon_cancels_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred().on_cancel(c)
+        p = d.promise()
+        self.assertTrue(p.abandon() is p)
+        self.assertTrue(d.cancelled)
+        c.assert_called_once_with()
+
+    def test_promise_does_not_allocate_instance_dict(self):
+        self.assertFalse(hasattr(Promise(None), '__dict__'))
+
+    def test_on_cancel_is_passed_to_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        p = d.promise()
+        self.assertTrue(p.on_cancel(c) is p)
+        d.cancel()
+        c.assert_called_once_with()
+
+    def test_resolved_deferred_with_promise_is_freed_without_gc(self):
+        gc.disable()
+        try:
+            d = Deferred()
+            d.promise().done(mock.MagicMock())
+            d.resolve(1)
+            ref = weakref.ref(d)
+            del d
+            self.assertEqual(ref(), None)
+            p = when(1, Deferred(2))
+            ref = weakref.ref(p)
+            del p
+            self.assertEqual(ref(), None)
+        finally:
+            gc.enable()
+
+    def test_done_weak_and_fail_weak_are_passed_to_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        self.assertTrue(d.promise().done_weak(c).fail_weak(c) is not None)
+        d.resolve(1)
+        c.assert_called_once_with(1)
+
+
+    def test_subscribe_and_subscribe_fail_are_passed_to_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        d.promise().subscribe(c).remove()
+        d.promise().subscribe_fail(c)
+        d.reject(1)
+        c.assert_called_once_with(1)
+
 
 if "__main__" == __name__:
     unittest.main()
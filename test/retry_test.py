@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import threading
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import Deferred, Promise, RetryBudget, TimerWheel, retry
+
+
+class RetryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1, clock=self.clock)
+        self.attempts = []
+
+    def factory(self):
+        d = Deferred()
+        self.attempts.append(d)
+        return d
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.wheel.advance()
+
+    def retry(self, attempts=3, **kwargs):
+        kwargs.setdefault('backoff', 1)
+        kwargs.setdefault('jitter', 0)
+        return retry(self.factory, attempts, wheel=self.wheel, **kwargs)
+
+    def test_retry_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(self.retry(), Promise))
+
+    def test_first_attempt_is_made_immediately(self):
+        self.retry().done(self.c)
+        self.attempts[0].resolve(1)
+        self.c.assert_called_once_with(1)
+
+    def test_failed_attempt_is_retried_after_backoff(self):
+        self.retry().done(self.c)
+        self.attempts[0].reject()
+        self.assertEqual(len(self.attempts), 1)
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 2)
+        self.attempts[1].resolve(2)
+        self.c.assert_called_once_with(2)
+
+    def test_backoff_is_doubled_with_each_attempt(self):
+        self.retry(attempts=4)
+        self.attempts[0].reject()
+        self.advance(1)
+        self.attempts[1].reject()
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 2)
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 3)
+        self.attempts[2].reject()
+        self.advance(3)
+        self.assertEqual(len(self.attempts), 3)
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 4)
+
+    def test_backoff_may_be_function(self):
+        backoff = mock.MagicMock(return_value=5)
+        self.retry(backoff=backoff)
+        self.attempts[0].reject()
+        backoff.assert_called_once_with(1)
+        self.advance(4)
+        self.assertEqual(len(self.attempts), 1)
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 2)
+
+    def test_last_failure_rejects_output(self):
+        self.retry(attempts=2).fail(self.c)
+        self.attempts[0].reject(1)
+        self.advance(1)
+        self.attempts[1].reject(2)
+        self.c.assert_called_once_with(2)
+
+    def test_error_raised_by_factory_is_retried(self):
+        factory = mock.MagicMock(side_effect=[RuntimeError(), 1])
+        retry(factory, 2, backoff=1, wheel=self.wheel).done(self.c)
+        self.advance(2)
+        self.c.assert_called_once_with(1)
+
+    def test_only_errors_matching_retry_on_are_retried(self):
+        self.retry(retry_on=KeyError).fail(self.c)
+        e = RuntimeError()
+        self.attempts[0].reject(e)
+        self.c.assert_called_once_with(e)
+
+    def test_retry_on_may_be_function(self):
+        retry_on = mock.MagicMock(return_value=False)
+        self.retry(retry_on=retry_on).fail(self.c)
+        e = RuntimeError()
+        self.attempts[0].reject(e)
+        retry_on.assert_called_once_with(e)
+        self.c.assert_called_once_with(e)
+
+    def test_retries_are_limited_by_budget(self):
+        budget = RetryBudget(rate=0, capacity=1)
+        self.retry(budget=budget)
+        self.retry(budget=budget).fail(self.c)
+        self.attempts[0].reject()
+        self.attempts[1].reject(2)
+        self.c.assert_called_once_with(2)
+        self.advance(1)
+        self.assertEqual(len(self.attempts), 3)
+
+    def test_cancel_stops_retrying(self):
+        p = self.retry()
+        self.attempts[0].reject()
+        p.abandon()
+        self.advance(10)
+        self.assertEqual(len(self.attempts), 1)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel_cancels_pending_attempt(self):
+        self.retry().abandon()
+        self.assertTrue(self.attempts[0].cancelled)
+
+
+    def test_shared_wheel_retries_in_background(self):
+        event = threading.Event()
+        retry(self.factory, 2, backoff=0.01, jitter=0).done(
+            lambda value: event.set())
+        self.attempts[0].reject()
+        # second attempt is made in thread of shared wheel
+        for i in range(0, 500):
+            if len(self.attempts) == 2:
+                break
+            event.wait(0.01)
+        self.attempts[1].resolve(1)
+        self.assertTrue(event.wait(5))
+
+
+class RetryBudgetTestCase(unittest.TestCase):
+
+    def test_tokens_are_taken_and_refilled(self):
+        clock = Clock()
+        budget = RetryBudget(rate=2, capacity=3, clock=clock)
+        self.assertEqual([budget.acquire() for i in range(0, 4)],
+                [True, True, True, False])
+        clock.now = 0.5
+        self.assertTrue(budget.acquire())
+        self.assertFalse(budget.acquire())
+        clock.now = 100
+        self.assertEqual(budget.tokens, 3)
+
+
+if "__main__" == __name__:
+    unittest.main()
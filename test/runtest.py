@@ -6,7 +6,9 @@ import sys
 import unittest
 
 TEST_MODULES = ['deferred_test', 'when_test', 'callback_list_test', \
-    'promise_test']
+    'promise_test', 'asyncio_test', 'threadsafe_test', 'executor_test', \
+    'timer_test', 'loader_test', 'cache_test', 'retry_test', 'monitor_test', \
+    'dispatcher_test']
 
 
 def all():
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+from functools import partial
+import sys
+import threading
+import unittest
+
+##
+# test helpers
+#
+from testutils import mock
+
+##
+# promise modules
+#
+from promise import ThreadSafeDeferred, ThreadSafeCallbackList, CANCELLED
+
+
+def hammer(workers, *targets):
+    """
+    Runs each of given targets in "workers" threads started at once
+    """
+    barrier = threading.Barrier(workers * len(targets))
+
+    def run(target):
+        barrier.wait()
+        target()
+
+    threads = [threading.Thread(target=run, args=(target, ))
+            for target in targets for i in range(0, workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ThreadSafeCallbackListTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+
+    def test_resolve_fires_callbacks(self):
+        ThreadSafeCallbackList().done(self.c).resolve(1)
+        self.c.assert_called_once_with(1)
+
+    def test_done_after_resolvement_fires_callbacks_immediately(self):
+        ThreadSafeCallbackList().resolve(1).done(self.c)
+        self.c.assert_called_once_with(1)
+
+    def test_callbacks_attached_while_firing_are_fired_in_order(self):
+        l = ThreadSafeCallbackList()
+        l.done(lambda: l.done(self.c.third), self.c.second).resolve()
+        self.assertEqual(self.c.mock_calls, [mock.call.second(),
+                mock.call.third()])
+
+    def test_callbacks_attached_after_error_are_fired_immediately(self):
+        l = ThreadSafeCallbackList()
+        l.done(mock.MagicMock(side_effect=RuntimeError()))
+        self.assertRaises(RuntimeError, l.resolve)
+        l.done(self.c)
+        self.c.assert_called_once_with()
+
+    def test_cancel_terminates_resolution(self):
+        ThreadSafeCallbackList().done(self.c).cancel().resolve()
+        self.assertEqual(self.c.call_count, 0)
+
+
+class ThreadSafeDeferredTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+    def test_resolve_fires_callbacks(self):
+        ThreadSafeDeferred().done(self.c).resolve(1).done(self.c)
+        self.assertEqual(self.c.call_args_list, [mock.call(1), mock.call(1)])
+
+    def test_reject_fires_callbacks(self):
+        ThreadSafeDeferred().fail(self.c).reject(1).fail(self.c)
+        self.assertEqual(self.c.call_args_list, [mock.call(1), mock.call(1)])
+
+    def test_deferred_can_be_settled_once(self):
+        ThreadSafeDeferred().then(self.c, self.c).resolve(1).reject(2)
+        self.c.assert_called_once_with(1)
+
+    def test_cancel_terminates_deferred(self):
+        ThreadSafeDeferred().then(self.c, self.c).cancel().resolve()
+        self.assertEqual(self.c.call_count, 0)
+
+    def test_on_cancel_callbacks_may_use_deferred(self):
+        d = ThreadSafeDeferred()
+        d.on_cancel(lambda: self.c(d.state)).cancel()
+        self.c.assert_called_once_with(CANCELLED)
+
+    def test_chained_deferred_is_thread_safe_too(self):
+        d = ThreadSafeDeferred().then(None, None, chain=True)
+        self.assertTrue(isinstance(d, ThreadSafeDeferred))
+
+    def test_callbacks_attached_concurrently_with_resolution_fire_once(self):
+        for i in range(0, 50):
+            calls = []
+            d = ThreadSafeDeferred()
+
+            def attach():
+                for j in range(0, 100):
+                    d.done(calls.append)
+
+            hammer(4, attach, partial(d.resolve, 1))
+            self.assertEqual(len(calls), 400)
+
+    def test_concurrent_settlement_fires_callbacks_of_one_kind_once(self):
+        for i in range(0, 50):
+            calls = []
+            d = ThreadSafeDeferred()
+
+            def attach():
+                for j in range(0, 100):
+                    d.then(calls.append, calls.append)
+
+            hammer(2, attach, partial(d.resolve, 1), partial(d.reject, 2))
+            self.assertEqual(len(calls), 200)
+            self.assertEqual(len(set(calls)), 1)
+
+
+    def test_weak_callbacks_are_fired_once(self):
+        c = mock.MagicMock()
+        d = ThreadSafeDeferred().done_weak(c)
+        d.resolve(1)
+        d.done_weak(c).fail_weak(c)
+        self.assertEqual(c.call_count, 2)
+
+
+    def test_subscriptions_are_removable(self):
+        c = mock.MagicMock()
+        d = ThreadSafeDeferred()
+        d.subscribe(c).remove()
+        d.subscribe_fail(c)
+        d.resolve(1)
+        d.subscribe(c)
+        c.assert_called_once_with(1)
+
+
+if "__main__" == __name__:
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##
+# python standard library
+#
+import threading
+import unittest
+import weakref
+
+##
+# test helpers
+#
+from testutils import mock
+from helpers import Clock
+
+##
+# promise modules
+#
+from promise import Deferred, DeferredTimeoutError, ThreadSafeDeferred, \
+    TimerWheel, when, when_all, when_any, when_race, REJECTED, RESOLVED, \
+    _Race
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1, bits=2, levels=3, clock=self.clock)
+        self.c = mock.MagicMock()
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        return self.wheel.advance()
+
+    def test_timer_is_fired_after_delay(self):
+        self.wheel.schedule(3, self.c, 1, 2)
+        self.advance(2)
+        self.assertEqual(self.c.call_count, 0)
+        self.advance(1)
+        self.c.assert_called_once_with(1, 2)
+
+    def test_timer_is_fired_once(self):
+        self.wheel.schedule(1, self.c)
+        self.advance(1)
+        self.advance(100)
+        self.assertEqual(self.c.call_count, 1)
+
+    def test_timers_from_all_levels_are_fired_in_time(self):
+        # 4 slots per level, 3 levels: delays up to 64 ticks exercise
+        # all levels and cascading
+        for delay in range(1, 80):
+            self.wheel.schedule(delay, self.c, delay)
+        for now in range(1, 80):
+            self.advance(1)
+            self.c.assert_called_once_with(now)
+            self.c.reset_mock()
+
+    def test_timers_are_fired_in_time_when_scheduled_late(self):
+        self.advance(7)
+        self.wheel.schedule(11, self.c)
+        self.advance(10)
+        self.assertEqual(self.c.call_count, 0)
+        self.advance(1)
+        self.c.assert_called_once_with()
+
+    def test_overdue_timers_are_fired_in_single_advance(self):
+        for delay in (1, 5, 20, 60):
+            self.wheel.schedule(delay, self.c, delay)
+        self.assertEqual(self.advance(100), 4)
+        self.assertEqual(self.c.mock_calls, [mock.call(1), mock.call(5),
+            mock.call(20), mock.call(60)])
+
+    def test_zero_delay_is_fired_on_next_tick(self):
+        self.wheel.schedule(0, self.c)
+        self.advance(1)
+        self.c.assert_called_once_with()
+
+    def test_cancelled_timer_is_not_fired(self):
+        timer = self.wheel.schedule(2, self.c)
+        timer.cancel()
+        self.assertFalse(timer.active)
+        self.assertEqual(len(self.wheel), 0)
+        self.advance(10)
+        self.assertEqual(self.c.call_count, 0)
+
+    def test_cancel_accepts_and_ignores_arguments(self):
+        timer = self.wheel.schedule(2, self.c)
+        timer.cancel(1, a=2)
+        timer.cancel()
+        self.advance(10)
+        self.assertEqual(self.c.call_count, 0)
+
+    def test_len_returns_number_of_active_timers(self):
+        self.wheel.schedule(1, self.c)
+        self.wheel.schedule(30, self.c)
+        self.assertEqual(len(self.wheel), 2)
+        self.advance(1)
+        self.assertEqual(len(self.wheel), 1)
+
+    def test_error_in_timer_does_not_stop_remaining_timers(self):
+        self.wheel.schedule(1, mock.MagicMock(side_effect=RuntimeError()))
+        self.wheel.schedule(1, self.c)
+        self.assertRaises(RuntimeError, self.advance, 1)
+        self.c.assert_called_once_with()
+
+    def test_dispatch_is_called_instead_of_callback(self):
+        dispatch = mock.MagicMock()
+        wheel = TimerWheel(tick=1, clock=self.clock, dispatch=dispatch)
+        wheel.schedule(1, self.c, 1)
+        self.clock.now += 1
+        wheel.advance()
+        dispatch.assert_called_once_with(self.c, 1)
+
+    def test_default_returns_shared_wheel(self):
+        self.assertIs(TimerWheel.default(), TimerWheel.default())
+
+
+class Payload(object):
+    """
+    Response that may be referenced weakly
+    """
+
+
+class TimeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1, clock=self.clock)
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.wheel.advance()
+
+    def test_timeout_rejects_pending_deferred(self):
+        c = mock.MagicMock()
+        d = Deferred().timeout(2, self.wheel)
+        d.fail(c)
+        self.advance(2)
+        self.assertEqual(d.state, REJECTED)
+        self.assertIsInstance(c.call_args[0][0], DeferredTimeoutError)
+
+    def test_timer_is_cancelled_on_resolution(self):
+        d = Deferred().timeout(2, self.wheel).resolve(1)
+        self.assertEqual(len(self.wheel), 0)
+        self.advance(2)
+        self.assertEqual(d.state, RESOLVED)
+
+    def test_timeout_on_settled_deferred_does_nothing(self):
+        Deferred().resolve().timeout(2, self.wheel)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_timeout_of_plain_deferred_requires_wheel(self):
+        self.assertRaises(TypeError, Deferred().timeout, 2)
+
+    def test_timeout_uses_default_wheel(self):
+        with mock.patch.object(TimerWheel, 'default',
+                return_value=self.wheel):
+            d = ThreadSafeDeferred().timeout(2)
+        self.advance(2)
+        self.assertEqual(d.state, REJECTED)
+
+    def test_default_wheel_is_advanced_in_background(self):
+        event = threading.Event()
+        ThreadSafeDeferred().timeout(0.02).fail(lambda error: event.set())
+        self.assertTrue(event.wait(5))
+
+    def test_output_of_combinator_is_taken_once(self):
+        fanin = _Race()
+        self.assertFalse(fanin.settle().cancelled)
+        self.assertTrue(fanin.settle().cancelled)
+
+    def test_when_deadline_rejects_output(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        when(d, 1, deadline=2, wheel=self.wheel).fail(c)
+        self.advance(2)
+        self.assertIsInstance(c.call_args[0][0], DeferredTimeoutError)
+
+    def test_when_deadline_detaches_from_inputs(self):
+        d = Deferred()
+        when_all([d], deadline=2, wheel=self.wheel)
+        self.advance(2)
+        self.assertIsNone(d._done_callbacks._callbacks)
+
+    def test_when_deadline_is_cancelled_on_resolution(self):
+        d = Deferred()
+        out = when(d, deadline=2, wheel=self.wheel)
+        d.resolve(1)
+        self.assertEqual(len(self.wheel), 0)
+        self.advance(2)
+        self.assertEqual(out.state, RESOLVED)
+
+    def test_deadline_on_shared_wheel_settles_output_once(self):
+        c = mock.MagicMock()
+        d = Deferred()
+        event = threading.Event()
+        when_race(d, deadline=0.02).fail(c).fail(lambda error: event.set())
+        self.assertTrue(event.wait(5))
+        # inputs are not touched from thread of shared wheel
+        self.assertIsNotNone(d._done_callbacks._callbacks)
+        d.resolve(1)
+        self.assertEqual(c.call_count, 1)
+
+    def test_deadline_on_shared_wheel_drops_collected_responses(self):
+        payload = Payload()
+        ref = weakref.ref(payload)
+        event = threading.Event()
+        (d1, d2) = (Deferred(), Deferred())
+        when(d1, d2, deadline=0.02).fail(lambda error: event.set())
+        d1.resolve(payload)
+        del payload, d1
+        self.assertTrue(event.wait(5))
+        # pending input still refers combinator state
+        self.assertIsNotNone(d2._done_callbacks._callbacks)
+        self.assertIsNone(ref())
+
+    def test_other_combinators_accept_deadline(self):
+        out = when_any(Deferred(), deadline=2, wheel=self.wheel)
+        self.advance(2)
+        self.assertEqual(out.state, REJECTED)
+
+    def test_unknown_keyword_argument_raises_error(self):
+        self.assertRaises(TypeError, when, Deferred(), timeout=2)
+
+
+if "__main__" == __name__:
+    unittest.main()
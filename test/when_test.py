@@ -4,9 +4,18 @@
 ##
 # python standard library
 #
+from concurrent import futures
+import gc
+import sys
+import threading
 import unittest
 from functools import partial
 
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
 ##
 # test helpers
 #
@@ -15,7 +24,10 @@ from testutils import mock, IsA, IsCallable
 ##
 # promise modules
 #
-from promise import when, Promise
+import promise
+from promise import when, when_all, when_any, when_race, when_some, \
+    as_completed, map_limited, Deferred, Promise, Results, \
+    ThreadSafeDeferred, TimerWheel
 
 
 class WhenTestCase(unittest.TestCase):
@@ -318,6 +330,530 @@ class WhenTestCase(unittest.TestCase):
 
         c.assert_called_once_with(2, foo=3)
 
+    def test_when_without_arguments_is_resolved_immediately(self):
+        c = mock.MagicMock()
+        when().done(c)
+        c.assert_called_once_with()
+
+    def test_when_counts_each_input_once(self):
+        cb = []
+        self.d.then = mock.MagicMock(side_effect=lambda ok, err: cb.append(ok))
+
+        p = when(self.d, Deferred())
+        cb[0](1)
+        cb[0](1)
+
+        self.assertFalse(p.resolved)
+
+    def test_when_resolves_with_responses_ordered_by_input(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+
+        when(d1, 'foo', d2).done(c)
+        d2.resolve(2)
+        self.assertEqual(c.call_count, 0)
+        d1.resolve(1, bar=1)
+
+        c.assert_called_once_with(((1, ), {'bar': 1}), (('foo', ), {}),
+                ((2, ), {}))
+
+    def test_when_all_accepts_any_iterable(self):
+        c = mock.MagicMock()
+        inputs = [Deferred() for i in range(0, 10)]
+
+        p = when_all(d for d in inputs).done(c)
+        for (i, d) in enumerate(inputs):
+            self.assertFalse(p.resolved)
+            d.resolve(i)
+
+        self.assertTrue(p.resolved)
+        c.assert_called_once_with(*[((i, ), {}) for i in range(0, 10)])
+
+    def test_when_all_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(when_all([]), Promise))
+
+    def test_when_all_resolves_already_resolved_deferreds_immediately(self):
+        p = when_all(iter([Deferred(1), Deferred(2), 3]))
+        self.assertTrue(p.resolved)
+        self.assertFalse(p.rejected)
+
+
+    def test_when_stops_collecting_responses_after_rejection(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred().done(c)
+
+        p = when(d1, d2)
+        d1.reject(1)
+        d2.resolve(2)
+
+        self.assertTrue(p.rejected)
+        c.assert_called_once_with(2)
+
+    def test_when_detaches_from_pending_inputs_once_settled(self):
+        d1 = Deferred()
+        d2 = Deferred()
+
+        with mock.patch('promise._success') as c:
+            when(d1, d2)
+        d1.reject()
+        d2.resolve()
+
+        self.assertEqual(c.call_count, 0)
+
+
+class WhenResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+
+    def test_output_is_resolved_with_single_Results_object(self):
+        when(1, 2, results=True).done(self.c)
+        results = self.c.call_args[0][0]
+        self.assertEqual(len(self.c.call_args[0]), 1)
+        self.assertTrue(isinstance(results, Results))
+        self.assertEqual(list(results), [1, 2])
+
+    def test_results_are_kept_in_order_of_inputs(self):
+        d1 = Deferred()
+        d2 = Deferred()
+        when(d1, d2, 3, results=True).done(self.c)
+        d2.resolve('b')
+        self.assertEqual(self.c.call_count, 0)
+        d1.resolve('a')
+        results = self.c.call_args[0][0]
+        self.assertEqual(len(results), 3)
+        self.assertEqual((results[0], results[1], results[2]), ('a', 'b', 3))
+        self.assertEqual(results[-1], 3)
+
+    def test_item_is_None_or_tuple_unless_one_argument_was_passed(self):
+        d1 = Deferred()
+        d2 = Deferred()
+        d3 = Deferred()
+        when(d1, d2, d3, results=True).done(self.c)
+        d1.resolve()
+        d2.resolve(1, 2)
+        d3.resolve(3, foo=4)
+        results = self.c.call_args[0][0]
+        self.assertEqual(list(results), [None, (1, 2), 3])
+
+    def test_response_returns_args_and_kwargs(self):
+        d1 = Deferred()
+        d2 = Deferred()
+        when(d1, d2, 5, results=True).done(self.c)
+        d1.resolve(1, foo=2)
+        d2.resolve()
+        results = self.c.call_args[0][0]
+        self.assertEqual(results.response(0), ((1, ), {'foo': 2}))
+        self.assertEqual(results.response(1), ((), {}))
+        self.assertEqual(results.response(2), ((5, ), {}))
+        self.assertEqual(results.response(-3), ((1, ), {'foo': 2}))
+
+    def test_None_is_valid_response(self):
+        d1 = Deferred()
+        d2 = Deferred()
+        p = when(d1, d2, results=True)
+        d1.resolve(None)
+        d1.resolve(None)
+        self.assertFalse(p.resolved)
+        d2.resolve(None)
+        self.assertTrue(p.resolved)
+
+    def test_results_are_passed_to_all_callbacks_by_reference(self):
+        e = mock.MagicMock()
+        when(1, results=True).done(self.c, e)
+        self.assertTrue(self.c.call_args[0][0] is e.call_args[0][0])
+
+    def test_when_all_accepts_generators(self):
+        when_all((i for i in range(0, 3)), results=True).done(self.c)
+        self.assertEqual(list(self.c.call_args[0][0]), [0, 1, 2])
+
+    def test_rejection_is_passed_as_is(self):
+        d = Deferred()
+        when(d, 1, results=True).fail(self.c)
+        d.reject(1, foo=2)
+        self.c.assert_called_once_with(1, foo=2)
+
+    def test_without_inputs_resolves_with_empty_results(self):
+        when(results=True).done(self.c)
+        self.assertEqual(len(self.c.call_args[0][0]), 0)
+
+
+class WhenAnyTestCase(unittest.TestCase):
+
+    def test_when_any_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(when_any(), Promise))
+
+    def test_when_any_resolves_with_response_of_first_resolved_input(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+
+        when_any(d1, d2).done(c)
+        d2.resolve(2, foo=2)
+        d1.resolve(1)
+
+        c.assert_called_once_with(2, foo=2)
+
+    def test_when_any_resolves_non_deferreds_immediately(self):
+        c = mock.MagicMock()
+        when_any(Deferred(), 'foo').done(c)
+        c.assert_called_once_with('foo')
+
+    def test_when_any_ignores_failures_until_all_inputs_rejected(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+
+        p = when_any(d1, d2).fail(c)
+        d1.reject(1)
+        self.assertFalse(p.rejected)
+        d2.reject(2, foo=2)
+
+        c.assert_called_once_with(((1, ), {}), ((2, ), {'foo': 2}))
+
+    def test_when_any_without_arguments_is_rejected(self):
+        self.assertTrue(when_any().rejected)
+
+    def test_when_any_detaches_from_losers(self):
+        d1 = Deferred()
+        d2 = Deferred()
+        d3 = Deferred()
+
+        with mock.patch('promise._success', wraps=promise._success) as c, \
+                mock.patch('promise._failure') as e:
+            when_any(d1, d2, d3)
+        d1.resolve()
+        d2.resolve()
+        d3.reject()
+
+        self.assertEqual(c.call_count, 1)
+        self.assertEqual(e.call_count, 0)
+
+
+class WhenRaceTestCase(unittest.TestCase):
+
+    def test_when_race_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(when_race(), Promise))
+
+    def test_when_race_resolves_like_first_settled_input(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+
+        p = when_race(d1, d2).then(c, c)
+        d1.resolve(1)
+        d2.reject(2)
+
+        self.assertTrue(p.resolved)
+        c.assert_called_once_with(1)
+
+    def test_when_race_rejects_like_first_settled_input(self):
+        c = mock.MagicMock()
+        d1 = Deferred()
+        d2 = Deferred()
+
+        p = when_race(d1, d2).then(c, c)
+        d2.reject(2, foo=2)
+        d1.resolve(1)
+
+        self.assertTrue(p.rejected)
+        c.assert_called_once_with(2, foo=2)
+
+    def test_when_race_without_arguments_never_settles(self):
+        p = when_race()
+        self.assertFalse(p.resolved)
+        self.assertFalse(p.rejected)
+
+
+class WhenSomeTestCase(unittest.TestCase):
+
+    def test_when_some_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(when_some(0), Promise))
+
+    def test_when_some_resolves_once_quorum_is_reached(self):
+        c = mock.MagicMock()
+        inputs = [Deferred() for i in range(0, 3)]
+
+        p = when_some(2, *inputs).done(c)
+        inputs[2].resolve(2)
+        self.assertFalse(p.resolved)
+        inputs[0].resolve(0, foo=0)
+        inputs[1].resolve(1)
+
+        c.assert_called_once_with(((2, ), {}), ((0, ), {'foo': 0}))
+
+    def test_when_some_rejects_once_quorum_can_not_be_reached(self):
+        c = mock.MagicMock()
+        inputs = [Deferred() for i in range(0, 3)]
+
+        p = when_some(2, *inputs).fail(c)
+        inputs[0].resolve(0)
+        inputs[1].reject(1)
+        self.assertFalse(p.rejected)
+        inputs[2].reject(2)
+
+        c.assert_called_once_with(((1, ), {}), ((2, ), {}))
+
+    def test_when_some_rejects_immediately_when_not_enough_inputs(self):
+        self.assertTrue(when_some(2, Deferred()).rejected)
+
+    def test_when_some_counts_non_deferreds_as_resolved(self):
+        self.assertTrue(when_some(2, 1, Deferred(), 2).resolved)
+
+
+class Thenable(object):
+    """
+    Foreign thenable with "then" defined by class
+    """
+
+    def __init__(self):
+        self.callbacks = None
+
+    def then(self, success, error):
+        self.callbacks = (success, error)
+
+
+class Wrapper(object):
+    """
+    Foreign object that has to be adapted to be waited for
+    """
+
+    def __init__(self, deferred):
+        self.deferred = deferred
+
+
+class WhenInputsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.addCleanup(promise._thenables.pop, Wrapper, None)
+        self.addCleanup(promise._kinds.clear)
+
+    def test_immediate_values_are_passed_as_they_are(self):
+        value = Wrapper(None)
+        when(1, 'a', None, value).done(self.c)
+        self.c.assert_called_once_with(((1, ), {}), (('a', ), {}),
+                ((None, ), {}), ((value, ), {}))
+
+    def test_kind_of_input_is_remembered_per_class(self):
+        when(1, Thenable())
+        self.assertEqual(promise._kinds, {int: None, Thenable: promise._then})
+
+    def test_duck_typed_thenables_are_waited_for(self):
+        thenable = Thenable()
+        p = when(thenable).done(self.c)
+        self.assertFalse(p.resolved)
+        thenable.callbacks[0](1)
+        self.c.assert_called_once_with(((1, ), {}))
+
+    def test_errors_raised_by_then_are_propagated(self):
+        thenable = Thenable()
+        thenable.then = mock.MagicMock(side_effect=AttributeError())
+        self.assertRaises(AttributeError, when, thenable)
+
+    def test_registered_thenables_are_adapted(self):
+        promise.register_thenable(Wrapper, lambda wrapper: wrapper.deferred)
+        d = Deferred()
+        p = when(Wrapper(d)).done(self.c)
+        self.assertFalse(p.resolved)
+        d.resolve(1)
+        self.c.assert_called_once_with(((1, ), {}))
+
+    def test_concurrent_futures_are_waited_for(self):
+        future = futures.Future()
+        p = when(future).done(self.c)
+        self.assertFalse(p.resolved)
+        future.set_result(1)
+        self.c.assert_called_once_with(((1, ), {}))
+
+    def test_cancel_cancels_concurrent_futures(self):
+        future = futures.Future()
+        when(future).abandon()
+        self.assertTrue(future.cancelled())
+
+
+class AsCompletedTestCase(unittest.TestCase):
+
+    def test_inputs_are_yielded_in_order_of_settlement(self):
+        inputs = [Deferred() for i in range(0, 3)]
+        completed = as_completed(inputs)
+        inputs[2].resolve()
+        inputs[0].reject()
+        inputs[1].cancel()
+        self.assertEqual(list(completed), [inputs[2], inputs[0], inputs[1]])
+
+    def test_other_inputs_are_yielded_as_settled_deferreds(self):
+        future = futures.Future()
+        future.set_result(2)
+        c = mock.MagicMock()
+        for d in as_completed([1, future]):
+            d.done(c)
+        self.assertEqual(c.mock_calls, [mock.call(1), mock.call(2)])
+
+    def test_iteration_waits_for_inputs_settled_in_other_threads(self):
+        inputs = [ThreadSafeDeferred() for i in range(0, 100)]
+        completed = as_completed(inputs)
+        worker = threading.Thread(target=lambda: [d.resolve(i)
+            for (i, d) in enumerate(reversed(inputs))])
+        worker.start()
+        self.assertEqual(list(completed), list(reversed(inputs)))
+        worker.join()
+
+    def test_yielded_deferreds_are_not_retained(self):
+        d = Deferred()
+        completed = as_completed([1, d])
+        # held only by getrefcount argument
+        self.assertEqual(sys.getrefcount(next(completed)), 1)
+        d.resolve()
+        self.assertTrue(next(completed) is d)
+        self.assertIsNone(d._done_callbacks._callbacks)
+        self.assertEqual(len(completed._ready), 0)
+
+
+class MapLimitedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.c = mock.MagicMock()
+        self.pending = {}
+        self.pulled = []
+
+    def items(self, count):
+        for i in range(0, count):
+            self.pulled.append(i)
+            yield i
+
+    def call(self, item):
+        d = self.pending[item] = Deferred()
+        return d
+
+    def test_map_limited_returns_instance_of_Promise(self):
+        self.assertTrue(isinstance(map_limited(abs, [], 1), Promise))
+
+    def test_items_are_pulled_lazily_up_to_concurrency(self):
+        map_limited(self.call, self.items(10), 3)
+        self.assertEqual(self.pulled, [0, 1, 2])
+        self.pending[1].resolve()
+        self.assertEqual(self.pulled, [0, 1, 2, 3])
+
+    def test_results_are_ordered_just_like_items(self):
+        map_limited(self.call, self.items(3), 2).done(self.c)
+        self.pending[1].resolve('b')
+        self.pending[2].resolve('c')
+        self.pending[0].resolve('a')
+        self.c.assert_called_once_with(['a', 'b', 'c'])
+
+    def test_results_are_ordered_by_resolution_unless_ordered(self):
+        p = map_limited(self.call, self.items(3), 2, ordered=False)
+        p.done(self.c)
+        self.pending[1].resolve('b')
+        self.pending[2].resolve('c')
+        self.pending[0].resolve('a')
+        self.c.assert_called_once_with(['b', 'c', 'a'])
+
+    def test_immediate_results_are_handled_without_recursion(self):
+        map_limited(Deferred, range(0, 100000), 10).done(self.c)
+        self.c.assert_called_once_with(list(range(0, 100000)))
+
+    def test_results_are_not_kept_unless_collected(self):
+        map_limited(self.call, self.items(3), 2, collect=False).done(self.c)
+        for i in range(0, 3):
+            self.pending[i].resolve(i)
+        self.c.assert_called_once_with(None)
+
+    def test_rejection_rejects_output_and_stops_pulling(self):
+        map_limited(self.call, self.items(10), 2).fail(self.c)
+        self.pending[0].reject(1)
+        self.c.assert_called_once_with(1)
+        self.pending[1].resolve()
+        self.assertEqual(self.pulled, [0, 1])
+
+    def test_error_raised_by_function_rejects_output(self):
+        e = RuntimeError()
+        map_limited(mock.MagicMock(side_effect=e), [1], 1).fail(self.c)
+        self.c.assert_called_once_with(e)
+
+    def test_error_raised_by_iterable_rejects_output(self):
+        def items():
+            yield 1
+            raise RuntimeError()
+        p = map_limited(self.call, items(), 1)
+        self.pending[1].resolve()
+        self.assertTrue(p.rejected)
+
+    def test_cancel_cancels_pending_deferreds(self):
+        map_limited(self.call, self.items(10), 2).abandon()
+        self.assertTrue(all(d.cancelled for d in self.pending.values()))
+        self.assertEqual(self.pulled, [0, 1])
+
+    def test_concurrency_has_to_be_positive(self):
+        self.assertRaises(ValueError, map_limited, abs, [], 0)
+
+
+class WhenCancelTestCase(unittest.TestCase):
+
+    def test_cancel_cancels_inputs(self):
+        inputs = [Deferred() for i in range(0, 3)]
+        when(*inputs).abandon()
+        self.assertTrue(all(d.cancelled for d in inputs))
+
+    def test_cancel_detaches_from_inputs_used_elsewhere(self):
+        c = mock.MagicMock()
+        d = Deferred().done(c)
+        when(d, Deferred()).abandon()
+        self.assertFalse(d.cancelled)
+        self.assertEqual(d._done_callbacks._callbacks, [c])
+
+    def test_cancel_cancels_inputs_with_timeout(self):
+        wheel = TimerWheel()
+        d = Deferred().timeout(10, wheel)
+        when(d, Deferred()).abandon()
+        self.assertTrue(d.cancelled)
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel_reaches_producer(self):
+        c = mock.MagicMock()
+        when_any(Deferred().on_cancel(c), 1).abandon()
+        self.assertEqual(c.call_count, 0)
+        when_any(Deferred().on_cancel(c)).abandon()
+        c.assert_called_once_with()
+
+    def test_cancel_propagates_to_promise_inputs(self):
+        d = Deferred()
+        when_race(d.promise()).abandon()
+        self.assertTrue(d.cancelled)
+
+    def test_cancel_of_derived_deferred_cancels_inputs(self):
+        d = Deferred()
+        when(d).then(None, None, chain=True).cancel()
+        self.assertTrue(d.cancelled)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_cancelled_fanins_are_released_immediately(self):
+        inputs = [Deferred().done(len) for i in range(0, 2)]
+        gc.collect()
+        enabled = gc.isenabled()
+        gc.disable()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(0, 100000):
+                when(*inputs).abandon()
+            # released by reference counting, no garbage collection needed
+            retained = [o for o in gc.get_objects()
+                    if isinstance(o, promise._Fanin)]
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+            if enabled:
+                gc.enable()
+        self.assertEqual(retained, [])
+        self.assertEqual(gc.collect(), 0)
+        self.assertLess(after - before, 10000)
+        self.assertEqual([d._done_callbacks._callbacks for d in inputs],
+                [[len], [len]])
+
 
 if "__main__" == __name__:
     unittest.main()